@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 
-from .models import Company, Phone, Email, Manager, User, Project, Interaction, Customer, ManagerCRM
+from .models import Company, Phone, Email, Manager, User, Project, Interaction, Customer, ManagerCRM, \
+    RevenueSummary
 from django.contrib.auth.admin import UserAdmin
 
 
@@ -100,3 +101,19 @@ class ManagerCRMAdmin(admin.ModelAdmin):
     list_display = ('user', 'name')
 
 
+@admin.register(RevenueSummary)
+class RevenueSummaryAdmin(admin.ModelAdmin):
+    list_display = ('month', 'company', 'status_pro', 'projects', 'revenue')
+    list_filter = ('status_pro',)
+    list_select_related = ('company',)
+    date_hierarchy = 'month'
+    search_fields = ('company__title',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,205 @@
+import hashlib
+import time
+
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import View
+
+from crm.cache import get_table_state
+from crm.models import Company, Project, Interaction, Customer, ManagerCRM
+from crm.pagination import CursorPaginator
+
+
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+
+class ApiError(Exception):
+    """
+    Исключение ApiError - ошибка в параметрах запроса к API, ответ 400 с текстом ошибки.
+    """
+
+
+class ApiView(View):
+    """
+    Класс ApiView - JSON-ресурс API только для чтения: список (курсорная пагинация ?after=, ?limit=,
+    сортировка ?sort=) и объект по pk. Поля ответа выбираются параметром ?fields= и загружаются
+    через only(); связанные объекты (relations) встраиваются в ответ и загружаются select_related.
+    ETag и Last-Modified вычисляются по версиям таблиц ресурса в кэше (crm.cache), поэтому
+    на неизменившийся ресурс с If-None-Match или If-Modified-Since отвечает 304 без запросов к базе данных.
+    Last-Modified отдается с точностью до секунды, поэтому только после окончания секунды последней
+    записи: запись позже в ту же секунду иначе получила бы ту же дату, и клиент - 304 со старыми данными.
+    API доступен менеджерам и администраторам.
+    """
+    model = None
+    fields = ()
+    relations = {}
+    ordering_fields = ('id',)
+    default_ordering = 'id'
+
+    def get_fields(self):
+        """
+        Возвращает запрошенные поля ответа (по умолчанию - все), id всегда включается.
+        """
+        allowed = ('id',) + self.fields + tuple(self.relations)
+        requested = self.request.GET.get('fields')
+        if not requested:
+            return allowed
+        names = [name.strip() for name in requested.split(',') if name.strip()]
+        unknown = [name for name in names if name not in allowed]
+        if unknown:
+            raise ApiError('Неизвестные поля: %s' % ', '.join(unknown))
+        return ('id',) + tuple(name for name in allowed if name in names and name != 'id')
+
+    def get_ordering(self):
+        """
+        Возвращает сортировку списка из параметра ?sort=.
+        """
+        ordering = self.request.GET.get('sort', self.default_ordering)
+        if ordering.lstrip('-') not in self.ordering_fields:
+            raise ApiError('Сортировка возможна по полям: %s' % ', '.join(self.ordering_fields))
+        return ordering
+
+    def get_limit(self):
+        """
+        Возвращает размер страницы из параметра ?limit= (не больше API_MAX_PAGE_SIZE).
+        """
+        limit = self.request.GET.get('limit', '')
+        return min(int(limit), API_MAX_PAGE_SIZE) if limit.isdigit() and int(limit) > 0 else API_PAGE_SIZE
+
+    def get_queryset(self, fields):
+        """
+        Возвращает queryset ресурса, загружающий только поля fields и встроенные связанные объекты.
+        """
+        relations = [name for name in fields if name in self.relations]
+        only = [name for name in fields if name not in self.relations] + relations
+        only += ['%s__%s' % (name, field) for name in relations for field in self.relations[name]]
+        return self.model.objects.select_related(*relations).only(*only)
+
+    def get_tables(self, fields):
+        """
+        Возвращает таблицы, от которых зависит ответ с полями fields.
+        """
+        tables = [self.model._meta.db_table]
+        for name in fields:
+            if name in self.relations:
+                tables.append(self.model._meta.get_field(name).related_model._meta.db_table)
+        return tables
+
+    def serialize(self, obj, fields):
+        """
+        Возвращает словарь полей fields объекта obj.
+        """
+        data = {}
+        for name in fields:
+            if name in self.relations:
+                related = getattr(obj, name)
+                data[name] = None if related is None else \
+                    {field: getattr(related, field) for field in self.relations[name]}
+            else:
+                data[name] = getattr(obj, name)
+        return data
+
+    def get_list(self, fields):
+        """
+        Возвращает страницу списка: {'results': [...], 'next': адрес следующей страницы или None}.
+        """
+        paginator = CursorPaginator(self.get_queryset(fields).order_by(self.get_ordering()), self.get_limit())
+        page = paginator.page(self.request.GET.get('after') or None)
+        next_url = None
+        if page.has_next():
+            params = self.request.GET.copy()
+            params['after'] = page.next_cursor
+            next_url = '%s?%s' % (self.request.path, params.urlencode())
+        return {'results': [self.serialize(obj, fields) for obj in page], 'next': next_url}
+
+    def get(self, request, pk=None):
+        """
+        Возвращает JSON списка или объекта pk либо 304, если ресурс не изменился.
+        """
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Требуется вход в систему'}, status=401)
+        if not (request.user.is_manager or request.user.is_admin):
+            return JsonResponse({'error': 'Доступ только для менеджеров и администраторов'}, status=403)
+        try:
+            fields = self.get_fields()
+            if pk is None:
+                self.get_ordering()
+        except ApiError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        versions, modified = get_table_state(self.get_tables(fields))
+        signature = repr((request.get_full_path(), sorted(versions.items())))
+        etag = quote_etag(hashlib.md5(signature.encode()).hexdigest())
+        last_modified = int(modified) if modified is not None else None
+        if last_modified is not None and last_modified >= int(time.time()):
+            last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            if pk is None:
+                response = JsonResponse(self.get_list(fields))
+            else:
+                response = JsonResponse(self.serialize(get_object_or_404(self.get_queryset(fields), pk=pk), fields))
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class CompanyApiView(ApiView):
+    """
+    Класс ресурса API компаний.
+    """
+    model = Company
+    fields = ('title', 'leader_name', 'address', 'description', 'created_date', 'updated_date',
+              'projects_not_started', 'projects_in_process', 'projects_completed',
+              'interactions_phone', 'interactions_email', 'interactions_messenger', 'last_interaction_date')
+    ordering_fields = ('id', 'title', 'created_date', 'updated_date')
+    default_ordering = 'title'
+
+
+class ProjectApiView(ApiView):
+    """
+    Класс ресурса API проектов.
+    """
+    model = Project
+    fields = ('name', 'description', 'start_date', 'end_date', 'price', 'status_pro', 'updated_date')
+    relations = {'company': ('id', 'title'), 'customer': ('id', 'name')}
+    ordering_fields = ('id', 'name', 'start_date', 'end_date', 'price', 'company', 'updated_date')
+    default_ordering = 'start_date'
+
+
+class InteractionApiView(ApiView):
+    """
+    Класс ресурса API взаимодействий.
+    """
+    model = Interaction
+    fields = ('channel_of_reference', 'reference_obj', 'created_date', 'updated_date', 'description', 'rating')
+    relations = {'project': ('id', 'name'), 'company': ('id', 'title'), 'customer': ('id', 'name'),
+                 'user': USER_FIELDS}
+    ordering_fields = ('id', 'created_date', 'updated_date', 'project', 'channel_of_reference')
+    default_ordering = '-created_date'
+
+
+class CustomerApiView(ApiView):
+    """
+    Класс ресурса API заказчиков.
+    """
+    model = Customer
+    fields = ('name', 'gender')
+    relations = {'user': USER_FIELDS}
+    ordering_fields = ('id', 'name')
+
+
+class ManagerCRMApiView(ApiView):
+    """
+    Класс ресурса API CRM-менеджеров.
+    """
+    model = ManagerCRM
+    fields = ('name', 'gender')
+    relations = {'user': USER_FIELDS}
+    ordering_fields = ('id', 'name')
@@ -0,0 +1,21 @@
+from django.urls import path
+from .api import \
+    CompanyApiView, \
+    ProjectApiView, \
+    InteractionApiView, \
+    CustomerApiView, \
+    ManagerCRMApiView
+
+
+urlpatterns = [
+    path('companies/', CompanyApiView.as_view(), name='api_companies'),
+    path('companies/<int:pk>/', CompanyApiView.as_view(), name='api_company'),
+    path('projects/', ProjectApiView.as_view(), name='api_projects'),
+    path('projects/<int:pk>/', ProjectApiView.as_view(), name='api_project'),
+    path('interactions/', InteractionApiView.as_view(), name='api_interactions'),
+    path('interactions/<int:pk>/', InteractionApiView.as_view(), name='api_interaction'),
+    path('customers/', CustomerApiView.as_view(), name='api_customers'),
+    path('customers/<int:pk>/', CustomerApiView.as_view(), name='api_customer'),
+    path('manager_crm/', ManagerCRMApiView.as_view(), name='api_manager_crm_list'),
+    path('manager_crm/<int:pk>/', ManagerCRMApiView.as_view(), name='api_manager_crm'),
+]
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CrmConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'crm'
+
+    def ready(self):
+        """
+        Подключает обработчики сигналов моделей.
+        """
+        from crm import signals  # noqa: F401
@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.exceptions import ValidationError
+
+from crm.objectcache import object_cache
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Класс CachedModelBackend - ModelBackend, который загружает пользователя сессии из кэша объектов
+    (crm.objectcache) вместо запроса к таблице пользователей на каждый запрос. Запись кэша привязана
+    к версии пользователя, которую увеличивает сохранение User (crm.signals), поэтому изменение профиля,
+    прав и пароля (а значит, и хеша сессии) видно со следующего запроса во всех процессах.
+    """
+
+    def get_user(self, user_id):
+        """
+        Возвращает активного пользователя user_id из кэша объектов или None.
+        """
+        model = get_user_model()
+        try:
+            user = object_cache.get(model, model._meta.pk.to_python(user_id))
+        except (model.DoesNotExist, ValidationError):
+            return None
+        return user if self.user_can_authenticate(user) else None
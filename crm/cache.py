@@ -0,0 +1,146 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+CUSTOMER_PROJECTS_TIMEOUT = 60 * 15
+COUNT_TIMEOUT = 60 * 5
+
+
+def get_version(name):
+    """
+    Возвращает номер версии name. Ключи кэша, в которые входит версия, становятся недействительными
+    после bump_version(name). Начальная версия берется из времени, чтобы после вытеснения счетчика
+    из кэша не совпасть со старыми ключами.
+    """
+    return cache.get_or_set('version:%s' % name, time.time_ns, None)
+
+
+def get_versions(names):
+    """
+    Возвращает словарь {name: версия} для нескольких name одним обращением к кэшу.
+    """
+    keys = {'version:%s' % name: name for name in names}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for name in set(names) - set(versions):
+        versions[name] = get_version(name)
+    return versions
+
+
+def bump_version(name):
+    """
+    Увеличивает номер версии name.
+    """
+    key = 'version:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def customer_projects_key(user_id, ordering):
+    """
+    Возвращает ключ кэша списка проектов заказчика (пользователя user_id) с сортировкой ordering.
+    В ключ входит номер версии, который увеличивается при изменении любого проекта заказчика.
+    """
+    version = get_version('customer_projects:%s' % user_id)
+    return 'customer_projects:%s:%s:%s' % (user_id, version, ordering)
+
+
+def invalidate_customer_projects(user_id):
+    """
+    Делает недействительными все закэшированные списки проектов заказчика (пользователя user_id).
+    """
+    bump_version('customer_projects:%s' % user_id)
+
+
+def customer_projects_timeout(projects):
+    """
+    Возвращает время жизни кэша списка проектов: не дольше CUSTOMER_PROJECTS_TIMEOUT
+    и не дольше ближайшей смены статуса (начала или окончания) одного из проектов списка.
+    """
+    now = timezone.now()
+    boundaries = [project.start_date for project in projects if project.start_date > now] + \
+                 [project.end_date for project in projects if project.end_date >= now]
+    if not boundaries:
+        return CUSTOMER_PROJECTS_TIMEOUT
+    return min(CUSTOMER_PROJECTS_TIMEOUT, int((min(boundaries) - now).total_seconds()) + 1)
+
+
+def status_count_timeout(change, now):
+    """
+    Возвращает время жизни закэшированного количества проектов с заданным статусом на момент now:
+    не дольше COUNT_TIMEOUT и не дольше ближайшей смены статуса change одного из проектов (None - смен нет).
+    """
+    if change is None:
+        return COUNT_TIMEOUT
+    return min(COUNT_TIMEOUT, int((change - now).total_seconds()) + 1)
+
+
+def bump_table(table):
+    """
+    Увеличивает версию таблицы table и запоминает время ее изменения.
+    """
+    bump_version('table:%s' % table)
+    cache.set('modified:table:%s' % table, time.time(), None)
+
+
+def invalidate_table(table):
+    """
+    Делает недействительными закэшированные количества строк всех запросов к таблице table и ETag
+    ответов API, построенных по ней. В транзакции версия увеличивается еще раз после фиксации:
+    ответ, построенный другим процессом между записью и фиксацией, видел новую версию и старые данные.
+    """
+    bump_table(table)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump_table(table))
+
+
+def object_version_name(model, pk):
+    """
+    Возвращает имя версии объекта pk модели model, которая увеличивается при его изменении
+    и изменении того, что отображается вместе с ним (см. crm.signals).
+    """
+    return 'object:%s:%s' % (model._meta.label_lower, pk)
+
+
+def invalidate_object(model, pk):
+    """
+    Делает недействительными закэшированные фрагменты шаблонов с объектом pk модели model.
+    В транзакции версия увеличивается еще раз после фиксации, как в invalidate_table.
+    """
+    name = object_version_name(model, pk)
+    bump_version(name)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump_version(name))
+
+
+def publish(channel, message):
+    """
+    Публикует message в канале channel для других процессов, если бэкенд кэша поддерживает каналы
+    (crm.sqlite_cache.SQLiteCache). Без общего кэша процесс один на кэш, и публиковать некому.
+    """
+    if hasattr(cache, 'publish'):
+        cache.publish(channel, message)
+
+
+def receive(channel, after=None):
+    """
+    Возвращает (номер последнего сообщения, сообщения канала channel после сообщения after), см. publish.
+    """
+    if hasattr(cache, 'receive'):
+        return cache.receive(channel, after)
+    return after or 0, []
+
+
+def get_table_state(tables):
+    """
+    Возвращает (версии таблиц tables, время последнего изменения любой из них или None, если оно неизвестно)
+    двумя обращениями к кэшу, без запросов к базе данных.
+    """
+    versions = get_versions(['table:%s' % table for table in tables])
+    modified = cache.get_many(['modified:table:%s' % table for table in tables])
+    last_modified = max(modified.values()) if len(modified) == len(set(tables)) else None
+    return versions, last_modified
@@ -0,0 +1,106 @@
+from collections import Counter
+
+from django.db.models import Count, F, Max, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from crm.cache import invalidate_table, invalidate_object
+from crm.models import Company, Project, Interaction
+
+
+STATUS_COUNTERS = {
+    Project.status_not_started: 'projects_not_started',
+    Project.status_in_process: 'projects_in_process',
+    Project.status_completed: 'projects_completed',
+}
+
+CHANNEL_COUNTERS = {
+    Interaction.channel_phone: 'interactions_phone',
+    Interaction.channel_email: 'interactions_email',
+    Interaction.channel_messenger: 'interactions_messenger',
+}
+
+COUNTER_FIELDS = list(STATUS_COUNTERS.values()) + list(CHANNEL_COUNTERS.values()) + ['last_interaction_date']
+
+
+def change_counter(company_id, field, delta):
+    """
+    Изменяет счетчик field компании company_id на delta одним UPDATE без чтения строки.
+    Счетчик не опускается ниже нуля: строки, записанные в обход сигналов (bulk_create, update),
+    в счетчиках не учтены до пересчета командой recompute_company_counters.
+    UPDATE не отправляет сигналы, поэтому версии таблицы компаний и компании (см. crm.cache)
+    увеличиваются явно. Счетчики отображаются на странице компании, поэтому обновляется
+    и дата ее изменения (Last-Modified страницы).
+    """
+    if company_id is not None and field is not None and delta:
+        Company.objects.filter(pk=company_id).update(updated_date=timezone.now(),
+                                                     **{field: Greatest(F(field) + delta, 0)})
+        invalidate_table(Company._meta.db_table)
+        invalidate_object(Company, company_id)
+
+
+def touch_last_interaction(company_id, date):
+    """
+    Сдвигает дату последнего взаимодействия компании company_id на date, если date позже.
+    """
+    if company_id is not None and date is not None:
+        if Company.objects.filter(Q(last_interaction_date__lt=date) | Q(last_interaction_date__isnull=True),
+                                  pk=company_id).update(last_interaction_date=date, updated_date=timezone.now()):
+            invalidate_table(Company._meta.db_table)
+            invalidate_object(Company, company_id)
+
+
+def refresh_last_interaction(company_id):
+    """
+    Пересчитывает дату последнего взаимодействия компании company_id (после удаления или переноса).
+    """
+    if company_id is not None:
+        last = Interaction.objects.filter(company_id=company_id).aggregate(last=Max('created_date'))['last']
+        Company.objects.filter(pk=company_id).update(last_interaction_date=last, updated_date=timezone.now())
+        invalidate_table(Company._meta.db_table)
+        invalidate_object(Company, company_id)
+
+
+def apply_status_transitions(rows, status):
+    """
+    Переносит в счетчиках компаний проекты в статус status по строкам GROUP BY переходящих проектов
+    rows ({'company_id', 'status_pro', 'n'}, строки с одинаковыми компанией и статусом суммируются).
+    Вызывается до массового UPDATE статуса: по UPDATE на компанию и статус.
+    """
+    moved = Counter()
+    for row in rows:
+        moved[row['company_id'], row['status_pro']] += row['n']
+    for (company_id, status_pro), count in moved.items():
+        change_counter(company_id, STATUS_COUNTERS.get(status_pro), -count)
+        change_counter(company_id, STATUS_COUNTERS[status], count)
+
+
+def recompute_counters(company_ids):
+    """
+    Пересчитывает все счетчики компаний company_ids двумя GROUP BY и одним bulk_update
+    (дата изменения компаний тоже обновляется).
+    :return: количество обновленных компаний
+    """
+    values = {pk: dict.fromkeys(COUNTER_FIELDS, 0) for pk in company_ids}
+    for company in values.values():
+        company['last_interaction_date'] = None
+    projects = Project.objects.filter(company_id__in=company_ids).order_by()\
+        .values('company_id', 'status_pro').annotate(n=Count('pk'))
+    for row in projects:
+        if row['status_pro'] in STATUS_COUNTERS:
+            values[row['company_id']][STATUS_COUNTERS[row['status_pro']]] = row['n']
+    interactions = Interaction.objects.filter(company_id__in=company_ids).order_by()\
+        .values('company_id', 'channel_of_reference').annotate(n=Count('pk'), last=Max('created_date'))
+    for row in interactions:
+        company = values[row['company_id']]
+        if row['channel_of_reference'] in CHANNEL_COUNTERS:
+            company[CHANNEL_COUNTERS[row['channel_of_reference']]] = row['n']
+        if company['last_interaction_date'] is None or row['last'] > company['last_interaction_date']:
+            company['last_interaction_date'] = row['last']
+    now = timezone.now()
+    companies = [Company(pk=pk, updated_date=now, **fields) for pk, fields in values.items()]
+    Company.objects.bulk_update(companies, COUNTER_FIELDS + ['updated_date'])
+    invalidate_table(Company._meta.db_table)
+    for pk in values:
+        invalidate_object(Company, pk)
+    return len(companies)
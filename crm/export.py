@@ -0,0 +1,169 @@
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from crm.text import html_to_text
+
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+INVALID_XML_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>')
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>')
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="%s" sheetId="1" r:id="rId1"/></sheets></workbook>')
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '</Relationships>')
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+
+def export_value(value):
+    """
+    Возвращает значение ячейки выгрузки: дату - строкой в текущем часовом поясе, None - пустой строкой.
+    Перед текстом, который Excel счел бы формулой (FORMULA_PREFIXES), ставится апостроф: введенный
+    пользователями текст не выполняется при открытии файла.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime('%d.%m.%Y %H:%M')
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def export_rows(queryset, fields, html_fields=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Возвращает генератор строк выгрузки queryset: значения полей fields (в том числе через связи,
+    например company__title) одним SELECT с JOIN, читаемым пачками по chunk_size без создания
+    объектов моделей. HTML полей html_fields (CKEditor) преобразуется в текст.
+    """
+    html = [field in html_fields for field in fields]
+    for row in queryset.values_list(*fields).iterator(chunk_size=chunk_size):
+        yield [export_value(html_to_text(value) if is_html else value) for value, is_html in zip(row, html)]
+
+
+def csv_chunks(headers, rows):
+    """
+    Возвращает генератор байтов CSV в UTF-8 с BOM (чтобы Excel распознал кодировку) кусками
+    около EXPORT_BUFFER_SIZE: заголовок отправляется сразу, память не зависит от числа строк.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(headers)
+    yield buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_BUFFER_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+class StreamBuffer:
+    """
+    Класс StreamBuffer - файл только для записи, из которого генератор забирает записанные байты.
+    У него нет tell() и seek(), поэтому zipfile пишет архив потоком, с дескрипторами данных.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """
+        Возвращает и забывает записанные байты.
+        """
+        data, self.chunks, self.size = b''.join(self.chunks), [], 0
+        return data
+
+
+def xlsx_cell(value):
+    """
+    Возвращает XML ячейки листа: число или строку (inlineStr, без таблицы общих строк и стилей).
+    """
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return '<c><v>%s</v></c>' % value
+    text = escape(INVALID_XML_RE.sub('', str(value)))
+    return '<c t="inlineStr"><is><t xml:space="preserve">%s</t></is></c>' % text
+
+
+def xlsx_row(values):
+    """
+    Возвращает XML строки листа.
+    """
+    return '<row>%s</row>' % ''.join(xlsx_cell(value) for value in values)
+
+
+def xlsx_chunks(headers, rows, sheet_name='Лист1'):
+    """
+    Возвращает генератор байтов книги XLSX из одного листа кусками около EXPORT_BUFFER_SIZE.
+    Архив собирается потоком из zipfile стандартной библиотеки: служебные части и заголовок
+    отправляются сразу, строки листа сжимаются по мере чтения, память не зависит от числа строк.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', XLSX_ROOT_RELS)
+        archive.writestr('xl/workbook.xml', XLSX_WORKBOOK % escape(sheet_name, {'"': '&quot;'}))
+        archive.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS)
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write((XLSX_SHEET_START + xlsx_row(headers)).encode())
+            yield buffer.take()
+            for row in rows:
+                sheet.write(xlsx_row(row).encode())
+                if buffer.size >= EXPORT_BUFFER_SIZE:
+                    yield buffer.take()
+            sheet.write(XLSX_SHEET_END.encode())
+    yield buffer.take()
+
+
+EXPORT_WRITERS = {'csv': csv_chunks, 'xlsx': xlsx_chunks}
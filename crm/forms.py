@@ -2,72 +2,116 @@ from django import forms
 from django.core.exceptions import ValidationError
 from .models import Company, Phone, Email, Manager, Project, Interaction, ManagerCRM, User, Customer
 from ckeditor.widgets import CKEditorWidget
-from django.forms.models import inlineformset_factory
+from django.forms.models import BaseInlineFormSet, inlineformset_factory
+from .importer import IMPORT_FORMATS
 
 
-class CompanyModelForm(forms.ModelForm):
+class ConstraintErrorsMixin:
+    """
+    Класс-примесь для ModelForm: уникальность и другие ограничения проверяет база данных при сохранении,
+    а не отдельные SELECT перед ним. add_constraint_error() превращает IntegrityError в ошибку поля
+    по имени нарушенного ограничения или индекса (constraint_errors).
+    """
+    constraint_errors = {}
+
+    def validate_unique(self):
+        """
+        Не проверяет уникальность запросами: ее проверяют уникальные индексы при сохранении.
+        """
+
+    def add_constraint_error(self, error):
+        """
+        Добавляет в форму ошибку поля для нарушенного ограничения из constraint_errors.
+        :return: False, если ограничение формы не известно
+        """
+        message = str(error)
+        for constraint, (field, text) in self.constraint_errors.items():
+            if constraint in message:
+                self.add_error(field, text)
+                return True
+        return False
+
+
+class CompanyModelForm(ConstraintErrorsMixin, forms.ModelForm):
     """
     Класс по созданию формы для модели Company.
     """
+    constraint_errors = {
+        'company_title_lower_uniq': ('title', 'Введите уникальное название'),
+    }
+
     class Meta:
         """
         Отображает поля из модели в форме.
         """
         model = Company
-        fields = '__all__'
+        fields = ['title', 'leader_name', 'description', 'address']
 
-    def clean_title(self):
-        """
-        Проверяет валидность названия компании.
-        """
-        title = self.cleaned_data.get('title')
 
-        qs = Company.objects.filter(title__iexact=title)
-        if self.instance is not None:
-            qs = qs.exclude(pk=self.instance.pk)
-        if qs.exists():
-            raise forms.ValidationError('Введите уникальное название')
-        return title
+class LoadedObjectField(forms.ModelChoiceField):
+    """
+    Класс LoadedObjectField - скрытое поле первичного ключа строки формсета, которое находит объект
+    среди строк, загруженных формсетом одним запросом, а не запросом на каждую строку, как ModelChoiceField.
+    Заодно строка формсета не может сослаться на объект, не принадлежащий формсету.
+    """
 
+    def __init__(self, formset, **kwargs):
+        super().__init__(formset.model._default_manager.none(), **kwargs)
+        self.formset = formset
 
-PhoneFormSet = inlineformset_factory(Company, Phone,
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            obj = self.formset._existing_object(self.formset.model._meta.pk.to_python(value))
+        except ValidationError:
+            obj = None
+        if obj is None:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+        return obj
+
+
+class ContactFormSet(BaseInlineFormSet):
+    """
+    Класс формсета контактов компании, который проверяет строки без запроса на каждую строку.
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        name = self.model._meta.pk.name
+        if form.is_bound and name in form.fields:
+            field = form.fields[name]
+            form.fields[name] = LoadedObjectField(self, initial=field.initial, required=False, widget=field.widget)
+
+
+PhoneFormSet = inlineformset_factory(Company, Phone, formset=ContactFormSet,
                                         fields=['phone_number'],
                                         can_delete=False, extra=2)
 
-EmailFormSet = inlineformset_factory(Company, Email,
+EmailFormSet = inlineformset_factory(Company, Email, formset=ContactFormSet,
                                         fields=['email_address'],
                                         can_delete=False, extra=2)
 
-ManagerFormSet = inlineformset_factory(Company, Manager,
+ManagerFormSet = inlineformset_factory(Company, Manager, formset=ContactFormSet,
                                         fields=['manager_name'],
                                         can_delete=False, extra=2)
 
 
-class ProjectModelForm(forms.ModelForm):
+class ProjectModelForm(ConstraintErrorsMixin, forms.ModelForm):
     """
     Класс по созданию формы для модели Project.
     """
+    constraint_errors = {
+        'project_name_lower_uniq': ('name', 'Введите уникальное название'),
+        'project_dates_check': ('end_date', 'Дата окончания проекта не может быть раньше даты начала проекта'),
+    }
 
     class Meta:
         """
         Отображает поля из модели в форме.
         """
         model = Project
-        fields = ['company', 'name', 'description', 'start_date', 'end_date', 'price']
-
-
-    def clean_title(self):
-        """
-        Проверяет валидность названия проекта.
-        """
-        name = self.cleaned_data.get('name')
-
-        qs = Project.objects.filter(title__iexact=name)
-        if self.instance is not None:
-            qs = qs.exclude(pk=self.instance.pk)
-        if qs.exists():
-            raise forms.ValidationError('Введите уникальное название')
-        return name
+        fields = ['company', 'name', 'customer', 'description', 'start_date', 'end_date', 'price']
 
 
 class InteractionModelForm(forms.ModelForm):
@@ -105,3 +149,26 @@ ManagerCRMFormSet = inlineformset_factory(User, ManagerCRM,
 CustomerFormSet = inlineformset_factory(User, Customer,
                                         fields=['name'],
                                         can_delete=False, extra=0)
+
+
+class CompanyImportForm(forms.Form):
+    """
+    Класс формы загрузки файла CSV или JSONL для импорта компаний (см. crm.importer).
+    """
+    file = forms.FileField(label='Файл', help_text='―CSV или JSONL в UTF-8')
+
+    def clean_file(self):
+        """
+        Проверяет расширение загруженного файла.
+        """
+        file = self.cleaned_data['file']
+        if self.get_format(file) not in IMPORT_FORMATS:
+            raise ValidationError('Загрузите файл .csv или .jsonl')
+        return file
+
+    @staticmethod
+    def get_format(file):
+        """
+        Возвращает формат файла по его расширению.
+        """
+        return file.name.rsplit('.', 1)[-1].lower()
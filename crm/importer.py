@@ -0,0 +1,268 @@
+import csv
+import io
+import json
+from functools import partial
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from crm.cache import invalidate_table, invalidate_object
+from crm.models import Company, Phone, Email, Manager, SearchDocument, fold_title
+from crm.search import make_document
+from crm.typeahead import typeahead_index
+
+
+BATCH_SIZE = 1000
+MAX_ERRORS = 100
+RETRIES = 3
+LIST_SEPARATOR = ';'
+
+COMPANY_FIELDS = ('title', 'leader_name', 'address', 'description')
+CONTACT_SOURCES = (
+    ('phones', Phone, 'phone_number'),
+    ('emails', Email, 'email_address'),
+    ('managers', Manager, 'manager_name'),
+)
+IMPORT_FORMATS = ('csv', 'jsonl')
+
+
+class ImportResult:
+    """
+    Класс ImportResult содержит итоги импорта: количество созданных и обновленных компаний,
+    количество отклоненных строк и первые MAX_ERRORS ошибок в виде (номер строки, текст).
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.rejected = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        """
+        Учитывает отклоненную строку line.
+        """
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, message))
+
+
+def split_list(value):
+    """
+    Возвращает список значений вложенного поля: список из JSON или строку CSV через LIST_SEPARATOR.
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    return [str(item).strip() for item in value if str(item).strip()]
+
+
+def read_csv(stream):
+    """
+    Читает компании из текстового потока CSV с заголовком title, leader_name, address, description,
+    phones, emails, managers (несколько телефонов, e-mail и контактных лиц - через ";").
+    :return: генератор пар (номер строки, словарь)
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def read_jsonl(stream):
+    """
+    Читает компании из текстового потока JSONL: по объекту в строке с полями как в CSV,
+    phones, emails и managers - списки или строки через ";".
+    :return: генератор пар (номер строки, словарь); некорректный JSON - словарь с ключом 'error'
+    """
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as error:
+            row = {'error': 'Некорректный JSON: %s' % error}
+        if not isinstance(row, dict):
+            row = {'error': 'Строка должна быть объектом JSON'}
+        yield line, row
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def clean_row(row):
+    """
+    Проверяет строку импорта валидаторами полей моделей (длина, обязательность, формат телефона
+    и e-mail) и возвращает (поля компании, {вложенное поле: список значений}).
+    Описание необязательно.
+    :raise ValidationError: если строка некорректна
+    """
+    if 'error' in row:
+        raise ValidationError(row['error'])
+    errors, company = [], {}
+    for name in COMPANY_FIELDS:
+        value = (row.get(name) or '').strip()
+        if name == 'description' and not value:
+            company[name] = ''
+            continue
+        try:
+            company[name] = Company._meta.get_field(name).clean(value, None)
+        except ValidationError as error:
+            errors.append('%s: %s' % (name, ' '.join(error.messages)))
+    contacts = {}
+    for key, model, field_name in CONTACT_SOURCES:
+        field = model._meta.get_field(field_name)
+        contacts[key] = []
+        for value in split_list(row.get(key)):
+            try:
+                contacts[key].append(field.clean(value, None))
+            except ValidationError as error:
+                errors.append('%s: %s (%s)' % (key, ' '.join(error.messages), value))
+    if errors:
+        raise ValidationError('; '.join(errors))
+    return company, contacts
+
+
+def existing_companies(keys):
+    """
+    Возвращает {название для сравнения: pk} компаний, название которых совпадает с одним из keys
+    (названий для сравнения, см. crm.models.fold_title) без учета регистра в любом алфавите
+    (по индексу title_key).
+    """
+    return dict(Company.objects.filter(title_key__in=keys).order_by().values_list('title_key', 'pk'))
+
+
+def update_companies(companies):
+    """
+    Обновляет поля COMPANY_FIELDS, название для сравнения, очищенный HTML и выдержку описания и дату изменения компаний одним executemany UPDATE ... WHERE id = %s:
+    bulk_update строит CASE WHEN по каждой строке и на больших пачках в несколько раз медленнее.
+    """
+    quote = connection.ops.quote_name
+    fields = [Company._meta.get_field(name)
+              for name in COMPANY_FIELDS + ('title_key', 'description_html', 'description_excerpt', 'updated_date')]
+    sql = 'UPDATE %s SET %s WHERE %s = %%s' % (quote(Company._meta.db_table),
+                                               ', '.join('%s = %%s' % quote(field.column) for field in fields),
+                                               quote(Company._meta.pk.column))
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [[field.get_db_prep_save(getattr(company, field.attname), connection)
+                                  for field in fields] + [company.pk] for company in companies])
+
+
+def delete_rows(model, column, values, **equal):
+    """
+    Удаляет строки таблицы модели model, у которых column входит в values, а столбцы equal равны
+    заданным значениям, запросами DELETE без загрузки объектов и сигналов: у контактов и поисковых
+    документов нет зависимых объектов, а кэш количества строк import_companies сбрасывает сам.
+    """
+    quote = connection.ops.quote_name
+    sql = 'DELETE FROM %s WHERE %s' % (quote(model._meta.db_table),
+                                       ''.join('%s = %%s AND ' % quote(name) for name in equal))
+    with connection.cursor() as cursor:
+        for i in range(0, len(values), BATCH_SIZE):
+            batch = values[i:i + BATCH_SIZE]
+            cursor.execute(sql + '%s IN (%s)' % (quote(column), ', '.join(['%s'] * len(batch))),
+                           list(equal.values()) + batch)
+
+
+def update_typeahead(names):
+    """
+    Обновляет названия компаний в индексе подсказок по парам (pk, название) одним сообщением в канале.
+    """
+    typeahead_index.update_many(Company, names)
+
+
+def save_batch(batch, result):
+    """
+    Сохраняет пачку проверенных строк {название для сравнения: (поля, контакты)} в одной транзакции:
+    обновляет найденные по названию компании и заменяет их контакты, остальные компании создает.
+    Поисковые документы создаются тем же bulk_create, индекс подсказок обновляется после фиксации.
+    Очищенный HTML и выдержки описаний заполняются здесь же: bulk_create не вызывает save.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        found = existing_companies(list(batch))
+        updated, created = [], []
+        for key, (fields, _) in batch.items():
+            if key in found:
+                updated.append(Company(pk=found[key], title_key=key, updated_date=now, **fields))
+            else:
+                created.append(Company(title_key=key, **fields))
+        for company in updated + created:
+            company.render_description()
+        update_companies(updated)
+        Company.objects.bulk_create(created, batch_size=BATCH_SIZE)
+        if created and created[0].pk is None:
+            pks = dict(Company.objects.filter(title__in=[company.title for company in created])
+                       .values_list('title', 'pk'))
+            for company in created:
+                company.pk = pks[company.title]
+
+        updated_pks = [company.pk for company in updated]
+        for key, model, field_name in CONTACT_SOURCES:
+            delete_rows(model, 'company_id', updated_pks)
+        companies = updated + created
+        for key, model, field_name in CONTACT_SOURCES:
+            model.objects.bulk_create(
+                (model(company_id=company.pk, **{field_name: value})
+                 for company in companies for value in batch[company.title_key][1][key]),
+                batch_size=BATCH_SIZE)
+        delete_rows(SearchDocument, 'object_id', updated_pks, kind=SearchDocument.kind_company)
+        SearchDocument.objects.bulk_create((make_document(company) for company in companies), batch_size=BATCH_SIZE)
+
+        transaction.on_commit(partial(update_typeahead, [(company.pk, company.title) for company in companies]))
+        for pk in updated_pks:
+            invalidate_object(Company, pk)
+    result.updated += len(updated)
+    result.created += len(created)
+
+
+def import_companies(rows, batch_size=BATCH_SIZE):
+    """
+    Импортирует компании с телефонами, e-mail и контактными лицами из пар (номер строки, словарь)
+    (см. read_csv, read_jsonl). Строки читаются и сохраняются пачками по batch_size, каждая пачка -
+    в своей транзакции, поэтому память не зависит от размера файла. Компания с уже существующим
+    (без учета регистра) названием обновляется, ее контакты заменяются; внутри пачки побеждает
+    последняя строка. Некорректные строки пропускаются и попадают в ImportResult.errors.
+    bulk_create и bulk_update не отправляют сигналы, поэтому кэш количества строк сбрасывается явно.
+    Если параллельная запись нарушила уникальность названия, пачка повторяется.
+    :return: ImportResult
+    """
+    result, rows = ImportResult(), iter(rows)
+    while True:
+        chunk = list(islice(rows, batch_size))
+        if not chunk:
+            break
+        batch = {}
+        for line, row in chunk:
+            try:
+                fields, contacts = clean_row(row)
+            except ValidationError as error:
+                result.add_error(line, ' '.join(error.messages))
+                continue
+            key = fold_title(fields['title'])
+            batch.pop(key, None)
+            batch[key] = (fields, contacts)
+        for attempt in range(RETRIES):
+            try:
+                save_batch(batch, result)
+                break
+            except IntegrityError:
+                if attempt == RETRIES - 1:
+                    raise
+    for model in (Company, Phone, Email, Manager, SearchDocument):
+        invalidate_table(model._meta.db_table)
+    return result
+
+
+def import_file(file, file_format, batch_size=BATCH_SIZE):
+    """
+    Импортирует компании из бинарного файла file в формате file_format ('csv' или 'jsonl') в UTF-8.
+    :return: ImportResult
+    """
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        return import_companies(READERS[file_format](stream), batch_size)
+    finally:
+        stream.detach()
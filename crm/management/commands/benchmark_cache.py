@@ -0,0 +1,83 @@
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+
+BACKENDS = (
+    ('locmem', 'django.core.cache.backends.locmem.LocMemCache'),
+    ('file', 'django.core.cache.backends.filebased.FileBasedCache'),
+    ('sqlite', 'crm.sqlite_cache.SQLiteCache'),
+)
+
+
+def run_worker(backend, location, number, options, barrier, results):
+    """
+    Процесс замера: публикует свой ключ и считает, сколько ключей других процессов видит,
+    затем выполняет options['operations'] обращений к кэшу (каждое десятое - запись).
+    """
+    cache = import_string(backend)(location, {'OPTIONS': {'MAX_ENTRIES': options['keys'] * 2}})
+    workers = options['workers']
+    cache.set('worker:%d' % number, number)
+    barrier.wait()
+    seen = sum(cache.get('worker:%d' % other) == other for other in range(workers) if other != number)
+    barrier.wait()
+    rng, value = random.Random(number), 'x' * options['size']
+    start = time.perf_counter()
+    for i in range(options['operations']):
+        key = 'key:%d' % rng.randrange(options['keys'])
+        if i % 10 == 0:
+            cache.set(key, value)
+        else:
+            cache.get(key)
+    results.put((time.perf_counter() - start, seen))
+
+
+class Command(BaseCommand):
+    """
+    Команда сравнивает бэкенды кэша locmem, file и sqlite (crm.sqlite_cache) под нагрузкой
+    нескольких процессов, как у gunicorn: пропускную способность и видимость записей
+    других процессов (у locmem каждый процесс видит только свой кэш).
+    """
+    help = 'Сравнивает бэкенды кэша locmem, file и sqlite под нагрузкой нескольких процессов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Количество процессов.')
+        parser.add_argument('--operations', type=int, default=5000, help='Количество обращений каждого процесса.')
+        parser.add_argument('--keys', type=int, default=5000, help='Количество разных ключей.')
+        parser.add_argument('--size', type=int, default=200, help='Размер значения в байтах.')
+
+    def measure(self, backend, location, options):
+        """
+        Возвращает (обращений в секунду всеми процессами, доля видимых ключей других процессов).
+        """
+        context = multiprocessing.get_context('fork')
+        barrier, results = context.Barrier(options['workers']), context.Queue()
+        processes = [context.Process(target=run_worker, args=(backend, location, number, options, barrier, results))
+                     for number in range(options['workers'])]
+        for process in processes:
+            process.start()
+        measured = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = max(seconds for seconds, _ in measured)
+        pairs = options['workers'] * (options['workers'] - 1)
+        visible = sum(seen for _, seen in measured) / pairs if pairs else 1.0
+        return options['workers'] * options['operations'] / elapsed, visible
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        try:
+            locations = {'locmem': 'benchmark', 'file': os.path.join(directory, 'file'),
+                         'sqlite': os.path.join(directory, 'cache.sqlite3')}
+            for name, backend in BACKENDS:
+                rate, visible = self.measure(backend, locations[name], options)
+                self.stdout.write('%-7s %10.0f обращений/с, видно ключей других процессов: %.0f%%'
+                                  % (name, rate, visible * 100))
+        finally:
+            shutil.rmtree(directory)
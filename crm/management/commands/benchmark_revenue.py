@@ -0,0 +1,57 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from crm.models import Company, Project, RevenueSummary
+from crm.revenue import live_revenue, rebuild_revenue
+
+
+class Command(BaseCommand):
+    """
+    Команда сравнивает отчет "выручка по компании, статусу и месяцу", посчитанный GROUP BY по проектам,
+    с чтением сводки RevenueSummary. Тестовые данные создаются в транзакции, которая затем откатывается.
+    """
+    help = 'Сравнивает время GROUP BY по проектам и чтения сводки выручки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--projects', type=int, default=100000, help='Количество тестовых проектов.')
+        parser.add_argument('--companies', type=int, default=100, help='Количество тестовых компаний.')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество повторов каждого запроса.')
+
+    def measure(self, query, repeat):
+        """
+        Возвращает лучшее время выполнения query() из repeat запусков в миллисекундах.
+        """
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query()
+            timings.append((time.perf_counter() - start) * 1000)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        statuses = (Project.status_not_started, Project.status_in_process, Project.status_completed)
+        with transaction.atomic():
+            companies = [Company.objects.create(title='benchmark-%d' % i, leader_name='-', address='-')
+                         for i in range(options['companies'])]
+            Project.objects.bulk_create(
+                (Project(company=random.choice(companies), name='benchmark-%d' % i, description='',
+                         start_date=now - timedelta(days=random.randint(0, 730)),
+                         end_date=now + timedelta(days=random.randint(1, 365)),
+                         price=random.randint(100, 100000), status_pro=random.choice(statuses))
+                 for i in range(options['projects'])),
+                batch_size=1000)
+            rebuild_revenue()
+
+            live = self.measure(lambda: list(live_revenue()), options['repeat'])
+            summary = self.measure(
+                lambda: list(RevenueSummary.objects.values('company_id', 'status_pro', 'month', 'projects', 'revenue')),
+                options['repeat'])
+            self.stdout.write('GROUP BY по проектам: %.1f мс' % live)
+            self.stdout.write('Сводка RevenueSummary: %.1f мс' % summary)
+            transaction.set_rollback(True)
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from crm.media import collect_garbage
+
+
+class Command(BaseCommand):
+    """
+    Команда пересчитывает ссылки на файлы хранилища по содержимому (crm.storage) и удаляет файлы
+    без ссылок, загруженные раньше --grace часов назад. Запускается по расписанию, например раз в сутки.
+    """
+    help = 'Удаляет файлы хранилища по содержимому, на которые нет ссылок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=float, default=24, help='Не удалять файлы моложе, часов.')
+
+    def handle(self, *args, **options):
+        deleted, freed = collect_garbage(timedelta(hours=options['grace']))
+        self.stdout.write('Удалено файлов: %d, освобождено: %d байт' % (deleted, freed))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from crm.media import fold_duplicates
+
+
+class Command(BaseCommand):
+    """
+    Команда переносит файлы, загруженные до хранилища по содержимому, в хранилище (crm.storage):
+    одинаковые файлы становятся одним, ссылки на них в фотографиях пользователей и описаниях заменяются.
+    """
+    help = 'Переносит старые файлы MEDIA_ROOT в хранилище по содержимому, объединяя одинаковые.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать, ничего не менять.')
+
+    def handle(self, *args, **options):
+        duplicated, moved, freed = fold_duplicates(options['dry_run'])
+        self.stdout.write('Групп одинаковых файлов: %d, перенесено файлов: %d, освобождено: %d байт' % (
+            duplicated, moved, freed))
@@ -0,0 +1,41 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from crm.importer import IMPORT_FORMATS, BATCH_SIZE, import_file
+
+
+class Command(BaseCommand):
+    """
+    Команда импортирует компании с телефонами, e-mail и контактными лицами из файла CSV или JSONL
+    (см. crm.importer). Компании с уже существующими названиями обновляются.
+    """
+    help = 'Импортирует компании из файла CSV или JSONL ("-" - стандартный ввод).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу или "-".')
+        parser.add_argument('--format', choices=IMPORT_FORMATS,
+                            help='Формат файла; по умолчанию определяется по расширению.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Количество строк в одной транзакции.')
+
+    def handle(self, *args, **options):
+        path, file_format = options['path'], options['format']
+        if file_format is None:
+            file_format = os.path.splitext(path)[1].lstrip('.').lower()
+            if file_format not in IMPORT_FORMATS:
+                raise CommandError('Укажите --format: %s' % ', '.join(IMPORT_FORMATS))
+        start = time.perf_counter()
+        if path == '-':
+            result = import_file(sys.stdin.buffer, file_format, options['batch_size'])
+        else:
+            try:
+                with open(path, 'rb') as file:
+                    result = import_file(file, file_format, options['batch_size'])
+            except OSError as error:
+                raise CommandError(error)
+        for line, message in result.errors:
+            self.stderr.write('Строка %d: %s' % (line, message))
+        self.stdout.write('Создано: %d, обновлено: %d, отклонено: %d за %.1f с' % (
+            result.created, result.updated, result.rejected, time.perf_counter() - start))
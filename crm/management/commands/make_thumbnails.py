@@ -0,0 +1,48 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from crm.models import User
+from crm.thumbnails import make_thumbnails
+
+
+def make_thumbnails_safely(source, force):
+    """
+    Создает копии фотографии source в процессе пула и возвращает (source, количество файлов, ошибка).
+    """
+    try:
+        return source, make_thumbnails(source, force), None
+    except (OSError, ValueError) as error:
+        return source, 0, str(error)
+
+
+class Command(BaseCommand):
+    """
+    Команда создает недостающие уменьшенные копии фотографий пользователей (crm.thumbnails),
+    например для фотографий, загруженных до появления копий. Фотографии обрабатываются пулом
+    процессов: декодирование и сжатие изображений упираются в процессор.
+    """
+    help = 'Создает недостающие уменьшенные копии фотографий пользователей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Количество процессов.')
+        parser.add_argument('--force', action='store_true', help='Пересоздать все копии.')
+
+    def handle(self, *args, **options):
+        sources = set(User.objects.exclude(photo='').exclude(photo=None).values_list('photo', flat=True))
+        sources.add(User._meta.get_field('photo').default)
+        connections.close_all()
+        start, created, failed = time.perf_counter(), 0, 0
+        with ProcessPoolExecutor(options['processes'], mp_context=multiprocessing.get_context('fork')) as pool:
+            for source, count, error in pool.map(make_thumbnails_safely, sorted(sources),
+                                                 [options['force']] * len(sources)):
+                if error:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (source, error))
+                created += count
+        self.stdout.write('Фотографий: %d, создано копий: %d, ошибок: %d за %.1f с' % (
+            len(sources), created, failed, time.perf_counter() - start))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from crm.objectcache import reset_shared_stats, shared_stats
+
+
+class Command(BaseCommand):
+    """
+    Команда выводит общие для всех процессов счетчики кэша объектов (crm.objectcache): попадания
+    в LRU процессов, в общий кэш, промахи и долю попаданий.
+    """
+    help = 'Выводит счетчики попаданий и промахов кэша объектов всех процессов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Обнулить счетчики после вывода.')
+
+    def handle(self, *args, **options):
+        stats = shared_stats()
+        self.stdout.write('В памяти процессов: %(local)d, в общем кэше: %(shared)d, промахов: %(miss)d, '
+                          'доля попаданий: %(hit_ratio).1f%%' % dict(stats, hit_ratio=stats['hit_ratio'] * 100))
+        if options['reset']:
+            reset_shared_stats()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from crm.revenue import rebuild_revenue
+
+
+class Command(BaseCommand):
+    """
+    Команда строит сводку выручки (RevenueSummary) заново по всем проектам,
+    например после массового импорта в обход сигналов.
+    """
+    help = 'Строит сводку выручки по компаниям, статусам и месяцам заново.'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Строк сводки: %d' % rebuild_revenue())
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from crm.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    """
+    Команда строит поисковые документы заново по всем компаниям, проектам и взаимодействиям,
+    например после массового импорта в обход сигналов.
+    """
+    help = 'Строит поисковый индекс по компаниям, проектам и взаимодействиям заново.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество объектов в одной пачке.')
+
+    def handle(self, *args, **options):
+        self.stdout.write('Документов: %d' % rebuild_search_index(options['batch_size']))
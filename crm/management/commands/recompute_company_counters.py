@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from crm.counters import recompute_counters
+from crm.models import Company
+
+
+class Command(BaseCommand):
+    """
+    Команда пересчитывает счетчики проектов и взаимодействий всех компаний (crm.counters),
+    например после массового импорта или если счетчики разошлись с данными.
+    """
+    help = 'Пересчитывает счетчики проектов и взаимодействий компаний.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество компаний в одной транзакции.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        company_ids = Company.objects.order_by('pk').values_list('pk', flat=True)
+        total, last_pk = 0, 0
+        while True:
+            batch = list(company_ids.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            with transaction.atomic():
+                total += recompute_counters(batch)
+            last_pk = batch[-1]
+        self.stdout.write('Обновлено компаний: %d' % total)
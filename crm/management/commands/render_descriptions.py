@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from crm.cache import invalidate_object, invalidate_table
+from crm.models import Company, Project, Interaction
+from crm.text import render_descriptions
+
+
+class Command(BaseCommand):
+    """
+    Команда заново заполняет очищенный HTML и выдержки описаний компаний, проектов и взаимодействий
+    (crm.models.RichTextMixin), например после изменения правил очистки или записи в обход моделей.
+    """
+    help = 'Заполняет очищенный HTML и выдержки описаний компаний, проектов и взаимодействий.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Количество объектов в одной пачке.')
+
+    def handle(self, *args, **options):
+        for model in (Company, Project, Interaction):
+            changed = render_descriptions(model, options['batch_size'])
+            for pk in changed:
+                invalidate_object(model, pk)
+            if changed:
+                invalidate_table(model._meta.db_table)
+            self.stdout.write('%s: изменено %d' % (model._meta.object_name, len(changed)))
@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, DateField
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from crm.cache import invalidate_table
+from crm.counters import apply_status_transitions
+from crm.models import Project, JobState
+from crm.revenue import refresh_revenue
+
+
+JOB_NAME = 'update_project_status'
+
+
+def transition_querysets(last_run, now):
+    """
+    Возвращает словарь {новый статус: проекты}, статус которых изменился между last_run и now.
+    Условия записаны через start_date и end_date и используют индексы по этим полям,
+    поэтому стоимость зависит от количества переходов, а не от размера таблицы.
+    При первом запуске (last_run is None) сверяются все проекты.
+    """
+    if last_run is None:
+        return {status: Project.objects.filter_status(status, now)
+                for status in (Project.status_not_started, Project.status_in_process, Project.status_completed)}
+    return {
+        Project.status_in_process: Project.objects.filter(start_date__gt=last_run, start_date__lte=now,
+                                                          end_date__gte=now),
+        Project.status_completed: Project.objects.filter(end_date__gte=last_run, end_date__lt=now),
+    }
+
+
+def transition_rows(queryset, status):
+    """
+    Возвращает строки GROUP BY (компания, прежний статус, месяц начала, количество) проектов queryset,
+    которые переходят в статус status, - одним запросом для счетчиков компаний и сводки выручки.
+    """
+    return list(queryset.exclude(status_pro=status).order_by()
+                .annotate(month=TruncMonth('start_date', output_field=DateField()))
+                .values('company_id', 'status_pro', 'month').annotate(n=Count('pk')))
+
+
+def update_project_status(now=None):
+    """
+    Переводит проекты, у которых с прошлого запуска наступила дата начала или окончания, в новый статус
+    (поле status_pro) - одним UPDATE на каждый статус, - переносит их в счетчиках компаний,
+    пересчитывает затронутые строки сводки выручки и сохраняет новую отметку запуска. Переходы
+    каждого статуса читаются одним GROUP BY; статус без переходов больше запросов не стоит.
+    :return: словарь {статус: количество обновленных проектов}
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        state, _ = JobState.objects.select_for_update().get_or_create(name=JOB_NAME)
+        updated, buckets = {}, set()
+        for status, qs in transition_querysets(state.high_water_mark, now).items():
+            rows = transition_rows(qs, status)
+            if not rows:
+                updated[status] = 0
+                continue
+            apply_status_transitions(rows, status)
+            buckets |= {(row['company_id'], row['month']) for row in rows if row['company_id'] is not None}
+            updated[status] = qs.exclude(status_pro=status).update(status_pro=status)
+        if buckets:
+            refresh_revenue(buckets)
+        state.high_water_mark = now
+        state.save(update_fields=['high_water_mark'])
+    if any(updated.values()):
+        invalidate_table(Project._meta.db_table)
+    return updated
+
+
+class Command(BaseCommand):
+    """
+    Команда обновляет сохраненный статус проектов (status_pro) по датам начала и окончания.
+    Запускается по расписанию или с --loop как отдельный процесс.
+    """
+    help = 'Обновляет статус проектов, у которых с прошлого запуска наступила дата начала или окончания.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Работать постоянно, запускаясь каждые --interval секунд.')
+        parser.add_argument('--interval', type=int, default=60, help='Интервал между запусками в секундах.')
+
+    def handle(self, *args, **options):
+        while True:
+            updated = update_project_status()
+            for status, count in updated.items():
+                self.stdout.write('%s: %d' % (status, count))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,168 @@
+import os
+import re
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from crm.cache import invalidate_object, invalidate_table
+from crm.models import User, Company, Project, Interaction, MediaBlob
+from crm.storage import CONTENT_DIRECTORY, content_storage, file_digest
+from crm.thumbnails import THUMBNAIL_DIRECTORY, THUMBNAIL_FORMATS, THUMBNAIL_WIDTHS, thumbnail_name
+
+
+HTML_FIELDS = ((Company, 'description'), (Project, 'description'), (Interaction, 'description'))
+CONTENT_NAME_RE = re.compile(r'%s/[0-9a-f]{2}/[0-9a-f]{64}(?:\.\w+)?' % CONTENT_DIRECTORY)
+GRACE_PERIOD = timedelta(days=1)
+
+
+def photo_default():
+    """
+    Возвращает фотографию по умолчанию поля User.photo - ее имя записано в миграциях и не меняется.
+    """
+    return User._meta.get_field('photo').default
+
+
+def count_references():
+    """
+    Возвращает Counter {имя файла: количество ссылок} по фотографиям пользователей и HTML полей
+    CKEditor (HTML_FIELDS), просматривая только строки, в которых упоминаются файлы хранилища.
+    """
+    references = Counter(User.objects.filter(photo__startswith=CONTENT_DIRECTORY + '/')
+                         .values_list('photo', flat=True).iterator())
+    for model, field in HTML_FIELDS:
+        for html in model.objects.filter(**{field + '__contains': CONTENT_DIRECTORY + '/'})\
+                .values_list(field, flat=True).iterator():
+            references.update(CONTENT_NAME_RE.findall(html))
+    return references
+
+
+def delete_with_thumbnails(name):
+    """
+    Удаляет файл name и его уменьшенные копии.
+    """
+    content_storage.delete(name)
+    for width in THUMBNAIL_WIDTHS:
+        for extension in THUMBNAIL_FORMATS:
+            content_storage.delete(thumbnail_name(name, width, extension))
+
+
+def collect_garbage(grace=GRACE_PERIOD):
+    """
+    Пересчитывает ссылки на файлы хранилища по содержимому (счетчики MediaBlob поддерживаются сигналами,
+    но запись в обход моделей и HTML их не меняют) и удаляет файлы без ссылок, загруженные раньше grace:
+    свежая загрузка могла еще не попасть в сохраненную форму. Каждый файл удаляется в своей транзакции
+    вместе со строкой MediaBlob и только если строка все еще без ссылок и не загружена заново
+    (ContentAddressedStorage._save обновляет дату загрузки в транзакции): загрузка того же содержимого
+    во время сборки не теряет файл. Удаляет и брошенные временные файлы.
+    :return: (количество удаленных файлов, освобождено байт)
+    """
+    references = count_references()
+    with transaction.atomic():
+        blobs = list(MediaBlob.objects.select_for_update())
+        for blob in blobs:
+            blob.references = references.get(blob.name, 0)
+        MediaBlob.objects.bulk_update(blobs, ['references'], batch_size=1000)
+    deadline = timezone.now() - grace
+    deleted, freed = 0, 0
+    for blob in blobs:
+        if blob.references == 0 and blob.created_date < deadline:
+            with transaction.atomic():
+                if MediaBlob.objects.filter(pk=blob.pk, references=0, created_date__lt=deadline).delete()[0]:
+                    delete_with_thumbnails(blob.name)
+                    deleted, freed = deleted + 1, freed + blob.size
+    directory = content_storage.path(CONTENT_DIRECTORY)
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.endswith('.upload') and os.path.getmtime(path) < deadline.timestamp():
+                os.remove(path)
+    return deleted, freed
+
+
+def legacy_files():
+    """
+    Возвращает имена файлов MEDIA_ROOT, сохраненных до хранилища по содержимому
+    (кроме каталогов хранилища и уменьшенных копий).
+    """
+    root = content_storage.location
+    names = []
+    for directory, subdirectories, files in os.walk(root):
+        if directory == root:
+            subdirectories[:] = [name for name in subdirectories
+                                 if name not in (CONTENT_DIRECTORY, THUMBNAIL_DIRECTORY)]
+        for file in files:
+            names.append(os.path.relpath(os.path.join(directory, file), root).replace(os.sep, '/'))
+    return sorted(names)
+
+
+def replace_references(renamed):
+    """
+    Заменяет ссылки на файлы renamed {старое имя: новое имя} в фотографиях пользователей и HTML полей
+    CKEditor (по адресу MEDIA_URL + имя), заново заполняет очищенный HTML и выдержки измененных
+    описаний (crm.models.RichTextMixin) и сбрасывает кэши измененных объектов.
+    """
+    for old, new in renamed.items():
+        pks = list(User.objects.filter(photo=old).values_list('pk', flat=True))
+        if pks:
+            User.objects.filter(pk__in=pks).update(photo=new)
+            for pk in pks:
+                invalidate_object(User, pk)
+    urls = {settings.MEDIA_URL + old: settings.MEDIA_URL + new for old, new in renamed.items()}
+    pattern = re.compile('|'.join(re.escape(url) for url in sorted(urls, key=len, reverse=True)))
+    for model, field in HTML_FIELDS:
+        changed = []
+        for pk, html in model.objects.filter(**{field + '__contains': settings.MEDIA_URL})\
+                .values_list('pk', field).iterator():
+            replaced = pattern.sub(lambda match: urls[match.group()], html)
+            if replaced != html:
+                obj = model(pk=pk, **{field: replaced})
+                obj.render_description()
+                changed.append(obj)
+        model.objects.bulk_update(changed, [field, 'description_html', 'description_excerpt'], batch_size=1000)
+        for obj in changed:
+            invalidate_object(model, obj.pk)
+        if changed:
+            invalidate_table(model._meta.db_table)
+    invalidate_table(User._meta.db_table)
+
+
+def fold_duplicates(dry_run=False):
+    """
+    Переносит файлы MEDIA_ROOT, сохраненные до хранилища по содержимому, в хранилище: одинаковые по
+    содержимому файлы (копии с суффиксами Django) становятся одним файлом, ссылки на старые имена
+    заменяются, старые файлы и их уменьшенные копии удаляются. Фотография по умолчанию остается
+    на месте (ее имя записано в миграциях), к ней присоединяются ее копии.
+    :return: (групп одинаковых файлов, перенесено файлов, освобождено байт)
+    """
+    groups = defaultdict(list)
+    for name in legacy_files():
+        with content_storage.open(name) as file:
+            groups[file_digest(file)].append(name)
+    renamed, freed = {}, 0
+    for names in groups.values():
+        if photo_default() in names:
+            keeper = photo_default()
+        elif dry_run:
+            keeper = None
+        else:
+            with content_storage.open(names[0]) as file:
+                keeper = content_storage.save(names[0], File(file))
+        for name in names:
+            if name != keeper:
+                renamed[name] = keeper
+        freed += content_storage.size(names[0]) * (len(names) - 1)
+    duplicated = sum(len(names) > 1 for names in groups.values())
+    if dry_run or not renamed:
+        return duplicated, len(renamed), freed
+    with transaction.atomic():
+        replace_references(renamed)
+        counts = count_references()
+        for blob in MediaBlob.objects.filter(name__in=set(renamed.values())):
+            MediaBlob.objects.filter(pk=blob.pk).update(references=counts.get(blob.name, 0))
+    for name in renamed:
+        delete_with_thumbnails(name)
+    return duplicated, len(renamed), freed
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0042_auto_20210822_1458'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['company', 'status_pro', 'start_date'], name='project_company_status_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0043_project_company_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='interaction',
+            index=models.Index(fields=['company', 'channel_of_reference', 'created_date'], name='interaction_company_chan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='interaction',
+            index=models.Index(fields=['project', 'channel_of_reference', 'created_date'], name='interaction_project_chan_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0044_interaction_channel_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['customer', 'start_date'], name='project_customer_idx'),
+        ),
+    ]
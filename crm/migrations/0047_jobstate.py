@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0046_project_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Задача')),
+                ('high_water_mark', models.DateTimeField(blank=True, null=True, verbose_name='Отметка последнего запуска')),
+            ],
+        ),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:19
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Заполняет счетчики компаний по уже существующим проектам и взаимодействиям.
+    """
+    Company = apps.get_model('crm', 'Company')
+    Project = apps.get_model('crm', 'Project')
+    Interaction = apps.get_model('crm', 'Interaction')
+    statuses = {
+        'Еще не начат': 'projects_not_started',
+        'В процессе разработки': 'projects_in_process',
+        'Выполнен': 'projects_completed',
+    }
+    channels = {
+        'Телефонный звонок': 'interactions_phone',
+        'Переписка по E-mail': 'interactions_email',
+        'Переписка в мессенджере': 'interactions_messenger',
+    }
+    for row in Project.objects.order_by().values('company_id', 'status_pro').annotate(n=Count('pk')):
+        if row['status_pro'] in statuses:
+            Company.objects.filter(pk=row['company_id']).update(**{statuses[row['status_pro']]: row['n']})
+    for row in Interaction.objects.order_by().values('company_id', 'channel_of_reference').annotate(n=Count('pk')):
+        if row['channel_of_reference'] in channels:
+            Company.objects.filter(pk=row['company_id']).update(**{channels[row['channel_of_reference']]: row['n']})
+    for row in Interaction.objects.order_by().values('company_id').annotate(last=Max('created_date')):
+        Company.objects.filter(pk=row['company_id']).update(last_interaction_date=row['last'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0048_cursor_pagination_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='interactions_email',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Переписок по E-mail'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='interactions_messenger',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Переписок в мессенджере'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='interactions_phone',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Телефонных звонков'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='last_interaction_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Дата последнего взаимодействия'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='projects_completed',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Выполненных проектов'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='projects_in_process',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Проектов в процессе разработки'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='projects_not_started',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Еще не начатых проектов'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['projects_not_started'], name='company_not_started_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['projects_in_process'], name='company_in_process_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['projects_completed'], name='company_completed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['interactions_phone'], name='company_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['interactions_email'], name='company_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['interactions_messenger'], name='company_messenger_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='company',
+            index=models.Index(fields=['last_interaction_date'], name='company_last_interaction_idx'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:22
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+import django.db.models.deletion
+
+
+def fill_revenue_summary(apps, schema_editor):
+    """
+    Строит сводку выручки по уже существующим проектам.
+    """
+    Project = apps.get_model('crm', 'Project')
+    RevenueSummary = apps.get_model('crm', 'RevenueSummary')
+    rows = Project.objects.filter(company__isnull=False).order_by()\
+        .annotate(month=TruncMonth('start_date', output_field=DateField()))\
+        .values('company_id', 'status_pro', 'month')\
+        .annotate(projects=Count('pk'), revenue=Sum('price'))
+    RevenueSummary.objects.bulk_create((RevenueSummary(**row) for row in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0049_company_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevenueSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status_pro', models.CharField(max_length=100, verbose_name='Статус проекта')),
+                ('month', models.DateField(verbose_name='Месяц начала проекта')),
+                ('projects', models.PositiveIntegerField(default=0, verbose_name='Количество проектов')),
+                ('revenue', models.BigIntegerField(default=0, verbose_name='Сумма стоимости проектов')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='crm.company', verbose_name='Название компании')),
+            ],
+            options={
+                'ordering': ['-month', 'company', 'status_pro'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='revenuesummary',
+            index=models.Index(fields=['month', 'status_pro'], name='revenue_month_status_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='revenuesummary',
+            constraint=models.UniqueConstraint(fields=('company', 'status_pro', 'month'), name='revenue_summary_unique'),
+        ),
+        migrations.RunPython(fill_revenue_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+from crm.text import html_to_text, stem_text
+
+
+SQLITE_FULLTEXT = [
+    "CREATE VIRTUAL TABLE crm_searchdocument_fts USING fts5("
+    "stems, content='crm_searchdocument', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER crm_searchdocument_ai AFTER INSERT ON crm_searchdocument BEGIN "
+    "INSERT INTO crm_searchdocument_fts(rowid, stems) VALUES (new.id, new.stems); END",
+    "CREATE TRIGGER crm_searchdocument_ad AFTER DELETE ON crm_searchdocument BEGIN "
+    "INSERT INTO crm_searchdocument_fts(crm_searchdocument_fts, rowid, stems) VALUES ('delete', old.id, old.stems); END",
+    "CREATE TRIGGER crm_searchdocument_au AFTER UPDATE ON crm_searchdocument BEGIN "
+    "INSERT INTO crm_searchdocument_fts(crm_searchdocument_fts, rowid, stems) VALUES ('delete', old.id, old.stems); "
+    "INSERT INTO crm_searchdocument_fts(rowid, stems) VALUES (new.id, new.stems); END",
+]
+
+POSTGRESQL_FULLTEXT = [
+    "ALTER TABLE crm_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('russian', title), 'A') || setweight(to_tsvector('russian', body), 'B')) STORED",
+    "CREATE INDEX crm_searchdocument_vector_idx ON crm_searchdocument USING gin (search_vector)",
+]
+
+
+def create_fulltext_index(apps, schema_editor):
+    """
+    Создает полнотекстовый индекс по поисковым документам: FTS5 с триггерами на SQLite,
+    вычисляемый столбец tsvector с GIN-индексом на PostgreSQL.
+    """
+    statements = {'sqlite': SQLITE_FULLTEXT, 'postgresql': POSTGRESQL_FULLTEXT}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    """
+    Удаляет полнотекстовый индекс SQLite (на PostgreSQL он удаляется вместе с таблицей).
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('ai', 'ad', 'au'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS crm_searchdocument_%s' % trigger)
+        schema_editor.execute('DROP TABLE IF EXISTS crm_searchdocument_fts')
+
+
+def fill_search_documents(apps, schema_editor):
+    """
+    Создает поисковые документы по уже существующим компаниям, проектам и взаимодействиям.
+    """
+    SearchDocument = apps.get_model('crm', 'SearchDocument')
+    sources = [
+        ('company', apps.get_model('crm', 'Company'),
+         lambda obj: (obj.title, ' '.join([obj.leader_name, obj.address, html_to_text(obj.description)]))),
+        ('project', apps.get_model('crm', 'Project'), lambda obj: (obj.name, html_to_text(obj.description))),
+        ('interaction', apps.get_model('crm', 'Interaction'),
+         lambda obj: (' '.join(filter(None, [obj.channel_of_reference, obj.reference_obj])),
+                      html_to_text(obj.description))),
+    ]
+    for kind, model, fields in sources:
+        documents = []
+        for obj in model.objects.iterator():
+            title, body = fields(obj)
+            documents.append(SearchDocument(kind=kind, object_id=obj.pk, title=title[:255], body=body,
+                                            stems=stem_text(title + ' ' + body)))
+        SearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0050_revenue_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('company', 'Компания'), ('project', 'Проект'), ('interaction', 'Взаимодействие')], max_length=20, verbose_name='Тип объекта')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Объект')),
+                ('title', models.CharField(max_length=255, verbose_name='Заголовок')),
+                ('body', models.TextField(blank=True, verbose_name='Текст')),
+                ('stems', models.TextField(blank=True, editable=False, verbose_name='Основы слов')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_unique'),
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.6 on 2026-10-18 07:41
+
+import crm.models
+from django.db import migrations, models
+import django.db.models.expressions
+import django.db.models.functions.text
+from django.db.models import Count, F
+from django.db.models.functions import Lower
+
+
+def rename_duplicates(apps, schema_editor):
+    """
+    Переименовывает компании и проекты, названия которых совпадают без учета регистра (так, как
+    их сравнивает lower() базы данных): первое по pk название остается, к остальным добавляется
+    " (pk)". Иначе уникальные индексы ниже не создались бы на существующих данных.
+    """
+    for model_name, field in (('Company', 'title'), ('Project', 'name')):
+        model = apps.get_model('crm', model_name)
+        names = model.objects.annotate(key=Lower(field)).order_by()
+        duplicated = names.values('key').annotate(n=Count('pk')).filter(n__gt=1).values('key')
+        seen = set()
+        for pk, key, name in names.filter(key__in=duplicated).order_by('key', 'pk').values_list('pk', 'key', field):
+            if key in seen:
+                suffix = ' (%d)' % pk
+                model.objects.filter(pk=pk).update(**{field: name[:100 - len(suffix)] + suffix})
+            seen.add(key)
+
+
+def check_project_dates(apps, schema_editor):
+    """
+    Останавливает миграцию со списком проектов, у которых дата окончания не позже даты начала:
+    проверку дат ниже нельзя добавить к таким строкам, а исправить даты может только человек.
+    """
+    Project = apps.get_model('crm', 'Project')
+    invalid = list(Project.objects.filter(end_date__lte=F('start_date')).order_by('pk').values_list('pk', 'name'))
+    if invalid:
+        raise RuntimeError('Дата окончания проекта не позже даты начала, исправьте даты и повторите миграцию: %s'
+                           % ', '.join('%d (%s)' % row for row in invalid))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0051_search_document'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='title',
+            field=models.CharField(db_index=True, help_text='―――――', max_length=100, verbose_name='Название компании'),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='name',
+            field=models.CharField(db_index=True, help_text='―――――', max_length=100, verbose_name='Название проекта'),
+        ),
+        migrations.RunPython(rename_duplicates, migrations.RunPython.noop),
+        migrations.RunPython(check_project_dates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='company',
+            index=crm.models.UniqueIndex(django.db.models.functions.text.Lower('title'), name='company_title_lower_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=crm.models.UniqueIndex(django.db.models.functions.text.Lower('name'), name='project_name_lower_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='project',
+            constraint=models.CheckConstraint(check=models.Q(('end_date__gt', django.db.models.expressions.F('start_date'))), name='project_dates_check'),
+        ),
+    ]
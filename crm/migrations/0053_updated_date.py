@@ -0,0 +1,37 @@
+# Generated by Django 3.2.6 on 2026-10-18 11:40
+
+from django.db import migrations, models
+from django.db.models import F
+import django.utils.timezone
+
+
+def fill_updated_date(apps, schema_editor):
+    """
+    Берет дату изменения существующих взаимодействий из даты их создания.
+    У проектов даты создания нет, они получают время миграции.
+    """
+    Interaction = apps.get_model('crm', 'Interaction')
+    Interaction.objects.update(updated_date=F('created_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0052_case_insensitive_names'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='interaction',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='updated_date',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата изменения'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_date, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-18 08:44
+
+import crm.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0053_updated_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('created_date', models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='photo',
+            field=models.ImageField(blank=True, default='default1.jpg', help_text='―――――', null=True, storage=crm.storage.ContentAddressedStorage(), upload_to=''),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 3.2.6 on 2026-10-18 08:48
+
+from django.db import migrations, models
+
+from crm.text import render_descriptions
+
+
+def fill_descriptions(apps, schema_editor):
+    """
+    Заполняет очищенный HTML и выдержки описаний уже существующих компаний, проектов и взаимодействий.
+    """
+    for name in ('Company', 'Project', 'Interaction'):
+        render_descriptions(apps.get_model('crm', name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0054_content_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='description_excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200, verbose_name='Выдержка из описания'),
+        ),
+        migrations.AddField(
+            model_name='company',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Описание (очищенный HTML)'),
+        ),
+        migrations.AddField(
+            model_name='interaction',
+            name='description_excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200, verbose_name='Выдержка из описания'),
+        ),
+        migrations.AddField(
+            model_name='interaction',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Описание (очищенный HTML)'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='description_excerpt',
+            field=models.CharField(blank=True, default='', editable=False, max_length=200, verbose_name='Выдержка из описания'),
+        ),
+        migrations.AddField(
+            model_name='project',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Описание (очищенный HTML)'),
+        ),
+        migrations.RunPython(fill_descriptions, migrations.RunPython.noop),
+    ]
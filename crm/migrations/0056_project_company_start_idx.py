@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-18 09:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0055_rich_text_rendering'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='project',
+            name='project_company_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='project',
+            index=models.Index(fields=['company', 'start_date'], name='project_company_start_idx'),
+        ),
+    ]
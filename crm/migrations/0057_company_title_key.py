@@ -0,0 +1,32 @@
+# Generated by Django 3.2.6 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+from crm.models import fold_title
+
+
+def fill_title_keys(apps, schema_editor):
+    """
+    Заполняет название для сравнения уже существующих компаний.
+    """
+    Company = apps.get_model('crm', 'Company')
+    companies = []
+    for pk, title in Company.objects.order_by().values_list('pk', 'title').iterator():
+        companies.append(Company(pk=pk, title_key=fold_title(title)))
+    Company.objects.bulk_update(companies, ['title_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0056_project_company_start_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='title_key',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=300, verbose_name='Название для сравнения без учета регистра'),
+        ),
+        migrations.RunPython(fill_title_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-18 09:28
+
+import ckeditor_uploader.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crm', '0057_company_title_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='company',
+            name='description',
+            field=ckeditor_uploader.fields.RichTextUploadingField(help_text='―――――', max_length=1000, null=True, verbose_name='Краткое описание'),
+        ),
+        migrations.AlterField(
+            model_name='interaction',
+            name='description',
+            field=ckeditor_uploader.fields.RichTextUploadingField(help_text='―――――', max_length=1000, null=True, verbose_name='Описание'),
+        ),
+        migrations.AlterField(
+            model_name='project',
+            name='description',
+            field=ckeditor_uploader.fields.RichTextUploadingField(help_text='―――――', max_length=1000, null=True, verbose_name='Краткое описание'),
+        ),
+    ]
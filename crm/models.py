@@ -1,35 +1,147 @@
-from ckeditor.fields import RichTextField
+from ckeditor_uploader.fields import RichTextUploadingField
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import RegexValidator, ValidationError
 from django.db import models
+from django.db.backends.ddl_references import Expressions, Table
+from django.db.models.functions import Lower
 from django.urls import reverse
+from django.utils import timezone
 from datetime import datetime
 from django.conf import settings
 import pytz
 import django_filters
 from PIL import Image
 
+from crm.storage import content_storage
+from crm.text import EXCERPT_LENGTH, excerpt, html_to_text, sanitize_html
+
 
 utc = pytz.UTC
 
 
-class Company(models.Model):
+class UnqualifiedExpressions(Expressions):
+    """
+    Класс UnqualifiedExpressions - выражения индекса, которые при переименовании таблицы не получают
+    имя таблицы перед столбцами: SQLite запрещает "таблица.столбец" в выражениях индекса, а Django 3.2
+    добавляет его, пересоздавая таблицу в миграциях.
+    """
+
+    def rename_table_references(self, old_table, new_table):
+        Table.rename_table_references(self, old_table, new_table)
+
+
+class UniqueIndex(models.Index):
+    """
+    Класс UniqueIndex - уникальный индекс, в том числе по выражению, например Lower('title'):
+    в Django 3.2 UniqueConstraint не принимает выражения.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        """
+        Возвращает CREATE UNIQUE INDEX вместо CREATE INDEX.
+        """
+        statement = super().create_sql(model, schema_editor, using=using, **kwargs)
+        statement.template = statement.template.replace('CREATE INDEX', 'CREATE UNIQUE INDEX', 1)
+        columns = statement.parts['columns']
+        if isinstance(columns, Expressions):
+            statement.parts['columns'] = UnqualifiedExpressions(columns.table, columns.expressions,
+                                                                columns.compiler, columns.quote_value)
+        return statement
+
+
+class RichTextMixin:
+    """
+    Класс-примесь для моделей с полем CKEditor description: при сохранении заполняет очищенный HTML
+    description_html (выводят страницы объектов) и текстовую выдержку description_excerpt (выводят
+    списки), чтобы очистка и обрезка не выполнялись при каждом запросе.
+    """
+
+    def render_description(self):
+        """
+        Заполняет description_html и description_excerpt по description.
+        """
+        self.description_html = sanitize_html(self.description)
+        self.description_excerpt = excerpt(html_to_text(self.description_html))
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and 'description' not in self.get_deferred_fields():
+            self.render_description()
+        elif update_fields is not None and 'description' in update_fields:
+            self.render_description()
+            kwargs['update_fields'] = set(update_fields) | {'description_html', 'description_excerpt'}
+        return super().save(*args, **kwargs)
+
+
+def description_html_field():
+    """
+    Возвращает поле очищенного HTML описания (см. RichTextMixin).
+    """
+    return models.TextField(blank=True, default='', editable=False, verbose_name='Описание (очищенный HTML)')
+
+
+def description_excerpt_field():
+    """
+    Возвращает поле текстовой выдержки описания (см. RichTextMixin).
+    """
+    return models.CharField(max_length=EXCERPT_LENGTH, blank=True, default='', editable=False,
+                            verbose_name='Выдержка из описания')
+
+
+def fold_title(title):
+    """
+    Возвращает название для сравнения без учета регистра: casefold() приводит к одному виду
+    любые алфавиты, а lower() в SQLite - только латиницу.
+    """
+    return title.casefold()
+
+
+class Company(RichTextMixin, models.Model):
     """
     Класс Company представляет информацию о компаниях на сайте.
     """
-    title = models.CharField(max_length=100, help_text='―――――', unique=True,
+    title = models.CharField(max_length=100, help_text='―――――', db_index=True,
                              verbose_name='Название компании')
+    title_key = models.CharField(max_length=300, default='', editable=False, db_index=True,
+                                 verbose_name='Название для сравнения без учета регистра')
     leader_name = models.CharField(max_length=100, help_text='―ФИО', verbose_name='Директор')
     created_date = models.DateTimeField(auto_now_add=True,)
     updated_date = models.DateTimeField(auto_now=True,)
-    description = RichTextField(max_length=1000, null=True, help_text='―――――', verbose_name='Краткое описание')
+    description = RichTextUploadingField(max_length=1000, null=True, help_text='―――――', verbose_name='Краткое описание')
+    description_html = description_html_field()
+    description_excerpt = description_excerpt_field()
     address = models.CharField(max_length=100, help_text='―――――', verbose_name='Адрес компании')
+    projects_not_started = models.PositiveIntegerField(default=0, editable=False,
+                                                       verbose_name='Еще не начатых проектов')
+    projects_in_process = models.PositiveIntegerField(default=0, editable=False,
+                                                      verbose_name='Проектов в процессе разработки')
+    projects_completed = models.PositiveIntegerField(default=0, editable=False,
+                                                     verbose_name='Выполненных проектов')
+    interactions_phone = models.PositiveIntegerField(default=0, editable=False,
+                                                     verbose_name='Телефонных звонков')
+    interactions_email = models.PositiveIntegerField(default=0, editable=False,
+                                                     verbose_name='Переписок по E-mail')
+    interactions_messenger = models.PositiveIntegerField(default=0, editable=False,
+                                                         verbose_name='Переписок в мессенджере')
+    last_interaction_date = models.DateTimeField(null=True, blank=True, editable=False,
+                                                 verbose_name='Дата последнего взаимодействия')
 
     class Meta:
         """
-        Класс содержит ordering по title.
+        Класс содержит ordering по title, уникальный индекс по названию без учета регистра
+        и индексы для сортировки по счетчикам (см. crm.counters).
         """
         ordering = ['title']
+        indexes = [
+            UniqueIndex(Lower('title'), name='company_title_lower_uniq'),
+            models.Index(fields=['projects_not_started'], name='company_not_started_idx'),
+            models.Index(fields=['projects_in_process'], name='company_in_process_idx'),
+            models.Index(fields=['projects_completed'], name='company_completed_idx'),
+            models.Index(fields=['interactions_phone'], name='company_phone_idx'),
+            models.Index(fields=['interactions_email'], name='company_email_idx'),
+            models.Index(fields=['interactions_messenger'], name='company_messenger_idx'),
+            models.Index(fields=['last_interaction_date'], name='company_last_interaction_idx'),
+        ]
 
     def __str__(self):
         """
@@ -37,6 +149,18 @@ class Company(models.Model):
         """
         return self.title
 
+    def save(self, *args, **kwargs):
+        """
+        Заполняет title_key по названию (см. fold_title()).
+        """
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None and 'title' not in self.get_deferred_fields():
+            self.title_key = fold_title(self.title)
+        elif update_fields is not None and 'title' in update_fields:
+            self.title_key = fold_title(self.title)
+            kwargs['update_fields'] = set(update_fields) | {'title_key'}
+        return super().save(*args, **kwargs)
+
     def get_absolute_url(self):
         """
         :return: возвращает url - company-detail
@@ -112,7 +236,8 @@ class User(AbstractUser):
     """
     Класс User представляет информацию о пользователях сайта.
     """
-    photo = models.ImageField(default='default1.jpg', null=True, blank=True, help_text='―――――')
+    photo = models.ImageField(default='default1.jpg', null=True, blank=True, help_text='―――――',
+                              storage=content_storage)
     is_manager = models.BooleanField(default=False, verbose_name='Менеджер')
     is_customer = models.BooleanField(default=False, verbose_name='Заказчик')
     is_admin = models.BooleanField(default=False, verbose_name='Админ')
@@ -211,32 +336,107 @@ def start_date_valid(value):
                                'быть раньше сегодняшнего дня'))
 
 
-class Project(models.Model):
+class ProjectQuerySet(models.QuerySet):
+    """
+    Класс ProjectQuerySet вычисляет статус проекта в момент запроса по датам начала и окончания проекта,
+    в отличие от поля status_pro, которое обновляется только при сохранении проекта.
+    """
+
+    def with_status(self):
+        """
+        Добавляет к проектам вычисляемое поле current_status (для отображения и сортировки по статусу).
+        """
+        now = timezone.now()
+        return self.annotate(current_status=models.Case(
+            models.When(start_date__gt=now, then=models.Value(Project.status_not_started)),
+            models.When(end_date__lt=now, then=models.Value(Project.status_completed)),
+            default=models.Value(Project.status_in_process),
+            output_field=models.CharField(max_length=100),
+        ))
+
+    def filter_status(self, status, now=None):
+        """
+        Оставляет проекты со статусом status на момент now (по умолчанию - текущий).
+        Условие записано через start_date и end_date, поэтому использует индексы по датам,
+        а не вычисляемое поле.
+        """
+        return self.filter(status_q(status, now or timezone.now()))
+
+    def count_status(self, status, now):
+        """
+        Возвращает одним запросом количество проектов со статусом status на момент now
+        и ближайшую после now смену статуса (начало или окончание) одного из проектов или None.
+        """
+        result = self.aggregate(
+            count=models.Count('pk', filter=status_q(status, now)),
+            start=models.Min('start_date', filter=models.Q(start_date__gt=now)),
+            end=models.Min('end_date', filter=models.Q(end_date__gte=now)),
+        )
+        changes = [result[field] for field in ('start', 'end') if result[field] is not None]
+        return result['count'], min(changes) if changes else None
+
+
+def status_q(status, now):
+    """
+    Возвращает условие на даты проекта для статуса status на момент now.
+    """
+    if status == Project.status_not_started:
+        return models.Q(start_date__gt=now)
+    if status == Project.status_in_process:
+        return models.Q(start_date__lte=now, end_date__gte=now)
+    if status == Project.status_completed:
+        return models.Q(start_date__lte=now, end_date__lt=now)
+    return models.Q(pk__in=[])
+
+
+class Project(RichTextMixin, models.Model):
     """
     Класс Project представляет информацию о проектах компаний на сайте.
     """
+    status_not_started = 'Еще не начат'
+    status_in_process = 'В процессе разработки'
+    status_completed = 'Выполнен'
+
     company = models.ForeignKey('Company', on_delete=models.CASCADE, null=True,
                                 verbose_name='Название компании',
                                 help_text='―――――')
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, null=True,
                                  verbose_name='Заказчик проекта', help_text='―――――')
-    name = models.CharField(max_length=100, unique=True,
+    name = models.CharField(max_length=100, db_index=True,
                             help_text='―――――', verbose_name='Название проекта',)
-    description = RichTextField(max_length=1000, null=True,
+    description = RichTextUploadingField(max_length=1000, null=True,
                                 help_text='―――――',
                                 verbose_name='Краткое описание')
+    description_html = description_html_field()
+    description_excerpt = description_excerpt_field()
     start_date = models.DateTimeField(verbose_name='Дата начала проекта', help_text='― дд.мм.гггг.')
     end_date = models.DateTimeField(verbose_name='Дата окончания проекта', help_text='― дд.мм.гггг.')
     price = models.IntegerField(verbose_name='Стоимость проекта', help_text='― в долларах США')
-    status_pro = models.CharField(max_length=100, default='Еще не начат',
+    status_pro = models.CharField(max_length=100, default=status_not_started,
                                   verbose_name='Статус проекта', help_text='―――――')
+    updated_date = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    objects = ProjectQuerySet.as_manager()
 
     class Meta:
         """
-        Класс содержит ordering.
+        Класс содержит ordering, индексы, уникальный индекс по названию без учета регистра
+        и проверку дат проекта на уровне базы данных. Страницы статусов компании читаются
+        по индексу (company, start_date) уже отсортированными; сортировка по вычисляемому
+        статусу (current_status) индекса не имеет и сортирует все строки запроса.
         """
         ordering = ['name', '-name', 'company', 'price', 'start_date', 'end_date', 'status_pro']
-        pass
+        constraints = [
+            models.CheckConstraint(check=models.Q(end_date__gt=models.F('start_date')), name='project_dates_check'),
+        ]
+        indexes = [
+            UniqueIndex(Lower('name'), name='project_name_lower_uniq'),
+            models.Index(fields=['company', 'start_date'], name='project_company_start_idx'),
+            models.Index(fields=['customer', 'start_date'], name='project_customer_idx'),
+            models.Index(fields=['start_date'], name='project_start_date_idx'),
+            models.Index(fields=['end_date'], name='project_end_date_idx'),
+            models.Index(fields=['price'], name='project_price_idx'),
+        ]
 
     def clean(self):
         """
@@ -260,13 +460,23 @@ class Project(models.Model):
         today = datetime.now()
         today = pytz.utc.localize(today)
         if self.start_date > today:
-            self.status_pro = 'Еще не начат'
+            self.status_pro = self.status_not_started
         elif self.start_date <= today <= self.end_date:
-            self.status_pro = 'В процессе разработки'
+            self.status_pro = self.status_in_process
         elif self.end_date < today:
-            self.status_pro = 'Выполнен'
+            self.status_pro = self.status_completed
         return super().save(*args, **kwargs)
 
+    def status_at(self, now):
+        """
+        Возвращает статус проекта на момент now, как ProjectQuerySet.with_status.
+        """
+        if self.start_date > now:
+            return self.status_not_started
+        if self.end_date < now:
+            return self.status_completed
+        return self.status_in_process
+
     def __str__(self):
         """
         String for representing the Model object.
@@ -274,13 +484,16 @@ class Project(models.Model):
         return self.name
 
 
-class Interaction(models.Model):
+class Interaction(RichTextMixin, models.Model):
     """
     Класс Interaction представляет информацию о взаимодействиях по проектам компаний на сайте.
     """
-    channels = [('Телефонный звонок', 'Телефонный звонок'),
-                ('Переписка по E-mail', 'Переписка по E-mail'),
-                ('Переписка в мессенджере', 'Переписка в мессенджере')]
+    channel_phone = 'Телефонный звонок'
+    channel_email = 'Переписка по E-mail'
+    channel_messenger = 'Переписка в мессенджере'
+    channels = [(channel_phone, channel_phone),
+                (channel_email, channel_email),
+                (channel_messenger, channel_messenger)]
 
     rating_com = [('☆', '☆'),
                   ('☆☆', '☆☆'),
@@ -302,15 +515,31 @@ class Interaction(models.Model):
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, null=True,
                                  verbose_name='Заказчик проекта', default=None, blank=True, help_text='―――――')
     created_date = models.DateTimeField(auto_now_add=True,)
+    updated_date = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
     user = models.ForeignKey(to=settings.AUTH_USER_MODEL, on_delete=models.SET_NULL,
                                 null=True,
                                 verbose_name='Менеджер',
                                 help_text='―――――')
-    description = RichTextField(max_length=1000, null=True,
+    description = RichTextUploadingField(max_length=1000, null=True,
                                 help_text='―――――',
                                 verbose_name='Описание')
+    description_html = description_html_field()
+    description_excerpt = description_excerpt_field()
     rating = models.CharField(max_length=100, choices=rating_com, verbose_name='Оценка', help_text='―――――')
 
+    class Meta:
+        """
+        Класс содержит индексы для списков взаимодействий по каналу связи.
+        """
+        indexes = [
+            models.Index(fields=['company', 'channel_of_reference', 'created_date'],
+                         name='interaction_company_chan_idx'),
+            models.Index(fields=['project', 'channel_of_reference', 'created_date'],
+                         name='interaction_project_chan_idx'),
+            models.Index(fields=['created_date'], name='interaction_created_idx'),
+            models.Index(fields=['channel_of_reference'], name='interaction_channel_idx'),
+        ]
+
     def __str__(self):
         """
         String for representing the Model object.
@@ -334,3 +563,109 @@ class Interaction(models.Model):
         """
         return reverse('interaction-detail', args=[str(self.id)])
 
+
+
+class RevenueSummary(models.Model):
+    """
+    Класс RevenueSummary - материализованная сводка выручки (сумма Project.price) и количества проектов
+    по компании, статусу проекта и месяцу начала проекта. Строки пересчитываются при изменении
+    проектов (crm.revenue), поэтому отчет не сканирует таблицу проектов.
+    """
+    company = models.ForeignKey('Company', on_delete=models.CASCADE, verbose_name='Название компании')
+    status_pro = models.CharField(max_length=100, verbose_name='Статус проекта')
+    month = models.DateField(verbose_name='Месяц начала проекта')
+    projects = models.PositiveIntegerField(default=0, verbose_name='Количество проектов')
+    revenue = models.BigIntegerField(default=0, verbose_name='Сумма стоимости проектов')
+
+    class Meta:
+        """
+        Класс содержит ordering, ограничение уникальности и индексы.
+        """
+        ordering = ['-month', 'company', 'status_pro']
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'status_pro', 'month'], name='revenue_summary_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['month', 'status_pro'], name='revenue_month_status_idx'),
+        ]
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return '%s, %s, %s' % (self.company_id, self.status_pro, self.month)
+
+
+class SearchDocument(models.Model):
+    """
+    Класс SearchDocument хранит текст компании, проекта или взаимодействия без HTML для полнотекстового
+    поиска (crm.search). Полнотекстовый индекс строится базой данных по этой таблице: FTS5 по полю stems
+    на SQLite и tsvector с GIN-индексом по title и body на PostgreSQL (миграция 0051).
+    """
+    kind_company = 'company'
+    kind_project = 'project'
+    kind_interaction = 'interaction'
+    kinds = [(kind_company, 'Компания'),
+             (kind_project, 'Проект'),
+             (kind_interaction, 'Взаимодействие')]
+    detail_urls = {kind_company: 'company-detail',
+                   kind_project: 'project-detail',
+                   kind_interaction: 'interaction-detail'}
+
+    kind = models.CharField(max_length=20, choices=kinds, verbose_name='Тип объекта')
+    object_id = models.PositiveIntegerField(verbose_name='Объект')
+    title = models.CharField(max_length=255, verbose_name='Заголовок')
+    body = models.TextField(blank=True, verbose_name='Текст')
+    stems = models.TextField(blank=True, editable=False, verbose_name='Основы слов')
+
+    class Meta:
+        """
+        Класс содержит ограничение уникальности.
+        """
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'], name='search_document_unique'),
+        ]
+
+    def get_absolute_url(self):
+        """
+        :return: возвращает url страницы найденного объекта
+        """
+        return reverse(self.detail_urls[self.kind], args=[str(self.object_id)])
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return self.title
+
+
+class JobState(models.Model):
+    """
+    Класс JobState хранит отметку (high-water mark) последнего запуска фоновой задачи,
+    чтобы следующий запуск обрабатывал только изменения, произошедшие после нее.
+    """
+    name = models.CharField(max_length=100, unique=True, verbose_name='Задача')
+    high_water_mark = models.DateTimeField(null=True, blank=True, verbose_name='Отметка последнего запуска')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return self.name
+
+
+class MediaBlob(models.Model):
+    """
+    Класс MediaBlob учитывает файл хранилища по содержимому (crm.storage.ContentAddressedStorage):
+    размер и количество ссылок на него из моделей. Файлы без ссылок удаляет команда collect_media.
+    """
+    name = models.CharField(max_length=255, unique=True, verbose_name='Файл')
+    size = models.PositiveBigIntegerField(verbose_name='Размер')
+    references = models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')
+    created_date = models.DateTimeField(auto_now_add=True, verbose_name='Дата загрузки')
+
+    def __str__(self):
+        """
+        String for representing the Model object.
+        """
+        return self.name
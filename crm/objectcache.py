@@ -0,0 +1,199 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+from crm.cache import get_versions, object_version_name
+
+
+OBJECT_CACHE_SIZE = getattr(settings, 'CRM_OBJECT_CACHE_SIZE', 1000)
+OBJECT_CACHE_TIMEOUT = getattr(settings, 'CRM_OBJECT_CACHE_TIMEOUT', 60 * 60)
+OBJECT_CACHE_STATS_INTERVAL = getattr(settings, 'CRM_OBJECT_CACHE_STATS_INTERVAL', 60)
+STATS_NAMES = ('local', 'shared', 'miss')
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def row_layout(model):
+    """
+    Возвращает (имена столбцов строки модели model, метка их состава для ключа кэша): после миграции,
+    меняющей столбцы, строки старого состава не читаются.
+    """
+    attnames = tuple(field.attname for field in model._meta.concrete_fields)
+    return attnames, '%08x' % zlib.crc32(','.join(attnames).encode())
+
+
+def relation_tree(relations):
+    """
+    Возвращает дерево связей {поле: {поле связанной модели: ...}} из путей в формате select_related,
+    например ('project__company', 'project__customer__user').
+    """
+    tree = {}
+    for path in relations:
+        node = tree
+        for name in path.split('__'):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class ObjectCache:
+    """
+    Класс ObjectCache - сквозной кэш строк моделей по pk. Строка хранится компактно - кортежем значений
+    столбцов, как она пришла из базы данных, - под ключом с версией объекта (crm.cache.invalidate_object),
+    которую сигналы моделей увеличивают при сохранении и удалении, и составом столбцов (row_layout),
+    поэтому устаревшие строки не читаются ни в одном процессе. Поиск двухуровневый: LRU в памяти
+    процесса на OBJECT_CACHE_SIZE строк, затем общий кэш Django, затем база данных. Связанные объекты (пути select_related)
+    кэшируются отдельно, каждый со своей версией, и собираются в объект по внешним ключам.
+    Счетчики попаданий и промахов процесса возвращает stats(); раз в OBJECT_CACHE_STATS_INTERVAL секунд
+    они добавляются к общим счетчикам всех процессов (shared_stats(), команда object_cache_stats)
+    и записываются в журнал.
+    """
+
+    def __init__(self, size=OBJECT_CACHE_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+        self.local = OrderedDict()
+        self.counts = Counter()
+        self.published = Counter()
+        self.published_at = time.monotonic()
+
+    def get_rows(self, model, pks):
+        """
+        Возвращает {pk: строка} существующих объектов pks модели model.
+        """
+        attnames, layout = row_layout(model)
+        names = {pk: object_version_name(model, pk) for pk in pks}
+        versions = get_versions(list(names.values()))
+        keys = {'object_row:%s:%s:%s' % (name, versions[name], layout): pk for pk, name in names.items()}
+        rows, missing = {}, []
+        with self.lock:
+            for key, pk in keys.items():
+                row = self.local.get(key)
+                if row is None:
+                    missing.append(key)
+                else:
+                    self.local.move_to_end(key)
+                    rows[pk] = row
+        self.counts['local'] += len(rows)
+        if missing:
+            shared = cache.get_many(missing)
+            self.counts['shared'] += len(shared)
+            fetch = {keys[key]: key for key in missing if key not in shared}
+            if fetch:
+                self.counts['miss'] += len(fetch)
+                position = attnames.index(model._meta.pk.attname)
+                loaded = {}
+                for row in model._base_manager.filter(pk__in=list(fetch)).order_by().values_list(*attnames):
+                    loaded[fetch[row[position]]] = row
+                cache.set_many(loaded, OBJECT_CACHE_TIMEOUT)
+                shared.update(loaded)
+            self.remember(shared)
+            rows.update((keys[key], row) for key, row in shared.items())
+        if time.monotonic() - self.published_at >= OBJECT_CACHE_STATS_INTERVAL:
+            self.publish_stats()
+        return rows
+
+    def remember(self, rows):
+        """
+        Запоминает строки {ключ: строка} в LRU процесса, вытесняя давно не читанные.
+        """
+        with self.lock:
+            self.local.update(rows)
+            for key in rows:
+                self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def get_objects(self, model, pks):
+        """
+        Возвращает {pk: объект} существующих объектов pks модели model.
+        """
+        attnames = row_layout(model)[0]
+        return {pk: model.from_db(DEFAULT_DB_ALIAS, attnames, row) for pk, row in self.get_rows(model, pks).items()}
+
+    def attach(self, objects, model, tree):
+        """
+        Загружает объектам objects модели model связанные объекты по дереву связей tree
+        и запоминает их в объектах, как это делает select_related.
+        """
+        for name, subtree in tree.items():
+            field = model._meta.get_field(name)
+            pks = {getattr(obj, field.attname) for obj in objects} - {None}
+            related = self.get_objects(field.related_model, pks) if pks else {}
+            for obj in objects:
+                field.set_cached_value(obj, related.get(getattr(obj, field.attname)))
+            if subtree and related:
+                self.attach(list(related.values()), field.related_model, subtree)
+
+    def get(self, model, pk, relations=()):
+        """
+        Возвращает объект pk модели model со связанными объектами relations (пути select_related).
+        :raise model.DoesNotExist: если объекта нет
+        """
+        obj = self.get_objects(model, [pk]).get(pk)
+        if obj is None:
+            raise model.DoesNotExist('%s с pk=%s не найден' % (model._meta.object_name, pk))
+        self.attach([obj], model, relation_tree(relations))
+        return obj
+
+    def stats(self):
+        """
+        Возвращает счетчики процесса: попадания в LRU (local), в общий кэш (shared), промахи (miss)
+        и долю попаданий hit_ratio.
+        """
+        counts = {name: self.counts[name] for name in ('local', 'shared', 'miss')}
+        total = sum(counts.values())
+        counts['hit_ratio'] = (counts['local'] + counts['shared']) / total if total else 0.0
+        return counts
+
+    def publish_stats(self):
+        """
+        Добавляет к общим счетчикам в кэше Django попадания и промахи процесса с прошлого вызова
+        и записывает счетчики процесса в журнал.
+        """
+        self.published_at = time.monotonic()
+        for name in STATS_NAMES:
+            delta = self.counts[name] - self.published[name]
+            if delta:
+                cache.add('object_cache_stats:%s' % name, 0, None)
+                cache.incr('object_cache_stats:%s' % name, delta)
+                self.published[name] += delta
+        logger.info('Кэш объектов процесса %d: %s', os.getpid(), self.stats())
+
+    def clear(self):
+        """
+        Очищает LRU процесса и счетчики.
+        """
+        with self.lock:
+            self.local.clear()
+        self.counts.clear()
+        self.published.clear()
+
+
+def shared_stats():
+    """
+    Возвращает общие счетчики всех процессов (см. ObjectCache.publish_stats) в формате ObjectCache.stats().
+    """
+    values = cache.get_many(['object_cache_stats:%s' % name for name in STATS_NAMES])
+    counts = {name: values.get('object_cache_stats:%s' % name, 0) for name in STATS_NAMES}
+    total = sum(counts.values())
+    counts['hit_ratio'] = (counts['local'] + counts['shared']) / total if total else 0.0
+    return counts
+
+
+def reset_shared_stats():
+    """
+    Обнуляет общие счетчики всех процессов.
+    """
+    cache.delete_many(['object_cache_stats:%s' % name for name in STATS_NAMES])
+
+
+object_cache = ObjectCache()
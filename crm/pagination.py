@@ -0,0 +1,272 @@
+import base64
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import F, Q, QuerySet
+from django.http import Http404
+from django.utils.functional import cached_property
+
+from crm.cache import get_versions, COUNT_TIMEOUT
+
+
+COUNT_ESTIMATE_THRESHOLD = getattr(settings, 'CRM_COUNT_ESTIMATE_THRESHOLD', 100000)
+
+
+def encode_value(value):
+    """
+    Сериализует значение ключа сортировки для JSON. Даты - в ISO с микросекундами,
+    чтобы сравнение с курсором было точным.
+    """
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    raise TypeError('Неподдерживаемое значение курсора: %r' % value)
+
+
+class CursorPage:
+    """
+    Класс CursorPage - страница курсорной пагинации. В отличие от django.core.paginator.Page
+    не знает номера страницы и общего количества страниц, зато знает курсор следующей страницы.
+    """
+
+    def __init__(self, object_list, cursor, next_cursor):
+        self.object_list = object_list
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Класс CursorPaginator разбивает queryset на страницы по ключу сортировки (keyset pagination):
+    следующая страница начинается после последней строки предыдущей (WHERE ключ > курсор LIMIT n),
+    без OFFSET и без SELECT COUNT(*), поэтому стоимость страницы не зависит от ее номера.
+    Ключ - поля сортировки queryset и pk (в направлении последнего поля сортировки, чтобы хватало
+    одного индекса); сортировка по ForeignKey заменяется на первое поле ordering связанной модели,
+    как это делает Django. NULL считается меньше любого значения.
+    """
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = [str(field) for field in queryset.query.order_by] or ['pk']
+        self.keys = [self.resolve_key(field) for field in self.ordering]
+        self.keys.append(('pk', self.keys[-1][1] if self.keys else False, False))
+
+    def resolve_key(self, field):
+        """
+        Возвращает (путь к полю, по убыванию, может ли быть NULL) для элемента сортировки field.
+        """
+        descending = field.startswith('-')
+        path = field.lstrip('-')
+        if path in self.queryset.query.annotations:
+            return path, descending, False
+        model, nullable, parts = self.queryset.model, False, []
+        for name in path.split('__'):
+            model_field = model._meta.get_field(name)
+            nullable = nullable or model_field.null
+            parts.append(name)
+            model = model_field.related_model
+        while model_field.is_relation and model._meta.ordering:
+            related_ordering = model._meta.ordering
+            model_field = model._meta.get_field(related_ordering[0].lstrip('-'))
+            nullable = nullable or model_field.null
+            parts.append(model_field.name)
+            model = model_field.related_model
+        return '__'.join(parts), descending, nullable
+
+    def encode_cursor(self, obj):
+        """
+        Возвращает непрозрачный курсор (base64 от JSON) со значениями ключа сортировки строки obj.
+        """
+        values = [getattr(obj, 'cursor_%d' % i) for i in range(len(self.keys))]
+        data = json.dumps({'o': self.ordering, 'v': values}, default=encode_value)
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        """
+        Возвращает значения ключа сортировки из курсора. Возбуждает Http404 для неверного курсора.
+        """
+        try:
+            data = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values = data['v']
+        except (ValueError, TypeError, KeyError):
+            raise Http404('Неверный курсор страницы')
+        if data.get('o') != self.ordering or not isinstance(values, list) or len(values) != len(self.keys):
+            raise Http404('Неверный курсор страницы')
+        return values
+
+    def after_q(self, keys, values):
+        """
+        Возвращает условие "строка идет после строки с ключом values" в порядке сортировки keys.
+        Условие записано как "поле >= значение И (поле > значение ИЛИ ...)", чтобы первая часть
+        была диапазоном по индексу и база данных читала индекс в порядке сортировки.
+        """
+        (path, descending, nullable), value = keys[0], values[0]
+        if value is None:
+            strict = None if descending else Q(**{path + '__isnull': False})
+            bound = Q(**{path + '__isnull': True}) if descending else None
+            same = Q(**{path + '__isnull': True})
+        else:
+            strict = Q(**{path + ('__lt' if descending else '__gt'): value})
+            bound = Q(**{path + ('__lte' if descending else '__gte'): value})
+            if descending and nullable:
+                strict |= Q(**{path + '__isnull': True})
+                bound |= Q(**{path + '__isnull': True})
+            same = Q(**{path: value})
+        if len(keys) == 1:
+            return strict if strict is not None else Q(pk__in=[])
+        rest = same & self.after_q(keys[1:], values[1:])
+        condition = rest if strict is None else strict | rest
+        return condition if bound is None else bound & condition
+
+    def ordered_queryset(self):
+        """
+        Возвращает queryset, отсортированный по ключу (NULL меньше любого значения), со значениями ключа
+        в полях cursor_0, cursor_1, ... для encode_cursor().
+        """
+        order_by = []
+        for path, descending, nullable in self.keys:
+            if descending:
+                order_by.append(F(path).desc(nulls_last=True) if nullable else F(path).desc())
+            else:
+                order_by.append(F(path).asc(nulls_first=True) if nullable else F(path).asc())
+        queryset = self.queryset.annotate(**{'cursor_%d' % i: F(key[0]) for i, key in enumerate(self.keys)})
+        return queryset.order_by(*order_by)
+
+    def page_queryset(self, cursor=None):
+        """
+        Возвращает queryset строк страницы после курсора cursor (на одну строку больше per_page,
+        чтобы узнать, есть ли следующая страница).
+        """
+        queryset = self.ordered_queryset()
+        if cursor:
+            queryset = queryset.filter(self.after_q(self.keys, self.decode_cursor(cursor)))
+        return queryset[:self.per_page + 1]
+
+    def page(self, cursor=None):
+        """
+        Возвращает страницу, начинающуюся после курсора cursor (первую, если курсора нет).
+        """
+        rows = list(self.page_queryset(cursor))
+        next_cursor = self.encode_cursor(rows[self.per_page - 1]) if len(rows) > self.per_page else None
+        return CursorPage(rows[:self.per_page], cursor, next_cursor)
+
+
+class CursorPaginationMixin:
+    """
+    Класс-примесь для ListView: включает курсорную пагинацию по параметру ?after=. Без него список
+    разбивается на страницы по номерам (?page=, paginator_class), как раньше, но в том же порядке,
+    что и курсорные страницы, и с курсором следующей страницы (page_obj.next_cursor): с любой
+    страницы можно перейти к курсорным без пропусков и повторов.
+    Сортировка берется из queryset, который возвращает get_queryset().
+    """
+    cursor_param = 'after'
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Возвращает (paginator, page, object_list, is_paginated) по курсору из параметра запроса
+        или по номеру страницы, если курсора в запросе нет.
+        """
+        cursor_paginator = CursorPaginator(queryset, page_size)
+        if self.cursor_param not in self.request.GET:
+            paginator, page, object_list, is_paginated = super().paginate_queryset(
+                cursor_paginator.ordered_queryset(), page_size)
+            page.next_cursor = cursor_paginator.encode_cursor(page[len(page) - 1]) if page.has_next() else None
+            return paginator, page, object_list, is_paginated
+        page = cursor_paginator.page(self.request.GET[self.cursor_param] or None)
+        return cursor_paginator, page, page.object_list, page.has_other_pages()
+
+
+def estimate_count(queryset):
+    """
+    Возвращает оценку количества строк queryset из плана запроса PostgreSQL (EXPLAIN), не выполняя его.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(queryset):
+    """
+    Возвращает количество строк queryset: на PostgreSQL - оценку планировщика, если она
+    больше COUNT_ESTIMATE_THRESHOLD, иначе SELECT COUNT(*).
+    """
+    count = None
+    if connections[queryset.db].vendor == 'postgresql':
+        count = estimate_count(queryset)
+    if count is None or count <= COUNT_ESTIMATE_THRESHOLD:
+        count = queryset.count()
+    return count
+
+
+def get_count(queryset, signature=None, count_function=None):
+    """
+    Возвращает количество строк queryset. Результат кэшируется по тексту и параметрам запроса
+    и версиям всех таблиц запроса, которые увеличиваются при записи в них (см. crm.signals).
+    Запрос, параметры которого зависят от текущего времени (дата среди параметров), кэшируется
+    только по signature - ключу, который вызывающий строит без времени, - иначе ключ не совпал бы
+    ни разу. count_function - функция без аргументов, которая при промахе возвращает
+    (количество строк, время жизни в кэше) вместо подсчета строк queryset или None.
+    На PostgreSQL при оценке планировщика больше COUNT_ESTIMATE_THRESHOLD возвращается оценка
+    вместо точного SELECT COUNT(*).
+    """
+    queryset = queryset.order_by().values('pk')
+    sql, params = queryset.query.sql_with_params()
+    if signature is None:
+        if any(isinstance(param, (datetime.date, datetime.time)) for param in params):
+            return count_rows(queryset)
+        signature = (sql, params)
+    tables = {join.table_name for join in queryset.query.alias_map.values()}
+    versions = get_versions(['table:%s' % table for table in tables])
+    key = 'count:%s' % hashlib.md5(repr((signature, sorted(versions.items()))).encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        counted = count_function() if count_function else None
+        count, timeout = counted or (count_rows(queryset), COUNT_TIMEOUT)
+        cache.set(key, count, timeout)
+    return count
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Класс CachedCountPaginator - Paginator, который берет количество строк из get_count(),
+    а не выполняет SELECT COUNT(*) на каждый запрос страницы. count_signature и count_function
+    передаются в get_count().
+    """
+
+    def __init__(self, *args, count_signature=None, count_function=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_signature = count_signature
+        self.count_function = count_function
+
+    @cached_property
+    def count(self):
+        """
+        Возвращает общее количество объектов на всех страницах.
+        """
+        if isinstance(self.object_list, QuerySet):
+            return get_count(self.object_list, self.count_signature, self.count_function)
+        return len(self.object_list)
@@ -0,0 +1,91 @@
+from datetime import datetime, date
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, DateField, Q, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from crm.cache import invalidate_table
+from crm.models import Project, RevenueSummary
+
+
+BATCH_SIZE = 200
+
+
+def month_of(value):
+    """
+    Возвращает первый день месяца даты value в текущем часовом поясе (как TruncMonth в базе данных).
+    """
+    return timezone.localtime(value).date().replace(day=1)
+
+
+def month_range(month):
+    """
+    Возвращает границы месяца month [начало, начало следующего месяца) как aware datetime.
+    """
+    next_month = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    return (timezone.make_aware(datetime(month.year, month.month, 1)),
+            timezone.make_aware(datetime(next_month.year, next_month.month, 1)))
+
+
+def revenue_rows(queryset):
+    """
+    Возвращает GROUP BY проектов queryset по компании, статусу и месяцу начала
+    с количеством проектов и суммой их стоимости.
+    """
+    return queryset.filter(company__isnull=False).order_by()\
+        .annotate(month=TruncMonth('start_date', output_field=DateField()))\
+        .values('company_id', 'status_pro', 'month')\
+        .annotate(projects=Count('pk'), revenue=Sum('price'))
+
+
+def live_revenue():
+    """
+    Возвращает сводку выручки, посчитанную по таблице проектов в момент запроса (без RevenueSummary).
+    """
+    return revenue_rows(Project.objects.all())
+
+
+def project_bucket(company_id, start_date):
+    """
+    Возвращает ключ (компания, месяц) строк сводки, в которые входит проект, или None для проекта без компании.
+    """
+    if company_id is None or start_date is None:
+        return None
+    return company_id, month_of(start_date)
+
+
+def refresh_revenue(buckets):
+    """
+    Пересчитывает строки сводки для ключей (компания, месяц) buckets: удаляет их и вставляет заново
+    по GROUP BY только проектов этих компаний за эти месяцы (по индексу компании и даты начала).
+    bulk_create не отправляет сигналы, поэтому кэш количества строк сводки сбрасывается явно.
+    """
+    buckets = sorted(bucket for bucket in set(buckets) if bucket is not None)
+    for i in range(0, len(buckets), BATCH_SIZE):
+        batch = buckets[i:i + BATCH_SIZE]
+        projects = reduce(or_, (Q(company_id=company_id, start_date__gte=month_range(month)[0],
+                                  start_date__lt=month_range(month)[1])
+                                for company_id, month in batch))
+        summary = reduce(or_, (Q(company_id=company_id, month=month) for company_id, month in batch))
+        with transaction.atomic():
+            RevenueSummary.objects.filter(summary).delete()
+            RevenueSummary.objects.bulk_create(
+                RevenueSummary(**row) for row in revenue_rows(Project.objects.filter(projects)))
+    if buckets:
+        invalidate_table(RevenueSummary._meta.db_table)
+
+
+def rebuild_revenue():
+    """
+    Строит сводку выручки заново по всем проектам.
+    :return: количество строк сводки
+    """
+    with transaction.atomic():
+        RevenueSummary.objects.all().delete()
+        summary = RevenueSummary.objects.bulk_create(
+            (RevenueSummary(**row) for row in live_revenue()), batch_size=1000)
+    invalidate_table(RevenueSummary._meta.db_table)
+    return len(summary)
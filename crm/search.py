@@ -0,0 +1,104 @@
+from django.db import connections, transaction
+
+from crm.cache import invalidate_table
+from crm.models import Company, Project, Interaction, SearchDocument
+from crm.text import html_to_text, stem, words, stem_text
+
+
+FTS_TABLE = 'crm_searchdocument_fts'
+
+SEARCH_SOURCES = {
+    Company: (SearchDocument.kind_company, ('title', 'leader_name', 'address', 'description')),
+    Project: (SearchDocument.kind_project, ('name', 'description')),
+    Interaction: (SearchDocument.kind_interaction, ('channel_of_reference', 'reference_obj', 'description')),
+}
+
+
+def document_fields(instance):
+    """
+    Возвращает (заголовок, текст) поискового документа для компании, проекта или взаимодействия.
+    """
+    if isinstance(instance, Company):
+        return instance.title, ' '.join([instance.leader_name, instance.address, html_to_text(instance.description)])
+    if isinstance(instance, Project):
+        return instance.name, html_to_text(instance.description)
+    title = ' '.join(filter(None, [instance.channel_of_reference, instance.reference_obj]))
+    return title, html_to_text(instance.description)
+
+
+def make_document(instance):
+    """
+    Возвращает несохраненный поисковый документ объекта instance.
+    """
+    title, body = document_fields(instance)
+    return SearchDocument(kind=SEARCH_SOURCES[type(instance)][0], object_id=instance.pk,
+                          title=title[:255], body=body, stems=stem_text(title + ' ' + body))
+
+
+def index_object(instance, update_fields=None):
+    """
+    Сохраняет поисковый документ объекта instance. Если сохранялись только поля update_fields,
+    не попадающие в документ, ничего не делает.
+    """
+    kind, fields = SEARCH_SOURCES[type(instance)]
+    if update_fields is not None and not set(update_fields) & set(fields):
+        return
+    document = make_document(instance)
+    SearchDocument.objects.update_or_create(kind=kind, object_id=instance.pk, defaults={
+        'title': document.title, 'body': document.body, 'stems': document.stems})
+
+
+def unindex_object(instance):
+    """
+    Удаляет поисковый документ объекта instance.
+    """
+    SearchDocument.objects.filter(kind=SEARCH_SOURCES[type(instance)][0], object_id=instance.pk).delete()
+
+
+def rebuild_search_index(batch_size=1000):
+    """
+    Строит поисковые документы заново по всем компаниям, проектам и взаимодействиям.
+    :return: количество документов
+    """
+    total = 0
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        for model in SEARCH_SOURCES:
+            last_pk = 0
+            while True:
+                batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                SearchDocument.objects.bulk_create(make_document(instance) for instance in batch)
+                total += len(batch)
+                last_pk = batch[-1].pk
+    invalidate_table(SearchDocument._meta.db_table)
+    return total
+
+
+def search(query, kinds=None):
+    """
+    Возвращает поисковые документы, подходящие под запрос query, от более к менее релевантным
+    (поле rank). Слова запроса приводятся к основам, все слова должны встречаться в документе.
+    На SQLite используется индекс FTS5 и bm25, на PostgreSQL - tsvector и ts_rank,
+    на остальных базах - поиск подстроки без ранжирования.
+    """
+    qs = SearchDocument.objects.all()
+    if kinds is not None:
+        qs = qs.filter(kind__in=kinds)
+    vendor = connections[qs.db].vendor
+    if vendor == 'postgresql':
+        tsquery = "plainto_tsquery('russian', %s)"
+        return qs.extra(select={'rank': 'ts_rank(search_vector, %s)' % tsquery}, select_params=[query],
+                        where=['search_vector @@ %s' % tsquery], params=[query], order_by=['-rank'])
+    terms = words(query)
+    if not terms:
+        return qs.none()
+    if vendor == 'sqlite':
+        match = ' '.join('"%s"' % stem(term) for term in terms)
+        return qs.extra(tables=[FTS_TABLE], select={'rank': 'bm25(%s)' % FTS_TABLE},
+                        where=['%s.rowid = crm_searchdocument.id' % FTS_TABLE, '%s MATCH %%s' % FTS_TABLE],
+                        params=[match], order_by=['rank'])
+    for term in terms:
+        qs = qs.filter(stems__contains=stem(term))
+    return qs.order_by('kind', 'title')
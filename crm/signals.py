@@ -0,0 +1,306 @@
+import logging
+
+from django.db.models import Q
+from django.db.models.signals import post_init, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from crm.cache import invalidate_customer_projects, invalidate_table, invalidate_object
+from crm.counters import STATUS_COUNTERS, CHANNEL_COUNTERS, change_counter, touch_last_interaction, \
+    refresh_last_interaction
+from crm.models import Company, Project, Customer, Interaction, ManagerCRM, Phone, Email, Manager, User
+from crm.revenue import project_bucket, refresh_revenue
+from crm.search import index_object, unindex_object
+from crm.storage import acquire, release
+from crm.thumbnails import make_thumbnails
+from crm.typeahead import TYPEAHEAD_SOURCES, typeahead_index
+
+
+logger = logging.getLogger(__name__)
+
+
+def customer_user_id(customer_id):
+    """
+    Возвращает pk пользователя заказчика customer_id или None.
+    """
+    if customer_id is None:
+        return None
+    return Customer.objects.filter(pk=customer_id).values_list('user_id', flat=True).first()
+
+
+@receiver(post_init, sender=Project)
+def remember_project_state(sender, instance, **kwargs):
+    """
+    Запоминает заказчика, компанию, статус и дату начала, с которыми проект был загружен, чтобы при их
+    смене сбросить кэш старого заказчика и поправить счетчики и сводку выручки старой компании.
+    Не обращается к отложенным полям.
+    """
+    instance._loaded_customer_id = instance.__dict__.get('customer_id')
+    instance._loaded_company_id = instance.__dict__.get('company_id')
+    instance._loaded_status_pro = instance.__dict__.get('status_pro')
+    instance._loaded_start_date = instance.__dict__.get('start_date')
+
+
+@receiver(post_save, sender=Project)
+@receiver(post_delete, sender=Project)
+def invalidate_project_customer(sender, instance, **kwargs):
+    """
+    Сбрасывает закэшированные списки проектов заказчика при сохранении или удалении его проекта.
+    """
+    customer_ids = {instance.customer_id, getattr(instance, '_loaded_customer_id', None)} - {None}
+    for customer_id in customer_ids:
+        if customer_id == instance.customer_id and Project.customer.is_cached(instance):
+            user_id = instance.customer.user_id
+        else:
+            user_id = customer_user_id(customer_id)
+        if user_id is not None:
+            invalidate_customer_projects(user_id)
+    instance._loaded_customer_id = instance.customer_id
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_table_counts(sender, **kwargs):
+    """
+    Сбрасывает закэшированные количества строк запросов к таблице модели приложения crm при записи в нее.
+    """
+    if sender._meta.app_label == 'crm':
+        invalidate_table(sender._meta.db_table)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_object_fragments(sender, instance, **kwargs):
+    """
+    Сбрасывает закэшированные фрагменты шаблонов с сохраненным или удаленным объектом приложения crm
+    (см. crm.templatetags.crm_cache).
+    """
+    if sender._meta.app_label == 'crm':
+        invalidate_object(sender, instance.pk)
+
+
+@receiver(post_save, sender=Project)
+def refresh_saved_project_revenue(sender, instance, **kwargs):
+    """
+    Пересчитывает строки сводки выручки за месяц проекта (и за прежние компанию и месяц при их смене).
+    Подключен до count_saved_project, который заменяет запомненную компанию на новую.
+    """
+    refresh_revenue({project_bucket(instance._loaded_company_id, instance._loaded_start_date),
+                     project_bucket(instance.company_id, instance.start_date)})
+    instance._loaded_start_date = instance.start_date
+
+
+@receiver(post_delete, sender=Project)
+def refresh_deleted_project_revenue(sender, instance, **kwargs):
+    """
+    Пересчитывает строки сводки выручки за месяц удаленного проекта.
+    """
+    refresh_revenue({project_bucket(instance.company_id, instance.start_date)})
+
+
+@receiver(post_save, sender=Project)
+def count_saved_project(sender, instance, created, **kwargs):
+    """
+    Обновляет счетчики проектов по статусам у компании проекта (и у прежней компании при переносе).
+    """
+    old = (None, None) if created else (instance._loaded_company_id, instance._loaded_status_pro)
+    new = (instance.company_id, instance.status_pro)
+    if old != new:
+        change_counter(old[0], STATUS_COUNTERS.get(old[1]), -1)
+        change_counter(new[0], STATUS_COUNTERS.get(new[1]), 1)
+    instance._loaded_company_id, instance._loaded_status_pro = new
+
+
+@receiver(post_delete, sender=Project)
+def count_deleted_project(sender, instance, **kwargs):
+    """
+    Уменьшает счетчик проектов по статусу у компании удаленного проекта.
+    """
+    change_counter(instance.company_id, STATUS_COUNTERS.get(instance.status_pro), -1)
+
+
+@receiver(post_init, sender=Interaction)
+def remember_interaction_state(sender, instance, **kwargs):
+    """
+    Запоминает компанию и канал связи, с которыми взаимодействие было загружено.
+    """
+    instance._loaded_company_id = instance.__dict__.get('company_id')
+    instance._loaded_channel = instance.__dict__.get('channel_of_reference')
+
+
+@receiver(post_save, sender=Interaction)
+def count_saved_interaction(sender, instance, created, **kwargs):
+    """
+    Обновляет счетчики взаимодействий по каналам и дату последнего взаимодействия компании.
+    """
+    old = (None, None) if created else (instance._loaded_company_id, instance._loaded_channel)
+    new = (instance.company_id, instance.channel_of_reference)
+    if old != new:
+        change_counter(old[0], CHANNEL_COUNTERS.get(old[1]), -1)
+        change_counter(new[0], CHANNEL_COUNTERS.get(new[1]), 1)
+        if old[0] != new[0]:
+            refresh_last_interaction(old[0])
+            touch_last_interaction(new[0], instance.created_date)
+    instance._loaded_company_id, instance._loaded_channel = new
+
+
+@receiver(post_delete, sender=Interaction)
+def count_deleted_interaction(sender, instance, **kwargs):
+    """
+    Уменьшает счетчик взаимодействий по каналу и пересчитывает дату последнего взаимодействия компании.
+    """
+    change_counter(instance.company_id, CHANNEL_COUNTERS.get(instance.channel_of_reference), -1)
+    refresh_last_interaction(instance.company_id)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Interaction)
+def index_saved_object(sender, instance, update_fields=None, **kwargs):
+    """
+    Обновляет поисковый документ сохраненной компании, проекта или взаимодействия.
+    """
+    index_object(instance, update_fields)
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Interaction)
+def unindex_deleted_object(sender, instance, **kwargs):
+    """
+    Удаляет поисковый документ удаленной компании, проекта или взаимодействия.
+    """
+    unindex_object(instance)
+
+
+@receiver(post_save, sender=Company)
+@receiver(post_save, sender=Project)
+@receiver(post_save, sender=Customer)
+@receiver(post_save, sender=ManagerCRM)
+def update_typeahead(sender, instance, **kwargs):
+    """
+    Обновляет имя объекта в индексе подсказок после фиксации транзакции.
+    """
+    pk, name = instance.pk, getattr(instance, TYPEAHEAD_SOURCES[sender][1])
+    transaction.on_commit(lambda: typeahead_index.update(sender, pk, name))
+
+
+@receiver(post_delete, sender=Company)
+@receiver(post_delete, sender=Project)
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=ManagerCRM)
+def remove_typeahead(sender, instance, **kwargs):
+    """
+    Удаляет объект из индекса подсказок после фиксации транзакции.
+    """
+    pk = instance.pk
+    transaction.on_commit(lambda: typeahead_index.remove(sender, pk))
+
+
+@receiver(post_save, sender=Phone)
+@receiver(post_save, sender=Email)
+@receiver(post_save, sender=Manager)
+@receiver(post_delete, sender=Phone)
+@receiver(post_delete, sender=Email)
+@receiver(post_delete, sender=Manager)
+def touch_contact_company(sender, instance, **kwargs):
+    """
+    Обновляет дату изменения компании и сбрасывает фрагменты шаблонов с ней при изменении
+    ее телефонов, e-mail и контактных лиц: они отображаются на странице компании, ETag которой
+    строится по этой дате.
+    """
+    if instance.company_id is not None:
+        Company.objects.filter(pk=instance.company_id).update(updated_date=timezone.now())
+        invalidate_table(Company._meta.db_table)
+        invalidate_object(Company, instance.company_id)
+
+
+@receiver(post_init, sender=User)
+def remember_user_name(sender, instance, **kwargs):
+    """
+    Запоминает имя и фамилию, с которыми пользователь был загружен. Не обращается к отложенным полям.
+    """
+    instance._loaded_name = (instance.__dict__.get('first_name'), instance.__dict__.get('last_name'))
+
+
+@receiver(post_save, sender=User)
+def touch_user_pages(sender, instance, created, **kwargs):
+    """
+    Обновляет дату изменения проектов заказчика и взаимодействий менеджера или по проектам заказчика
+    при смене имени или фамилии пользователя: они отображаются на страницах проектов и взаимодействий,
+    Last-Modified которых строится по этой дате.
+    """
+    name = (instance.__dict__.get('first_name'), instance.__dict__.get('last_name'))
+    if created or name == instance._loaded_name:
+        return
+    instance._loaded_name = name
+    now = timezone.now()
+    for model, lookup in ((Project, Q(customer__user=instance)),
+                          (Interaction, Q(user=instance) | Q(project__customer__user=instance))):
+        pks = list(model.objects.filter(lookup).values_list('pk', flat=True))
+        if pks:
+            model.objects.filter(pk__in=pks).update(updated_date=now)
+            invalidate_table(model._meta.db_table)
+            for pk in pks:
+                invalidate_object(model, pk)
+
+
+def make_photo_thumbnails(name):
+    """
+    Создает уменьшенные копии фотографии name. Ошибка не мешает сохранению пользователя:
+    недостающие копии будут созданы при первом запросе (ThumbnailView) или командой make_thumbnails.
+    """
+    try:
+        make_thumbnails(name)
+    except (OSError, ValueError):
+        logger.exception('Не удалось создать уменьшенные копии %s', name)
+
+
+@receiver(post_save, sender=User)
+def make_user_photo_thumbnails(sender, instance, update_fields=None, **kwargs):
+    """
+    Создает уменьшенные копии загруженной фотографии пользователя после фиксации транзакции.
+    """
+    if instance.photo and (update_fields is None or 'photo' in update_fields):
+        name = instance.photo.name
+        transaction.on_commit(lambda: make_photo_thumbnails(name))
+
+
+def photo_name(value):
+    """
+    Возвращает имя файла фотографии по значению поля (строка из базы данных или FieldFile) или None.
+    """
+    return getattr(value, 'name', value) or None
+
+
+@receiver(post_init, sender=User)
+def remember_user_photo(sender, instance, **kwargs):
+    """
+    Запоминает фотографию, с которой пользователь был загружен, чтобы при ее смене уменьшить счетчик
+    ссылок на старый файл. Не обращается к отложенным полям.
+    """
+    instance._loaded_photo = photo_name(instance.__dict__.get('photo'))
+
+
+@receiver(post_save, sender=User)
+def count_user_photo_references(sender, instance, created, **kwargs):
+    """
+    Обновляет счетчики ссылок MediaBlob на новую и прежнюю фотографии пользователя.
+    """
+    if 'photo' not in instance.__dict__:
+        return
+    old = None if created else instance._loaded_photo
+    new = photo_name(instance.__dict__['photo'])
+    if old != new:
+        release(old)
+        acquire(new)
+    instance._loaded_photo = new
+
+
+@receiver(post_delete, sender=User)
+def release_user_photo(sender, instance, **kwargs):
+    """
+    Уменьшает счетчик ссылок на фотографию удаленного пользователя.
+    """
+    release(photo_name(instance.__dict__.get('photo')))
@@ -0,0 +1,235 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+
+
+ACCESS_RESOLUTION = 60
+CULL_INTERVAL = 100
+EVENT_RETENTION = 10 * 60
+SQL_VARIABLES = 900
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache_entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, '
+    'accessed REAL NOT NULL) WITHOUT ROWID',
+    'CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_events (id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, '
+    'message BLOB NOT NULL, created REAL NOT NULL)',
+)
+
+
+class SQLiteCache(BaseCache):
+    """
+    Класс SQLiteCache - бэкенд кэша Django в файле SQLite (LOCATION) в режиме WAL, общий для всех
+    процессов gunicorn на одной машине и не требующий отдельного сервиса. Чтения не блокируют друг
+    друга и запись, записи коротки (одна строка в autocommit), incr и add атомарны между процессами.
+    Записи со сроком (TIMEOUT) перестают читаться по истечении срока; при превышении MAX_ENTRIES
+    удаляются просроченные и давно не читанные (LRU) записи. Время чтения обновляется не чаще раза
+    в ACCESS_RESOLUTION секунд, чтобы чтения горячих ключей не превращались в записи, а превышение
+    проверяется раз в CULL_INTERVAL записей процесса, поэтому MAX_ENTRIES соблюдается приблизительно.
+    Кроме того, бэкенд дает канал сообщений между процессами (publish, receive) для сброса данных,
+    которые процессы держат в памяти (см. crm.typeahead).
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self.path = location
+        self.local = threading.local()
+        self.writes = 0
+
+    @property
+    def connection(self):
+        """
+        Возвращает соединение текущего потока, открывая его при первом обращении и после fork.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return connection
+
+    def execute(self, sql, params=()):
+        """
+        Выполняет запрос в соединении текущего потока.
+        """
+        return self.connection.execute(sql, params)
+
+    def transaction(self, work):
+        """
+        Выполняет work(соединение) в транзакции BEGIN IMMEDIATE, которая сразу берет блокировку записи
+        и поэтому не может столкнуться с другой записью при переходе от чтения к записи.
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = work(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def make_checked_key(self, key, version):
+        """
+        Возвращает ключ записи с префиксом и версией кэша, проверив его допустимость.
+        """
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def fetch(self, keys):
+        """
+        Возвращает {ключ: значение} непросроченных записей keys и обновляет время чтения устаревших отметок.
+        """
+        now, found, touched = time.time(), {}, []
+        for i in range(0, len(keys), SQL_VARIABLES):
+            batch = keys[i:i + SQL_VARIABLES]
+            rows = self.execute('SELECT key, value, expires, accessed FROM cache_entries WHERE key IN (%s)'
+                                % ', '.join('?' * len(batch)), batch)
+            for key, value, expires, accessed in rows:
+                if expires is not None and expires <= now:
+                    continue
+                found[key] = pickle.loads(value)
+                if accessed < now - ACCESS_RESOLUTION:
+                    touched.append((now, key))
+        if touched:
+            self.connection.executemany('UPDATE cache_entries SET accessed = ? WHERE key = ?', touched)
+        return found
+
+    def written(self, count=1):
+        """
+        Учитывает записи процесса и раз в CULL_INTERVAL записей проверяет размер кэша.
+        """
+        self.writes += count
+        if self.writes >= CULL_INTERVAL:
+            self.writes = 0
+            self.cull()
+
+    def cull(self):
+        """
+        Удаляет просроченные записи и старые сообщения, а при превышении MAX_ENTRIES - давно не читанные
+        записи (1/CULL_FREQUENCY от MAX_ENTRIES, CULL_FREQUENCY = 0 - все).
+        """
+        now = time.time()
+        self.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,))
+        self.execute('DELETE FROM cache_events WHERE created < ?', (now - EVENT_RETENTION,))
+        count = self.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count > self._max_entries:
+            if self._cull_frequency == 0:
+                self.execute('DELETE FROM cache_entries')
+            else:
+                excess = count - self._max_entries + self._max_entries // self._cull_frequency
+                self.execute('DELETE FROM cache_entries WHERE key IN '
+                             '(SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)', (excess,))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_checked_key(key, version)
+        now = time.time()
+        added = self.execute(
+            'INSERT INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires = excluded.expires, '
+            'accessed = excluded.accessed WHERE cache_entries.expires <= ?',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), self.get_backend_timeout(timeout), now, now)).rowcount
+        if added:
+            self.written()
+        return bool(added)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_checked_key(key, version)
+        return self.fetch([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        names = {self.make_checked_key(key, version): key for key in keys}
+        return {names[key]: value for key, value in self.fetch(list(names)).items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        if not data:
+            return []
+        now, expires = time.time(), self.get_backend_timeout(timeout)
+        rows = [(self.make_checked_key(key, version), pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires, now)
+                for key, value in data.items()]
+        sql = 'INSERT OR REPLACE INTO cache_entries (key, value, expires, accessed) VALUES (?, ?, ?, ?)'
+        if len(rows) == 1:
+            self.execute(sql, rows[0])
+        else:
+            self.transaction(lambda connection: connection.executemany(sql, rows))
+        self.written(len(rows))
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_checked_key(key, version)
+        return bool(self.execute('UPDATE cache_entries SET expires = ? WHERE key = ? '
+                                 'AND (expires IS NULL OR expires > ?)',
+                                 (self.get_backend_timeout(timeout), key, time.time())).rowcount)
+
+    def delete(self, key, version=None):
+        key = self.make_checked_key(key, version)
+        return bool(self.execute('DELETE FROM cache_entries WHERE key = ?', (key,)).rowcount)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_checked_key(key, version) for key in keys]
+        for i in range(0, len(keys), SQL_VARIABLES):
+            batch = keys[i:i + SQL_VARIABLES]
+            self.execute('DELETE FROM cache_entries WHERE key IN (%s)' % ', '.join('?' * len(batch)), batch)
+
+    def has_key(self, key, version=None):
+        key = self.make_checked_key(key, version)
+        return self.execute('SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                            (key, time.time())).fetchone() is not None
+
+    def incr(self, key, delta=1, version=None):
+        checked = self.make_checked_key(key, version)
+
+        def increment(connection):
+            row = connection.execute('SELECT value FROM cache_entries WHERE key = ? '
+                                     'AND (expires IS NULL OR expires > ?)', (checked, time.time())).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            connection.execute('UPDATE cache_entries SET value = ? WHERE key = ?',
+                               (pickle.dumps(value, pickle.HIGHEST_PROTOCOL), checked))
+            return value
+
+        return self.transaction(increment)
+
+    def clear(self):
+        self.execute('DELETE FROM cache_entries')
+
+    def close(self, **kwargs):
+        """
+        Соединения остаются открытыми между запросами: открытие соединения дороже самого чтения.
+        """
+
+    def publish(self, channel, message):
+        """
+        Публикует message для процессов, читающих канал channel.
+        """
+        self.execute('INSERT INTO cache_events (channel, message, created) VALUES (?, ?, ?)',
+                     (channel, pickle.dumps(message, pickle.HIGHEST_PROTOCOL), time.time()))
+
+    def receive(self, channel, after=None):
+        """
+        Возвращает (номер последнего сообщения, сообщения канала channel после сообщения after).
+        При after=None сообщения не возвращаются - так читатель узнает, с какого номера начинать.
+        Сообщения хранятся EVENT_RETENTION секунд: отставший читатель должен перечитать данные целиком.
+        """
+        if after is None:
+            return self.execute('SELECT COALESCE(MAX(id), 0) FROM cache_events').fetchone()[0], []
+        rows = self.execute('SELECT id, message FROM cache_events WHERE id > ? AND channel = ? ORDER BY id',
+                            (after, channel)).fetchall()
+        if not rows:
+            return after, []
+        return rows[-1][0], [pickle.loads(message) for _, message in rows]
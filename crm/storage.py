@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+
+from django.apps import apps
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+CONTENT_DIRECTORY = 'cas'
+
+
+def content_name(digest, extension):
+    """
+    Возвращает имя файла с содержимым digest (SHA-256) и расширением extension.
+    """
+    return '%s/%s/%s%s' % (CONTENT_DIRECTORY, digest[:2], digest, extension.lower())
+
+
+def file_digest(file):
+    """
+    Возвращает SHA-256 содержимого файла Django, читая его кусками.
+    """
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def acquire(name):
+    """
+    Увеличивает счетчик ссылок на файл name, если это файл ContentAddressedStorage.
+    """
+    if name:
+        apps.get_model('crm', 'MediaBlob').objects.filter(name=name).update(references=F('references') + 1)
+
+
+def release(name):
+    """
+    Уменьшает счетчик ссылок на файл name; файл без ссылок удаляет команда collect_media.
+    """
+    if name:
+        apps.get_model('crm', 'MediaBlob').objects.filter(name=name)\
+            .update(references=Greatest(F('references') - 1, 0))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Класс ContentAddressedStorage - файловое хранилище, в котором имя файла - SHA-256 содержимого
+    (cas/ab/abcd...jpg). Загрузка пишется во временный файл с подсчетом хеша по кускам, без чтения
+    в память целиком, и атомарно переименовывается в имя по содержимому (поверх такого же файла,
+    если он уже есть). Содержимое по имени никогда не меняется, поэтому одинаковые загрузки хранятся
+    один раз. Переименование выполняется в одной транзакции с обновлением даты загрузки MediaBlob,
+    поэтому collect_media не удалит файл, загруженный заново во время сборки.
+    Каждый файл учитывается строкой MediaBlob со счетчиком ссылок из моделей (crm.signals):
+    файлы без ссылок удаляет команда collect_media.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        """
+        Имя определяется содержимым в _save, поэтому суффиксы для уникальности не нужны.
+        """
+        return name
+
+    def _save(self, name, content):
+        directory = self.path(CONTENT_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.upload')
+        try:
+            with os.fdopen(handle, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+            name = content_name(digest.hexdigest(), os.path.splitext(name)[1])
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            with transaction.atomic():
+                apps.get_model('crm', 'MediaBlob').objects.update_or_create(
+                    name=name, defaults={'size': os.path.getsize(temporary), 'created_date': timezone.now()})
+                os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return name
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,69 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+
+from crm.cache import get_versions, object_version_name
+
+
+register = template.Library()
+
+FRAGMENT_TIMEOUT = getattr(settings, 'CRM_FRAGMENT_TIMEOUT', 60 * 60)
+
+
+def user_role(context):
+    """
+    Возвращает роль пользователя шаблона: (вошел ли, менеджер, администратор, заказчик).
+    """
+    user = context.get('user')
+    if user is None or not user.is_authenticated:
+        return False, False, False, False
+    return True, user.is_manager, user.is_admin, user.is_customer
+
+
+class CacheObjectNode(template.Node):
+    """
+    Класс CacheObjectNode - фрагмент шаблона, закэшированный по имени, объектам моделей с их версиями,
+    остальным значениям и роли пользователя. Версии всех объектов читаются одним обращением к кэшу.
+    """
+
+    def __init__(self, nodelist, name, vary_on):
+        self.nodelist = nodelist
+        self.name = name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        values = [value.resolve(context) for value in self.vary_on]
+        names = {i: object_version_name(value, value.pk) for i, value in enumerate(values)
+                 if isinstance(value, models.Model)}
+        versions = get_versions(list(names.values()))
+        signature = [(names[i], versions[names[i]]) if i in names else value for i, value in enumerate(values)]
+        key = 'fragment:%s:%s' % (self.name, hashlib.md5(repr((user_role(context), signature)).encode()).hexdigest())
+        content = cache.get(key)
+        if content is None:
+            content = self.nodelist.render(context)
+            cache.set(key, content, FRAGMENT_TIMEOUT)
+        return content
+
+
+@register.tag('cacheobject')
+def do_cacheobject(parser, token):
+    """
+    Кэширует фрагмент шаблона до изменения объектов, от которых он зависит:
+
+        {% load crm_cache %}
+        {% cacheobject interaction_row object object.project object.user %} ... {% endcacheobject %}
+
+    Первый аргумент - имя фрагмента, остальные - объекты моделей (ключ меняется при их изменении,
+    см. crm.cache.invalidate_object) и другие значения, от которых зависит фрагмент. Роль пользователя
+    (is_manager, is_admin, is_customer) входит в ключ всегда, поэтому внутри фрагмента можно проверять
+    роль, но не самого пользователя.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError('%r принимает имя фрагмента и хотя бы один объект' % bits[0])
+    nodelist = parser.parse(('endcacheobject',))
+    parser.delete_first_token()
+    return CacheObjectNode(nodelist, bits[1], [parser.compile_filter(bit) for bit in bits[2:]])
@@ -0,0 +1,35 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html
+
+from crm.models import User
+from crm.thumbnails import thumbnail_name
+
+
+register = template.Library()
+
+
+def srcset(source, width, extension):
+    """
+    Возвращает srcset копий изображения source для ширины width на обычных и плотных (2x) экранах.
+    """
+    return '%s 1x, %s 2x' % (default_storage.url(thumbnail_name(source, width, extension)),
+                             default_storage.url(thumbnail_name(source, width * 2, extension)))
+
+
+@register.simple_tag
+def avatar(photo, width, css_class=''):
+    """
+    Выводит фотографию пользователя шириной width уменьшенными копиями (crm.thumbnails): WebP для
+    браузеров, которые его поддерживают, иначе JPEG, с копией двойной ширины для плотных экранов.
+    Без фотографии выводится фотография по умолчанию поля User.photo:
+
+        {% load crm_media %}
+        {% avatar object.user.photo 100 'd-flex mr-3' %}
+    """
+    source = photo.name if photo else User._meta.get_field('photo').default
+    jpeg = srcset(source, width, 'jpg')
+    return format_html('<picture><source type="image/webp" srcset="{}">'
+                       '<img class="{}" src="{}" srcset="{}" width="{}" alt="аватарка"></picture>',
+                       srcset(source, width, 'webp'), css_class,
+                       default_storage.url(thumbnail_name(source, width, 'jpg')), jpeg, width)
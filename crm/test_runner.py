@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TemporaryCacheRunner(DiscoverRunner):
+    """
+    Класс TemporaryCacheRunner запускает тесты с файлом кэша во временном каталоге:
+    cache.clear() в тестах не очищает общий кэш сервера, а файл не остается в каталоге проекта.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.cache_directory = tempfile.TemporaryDirectory()
+        location = os.path.join(self.cache_directory.name, 'cache.sqlite3')
+        self.cache_settings = override_settings(CACHES={'default': dict(settings.CACHES['default'],
+                                                                      LOCATION=location)})
+        self.cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.cache_settings.disable()
+        self.cache_directory.cleanup()
+        super().teardown_test_environment(**kwargs)
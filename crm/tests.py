@@ -1,3 +1,1761 @@
-from django.test import TestCase
+import csv
+import io
+import os
+import tempfile
+import time
+import zipfile
+from unittest import mock
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, IntegrityError, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.template import Context, Template
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse, resolve
+from django.utils import timezone
+
+from crm.cache import COUNT_TIMEOUT, status_count_timeout
+from crm.importer import import_file
+from crm.media import collect_garbage, fold_duplicates
+from crm.counters import COUNTER_FIELDS, recompute_counters
+from crm.management.commands.update_project_status import update_project_status
+from crm.objectcache import ObjectCache, object_cache, shared_stats
+from crm.pagination import CursorPaginator, get_count
+from crm.revenue import live_revenue, month_of, rebuild_revenue
+from crm.search import rebuild_search_index, search
+from crm.sqlite_cache import SQLiteCache
+from crm.storage import content_storage
+from crm.text import stem, html_to_text, sanitize_html, excerpt
+from crm.thumbnails import thumbnail_name
+from crm.typeahead import PrefixIndex, TypeaheadIndex, typeahead_index
+from PIL import Image
+from crm.models import Company, User, Project, Interaction, Customer, ManagerCRM, RevenueSummary, SearchDocument, \
+    Phone, Email, Manager, MediaBlob
+
+
+def create_projects(company, count, status_pro, prefix):
+    """
+    Создает count проектов компании с датами, соответствующими статусу status_pro,
+    одним запросом (bulk_create, без Project.save).
+    """
+    now = timezone.now()
+    offset = {Project.status_not_started: timedelta(days=1),
+              Project.status_in_process: timedelta(days=-1),
+              Project.status_completed: timedelta(days=-30)}[status_pro]
+    Project.objects.bulk_create([
+        Project(company=company, name='%s-%s-%d' % (company.pk, prefix, i), description='',
+                start_date=now + offset + timedelta(minutes=i), end_date=now + offset + timedelta(days=2, minutes=i),
+                price=100, status_pro=status_pro)
+        for i in range(count)
+    ], batch_size=500)
+
+
+class CompanyProjectsStatusDetailViewTest(TestCase):
+    """
+    Проверяет фильтрацию проектов компании по статусу на стороне базы данных.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 7, Project.status_in_process, 'match')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('projects_in_process', args=[self.company.pk])
+
+    def get_page(self, page):
+        """
+        Возвращает ответ и количество SQL-запросов для заданной страницы.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'page': page})
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_pages_contain_only_matching_projects(self):
+        create_projects(self.company, 50, Project.status_completed, 'other')
+        response, _ = self.get_page(1)
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.num_pages, 3)
+        self.assertEqual(len(page.object_list), 3)
+        self.assertTrue(all(p.current_status == Project.status_in_process for p in page.object_list))
+        response, _ = self.get_page(3)
+        self.assertEqual(len(response.context['page_obj'].object_list), 1)
+
+    def test_query_count_is_flat_as_company_grows(self):
+        create_projects(self.company, 10, Project.status_not_started, 'small')
+        self.get_page(1)
+        response, small_queries = self.get_page(2)
+        small_page = [p.pk for p in response.context['page_obj'].object_list]
+
+        create_projects(self.company, 10000, Project.status_not_started, 'large')
+        response, large_queries = self.get_page(2)
+        large_page = [p.pk for p in response.context['page_obj'].object_list]
+
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(small_page, large_page)
+        self.assertEqual(response.context['page_obj'].paginator.num_pages, 3)
+
+    def test_status_is_computed_at_query_time(self):
+        Project.objects.update(status_pro=Project.status_not_started)
+        response, _ = self.get_page(1)
+        self.assertEqual(response.context['page_obj'].paginator.count, 7)
+
+    def test_count_is_cached_between_requests(self):
+        self.get_page(1)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 7)
+        self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+
+    def test_status_pages_are_read_from_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('План запроса проверяется только для SQLite')
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            plan = Project.objects.filter(company=self.company).filter_status(status)\
+                .order_by('start_date', 'pk').explain()
+            self.assertIn('project_company_start_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_count_expires_at_next_status_change(self):
+        now = timezone.now()
+        projects = Project.objects.filter(company=self.company)
+        projects.update(end_date=now + timedelta(seconds=30))
+        count, change = projects.count_status(Project.status_in_process, now)
+        self.assertEqual((count, status_count_timeout(change, now)), (7, 31))
+        projects.update(end_date=now - timedelta(seconds=30))
+        count, change = projects.count_status(Project.status_in_process, now)
+        self.assertEqual((count, status_count_timeout(change, now)), (0, COUNT_TIMEOUT))
+
+
+class ProjectQuerySetTest(TestCase):
+    """
+    Проверяет вычисление статуса проекта в момент запроса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            create_projects(cls.company, 2, status, status)
+        Project.objects.update(status_pro=Project.status_not_started)
+
+    def test_with_status_matches_filter_status(self):
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            projects = Project.objects.filter_status(status).with_status()
+            self.assertEqual(len(projects), 2)
+            self.assertTrue(all(p.current_status == status for p in projects))
+
+    def test_order_by_current_status(self):
+        statuses = list(Project.objects.with_status().order_by('current_status')
+                        .values_list('current_status', flat=True))
+        self.assertEqual(statuses, sorted(statuses))
+        self.assertEqual(len(set(statuses)), 3)
+
+
+class UpdateProjectStatusTest(TestCase):
+    """
+    Проверяет фоновое обновление сохраненного статуса проектов.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            create_projects(cls.company, 3, status, status)
+
+    def assertStoredStatusIsCurrent(self, now):
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            self.assertFalse(Project.objects.filter_status(status, now).exclude(status_pro=status).exists())
+
+    def test_first_run_reconciles_all_projects(self):
+        Project.objects.update(status_pro=Project.status_not_started)
+        now = timezone.now()
+        updated = update_project_status(now)
+        self.assertEqual(updated[Project.status_in_process], 3)
+        self.assertEqual(updated[Project.status_completed], 3)
+        self.assertStoredStatusIsCurrent(now)
+
+    def test_next_runs_update_only_crossed_boundaries(self):
+        now = timezone.now()
+        update_project_status(now)
+        with self.assertNumQueries(6):
+            self.assertEqual(update_project_status(now + timedelta(seconds=1)),
+                             {Project.status_in_process: 0, Project.status_completed: 0})
+
+        later = now + timedelta(days=2)
+        updated = update_project_status(later)
+        self.assertEqual(updated[Project.status_in_process], 3)
+        self.assertEqual(updated[Project.status_completed], 3)
+        self.assertStoredStatusIsCurrent(later)
+
+        with self.assertNumQueries(15):
+            update_project_status(later + timedelta(days=1))
+
+
+class InteractionsChannelDetailViewTest(TestCase):
+    """
+    Проверяет фильтрацию взаимодействий с компанией и по проекту по каналу связи на стороне базы данных.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 1, Project.status_in_process, 'project')
+        cls.project = Project.objects.get()
+        Interaction.objects.bulk_create(
+            [Interaction(company=cls.company, project=cls.project, user=cls.user, rating='☆',
+                         reference_obj='с компанией', channel_of_reference=Interaction.channel_phone)
+             for _ in range(4)] +
+            [Interaction(company=cls.company, project=cls.project, user=cls.user, rating='☆',
+                         reference_obj='с компанией', channel_of_reference=Interaction.channel_email)
+             for _ in range(20)]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_company_and_project_pages_contain_only_channel(self):
+        for url in (reverse('company_interactions_phones', args=[self.company.pk]),
+                    reverse('project_interactions_phones', args=[self.project.pk])):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            self.assertEqual(page.paginator.count, 4)
+            self.assertEqual(page.paginator.num_pages, 2)
+            self.assertEqual({i.channel_of_reference for i in page.object_list}, {Interaction.channel_phone})
+
+    def test_messenger_page_is_empty(self):
+        response = self.client.get(reverse('project_interactions_messenger', args=[self.project.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['object_list']), 0)
+
+
+class ListQueryBudgetTest(TestCase):
+    """
+    Проверяет, что каждая страница списка укладывается в объявленный во view query_budget
+    и что количество запросов не зависит от количества строк на странице.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password',
+                                            is_manager=True, is_customer=True)
+        cls.customer = Customer.objects.create(user=cls.user, name='Заказчик')
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 1, Project.status_in_process, 'project')
+        cls.project = Project.objects.get()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def populate(self, count):
+        """
+        Добавляет по count строк во все модели, отображаемые списками.
+        """
+        offset = User.objects.count()
+        User.objects.bulk_create([User(username='user-%d' % (offset + i)) for i in range(count)])
+        users = User.objects.filter(username__startswith='user-').order_by('-pk')[:count]
+        ManagerCRM.objects.bulk_create([ManagerCRM(user=user, name='Менеджер') for user in users])
+        Customer.objects.bulk_create([Customer(user=user, name='Заказчик') for user in users])
+        Company.objects.bulk_create([Company(title='Компания-%d' % (offset + i), leader_name='Директор',
+                                             address='Адрес', description='<p>Описание</p>')
+                                     for i in range(count)])
+        create_projects(self.company, count, Project.status_in_process, 'budget-%d' % offset)
+        Project.objects.filter(customer=None).update(customer=self.customer)
+        Interaction.objects.bulk_create([
+            Interaction(company=self.company, project=self.project, user=self.user, rating='☆',
+                        reference_obj='с компанией', channel_of_reference=channel)
+            for channel, _ in Interaction.channels for _ in range(count)
+        ])
+        rebuild_revenue()
+        rebuild_search_index()
+
+    def get_urls(self):
+        """
+        Возвращает адреса всех страниц со списками.
+        """
+        company, project = [self.company.pk], [self.project.pk]
+        return [
+            reverse('companies'), reverse('projects'), reverse('interactions'),
+            reverse('interaction_manager_crm'), reverse('manager_crm_list'), reverse('customer_list'),
+            reverse('customer_project_list'), reverse('revenue_summary'), reverse('search') + '?q=описание',
+            reverse('company_interactions', args=company), reverse('project_interactions', args=project),
+            reverse('projects_not_started', args=company), reverse('projects_in_process', args=company),
+            reverse('projects_completed', args=company),
+            reverse('company_interactions_phones', args=company), reverse('company_interactions_email', args=company),
+            reverse('company_interactions_messenger', args=company),
+            reverse('project_interactions_phones', args=project),
+            reverse('project_interactions_email', args=project),
+            reverse('project_interactions_messenger', args=project),
+            '/company/%d/projects/' % self.company.pk,
+        ]
+
+    def count_queries(self):
+        """
+        Возвращает словарь {url: количество SQL-запросов} по всем спискам при пустом кэше.
+        """
+        result = {}
+        for url in self.get_urls():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, url)
+            result[url] = len(queries)
+        return result
+
+    def test_lists_stay_within_query_budget(self):
+        self.populate(1)
+        small = self.count_queries()
+        self.populate(30)
+        large = self.count_queries()
+        for url in self.get_urls():
+            budget = resolve(url.split('?')[0]).func.view_class.query_budget
+            self.assertIsNotNone(budget, url)
+            self.assertLessEqual(large[url], budget, url)
+            self.assertEqual(small[url], large[url], url)
+
+
+class GetCountTest(TestCase):
+    """
+    Проверяет кэширование количества строк для пагинации и его сброс при записи в таблицу.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(self.company, 5, Project.status_completed, 'count')
+
+    def test_count_is_cached_until_write(self):
+        queryset = Project.objects.filter(company=self.company).order_by('name')
+        self.assertEqual(get_count(queryset), 5)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_count(queryset.order_by('-price')), 5)
+
+        Project.objects.get(name='%s-count-0' % self.company.pk).delete()
+        self.assertEqual(get_count(queryset), 4)
+
+    def test_count_depends_on_joined_tables(self):
+        queryset = Project.objects.filter(company__title='Компания')
+        self.assertEqual(get_count(queryset), 5)
+        self.company.title = 'Новое название'
+        self.company.save()
+        self.assertEqual(get_count(queryset), 0)
+
+
+class ProjectCustomerListViewTest(TestCase):
+    """
+    Проверяет, что заказчик видит только свои проекты и что кэш списка сбрасывается при их изменении.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='customer', password='password', is_customer=True)
+        cls.other = User.objects.create_user(username='other', password='password', is_customer=True)
+        cls.customer = Customer.objects.create(user=cls.user, name='Заказчик')
+        cls.other_customer = Customer.objects.create(user=cls.other, name='Другой заказчик')
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 20, Project.status_in_process, 'other')
+        Project.objects.update(customer=cls.other_customer)
+        create_projects(cls.company, 6, Project.status_in_process, 'own')
+        Project.objects.filter(customer=None).update(customer=cls.customer)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('customer_project_list')
+
+    def get_project_list(self):
+        """
+        Возвращает пагинатор списка проектов текущего заказчика.
+        """
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page_obj'].paginator
+
+    def test_list_is_scoped_to_customer(self):
+        paginator = self.get_project_list()
+        self.assertEqual(paginator.count, 6)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertTrue(all(p.customer_id == self.customer.pk for p in paginator.object_list))
+
+    def test_cache_is_invalidated_on_save_and_delete(self):
+        self.assertEqual(self.get_project_list().count, 6)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_project_list().count, 6)
+
+        project = Project.objects.filter(customer=self.other_customer).first()
+        project.customer = self.customer
+        project.save()
+        self.assertEqual(self.get_project_list().count, 7)
+
+        project = Project.objects.get(pk=project.pk)
+        project.customer = self.other_customer
+        project.save()
+        self.assertEqual(self.get_project_list().count, 6)
+
+        Project.objects.filter(customer=self.customer).first().delete()
+        self.assertEqual(self.get_project_list().count, 5)
+
+
+class CursorPaginationTest(TestCase):
+    """
+    Проверяет курсорную пагинацию списков взаимодействий и проектов по всем допустимым сортировкам.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        other = Company.objects.create(title='Другая компания', leader_name='Директор', address='Адрес')
+        for status in (Project.status_not_started, Project.status_in_process, Project.status_completed):
+            create_projects(cls.company, 4, status, status)
+            create_projects(other, 3, status, status)
+        Project.objects.filter(pk__in=Project.objects.values('pk')[:3]).update(company=None, price=50)
+        projects = list(Project.objects.all()) + [None]
+        channels = [channel for channel, _ in Interaction.channels]
+        Interaction.objects.bulk_create([
+            Interaction(project=projects[i % len(projects)], user=cls.user if i % 4 else None, rating='☆',
+                        channel_of_reference=channels[i % 3], reference_obj='с компанией')
+            for i in range(40)
+        ])
+        Interaction.objects.filter(pk__in=Interaction.objects.values('pk')[:10]).update(
+            created_date=timezone.now())
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def walk(self, url, sort):
+        """
+        Проходит все страницы списка по курсорам и возвращает pk в порядке отображения.
+        """
+        pks, params = [], {'sort': sort}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            page = response.context['page_obj']
+            pks.extend(obj.pk for obj in page.object_list)
+            if not page.has_next():
+                return pks
+            params = {'sort': sort, 'after': page.next_cursor}
+
+    def assertWalksAllRows(self, url, model, orderings):
+        for sort in orderings:
+            pks = self.walk(url, sort)
+            self.assertEqual(len(pks), len(set(pks)), sort)
+            self.assertEqual(set(pks), set(model.objects.values_list('pk', flat=True)), sort)
+
+    def test_interaction_orderings(self):
+        self.assertWalksAllRows(reverse('interactions'), Interaction,
+                                ('-project', 'channel_of_reference', 'user', 'created_date', '-created_date', 'project'))
+
+    def test_project_orderings(self):
+        self.assertWalksAllRows(reverse('projects'), Project,
+                                ('-start_date', 'name', '-name', 'company', '-company', 'start_date',
+                                 'price', '-price', 'status_pro'))
+
+    def test_page_order_matches_sort(self):
+        pks = self.walk(reverse('interactions'), '-created_date')
+        dates = list(Interaction.objects.in_bulk(pks)[pk].created_date for pk in pks)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_deep_pages_cost_the_same(self):
+        url = reverse('interactions')
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        cursor = response.context['page_obj'].next_cursor
+        for _ in range(5):
+            with CaptureQueriesContext(connection) as deep:
+                response = self.client.get(url, {'after': cursor})
+            cursor = response.context['page_obj'].next_cursor
+        self.assertEqual(len(first), len(deep))
+        self.assertFalse(any('COUNT(' in query['sql'] for query in deep.captured_queries))
+
+    def test_created_date_pages_are_read_from_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('План запроса проверяется только для SQLite')
+        paginator = CursorPaginator(Interaction.objects.order_by('-created_date'), 5)
+        cursor = paginator.page().next_cursor
+        plan = paginator.page_queryset(cursor).explain()
+        self.assertIn('interaction_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(reverse('interactions'), {'after': 'broken'}).status_code, 404)
+
+    def test_page_numbers_without_cursor(self):
+        url = reverse('projects')
+        response = self.client.get(url, {'sort': 'name', 'page': 3})
+        page = response.context['page_obj']
+        self.assertEqual(page.number, 3)
+        self.assertEqual(page.paginator.count, Project.objects.count())
+        names = list(Project.objects.order_by('name', 'pk').values_list('pk', flat=True))
+        self.assertEqual([obj.pk for obj in page.object_list], names[10:15])
+        self.assertContains(response, '?page=4&sort=name')
+        response = self.client.get(url, {'sort': 'name', 'after': page.next_cursor})
+        self.assertEqual([obj.pk for obj in response.context['page_obj'].object_list], names[15:20])
+
+
+class CompanyCountersTest(TestCase):
+    """
+    Проверяет счетчики проектов и взаимодействий компании.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        cls.other = Company.objects.create(title='Другая', leader_name='Директор', address='Адрес')
+
+    def create_project(self, company, start_in=timedelta(days=1)):
+        start = timezone.now() + start_in
+        return Project.objects.create(company=company, name='Проект', description='', start_date=start,
+                                      end_date=start + timedelta(days=1), price=100)
+
+    def create_interaction(self, company, channel=Interaction.channel_phone):
+        return Interaction.objects.create(company=company, user=self.user, rating='☆',
+                                          reference_obj='с компанией', channel_of_reference=channel)
+
+    def counters(self, company):
+        return Company.objects.values(*COUNTER_FIELDS).get(pk=company.pk)
+
+    def test_project_save_and_delete(self):
+        project = self.create_project(self.company)
+        self.assertEqual(self.counters(self.company)['projects_not_started'], 1)
+
+        project = Project.objects.get(pk=project.pk)
+        project.start_date -= timedelta(days=30)
+        project.end_date -= timedelta(days=30)
+        project.company = self.other
+        project.save()
+        self.assertEqual(self.counters(self.company)['projects_not_started'], 0)
+        self.assertEqual(self.counters(self.other)['projects_completed'], 1)
+
+        project.delete()
+        self.assertEqual(self.counters(self.other)['projects_completed'], 0)
+
+    def test_interaction_save_and_delete(self):
+        first = self.create_interaction(self.company)
+        second = self.create_interaction(self.company, Interaction.channel_email)
+        counters = self.counters(self.company)
+        self.assertEqual((counters['interactions_phone'], counters['interactions_email']), (1, 1))
+        self.assertEqual(counters['last_interaction_date'], second.created_date)
+
+        second.company = self.other
+        second.save()
+        self.assertEqual(self.counters(self.company)['last_interaction_date'], first.created_date)
+        self.assertEqual(self.counters(self.other)['interactions_email'], 1)
+
+        first.delete()
+        counters = self.counters(self.company)
+        self.assertEqual(counters['interactions_phone'], 0)
+        self.assertIsNone(counters['last_interaction_date'])
+
+    def test_recompute_repairs_drift(self):
+        self.create_project(self.company)
+        interaction = self.create_interaction(self.company)
+        create_projects(self.company, 2, Project.status_in_process, 'bulk')
+        Company.objects.update(projects_not_started=7)
+
+        recompute_counters([self.company.pk, self.other.pk])
+        counters = self.counters(self.company)
+        self.assertEqual(counters['projects_not_started'], 1)
+        self.assertEqual(counters['projects_in_process'], 2)
+        self.assertEqual(counters['interactions_phone'], 1)
+        self.assertEqual(counters['last_interaction_date'], interaction.created_date)
+        self.assertEqual(self.counters(self.other)['projects_not_started'], 0)
+
+    def test_status_update_moves_counters(self):
+        self.create_project(self.company)
+        update_project_status(timezone.now() + timedelta(days=3))
+        counters = self.counters(self.company)
+        self.assertEqual(counters['projects_not_started'], 0)
+        self.assertEqual(counters['projects_completed'], 1)
+
+    def test_company_list_sorted_by_counter(self):
+        self.create_interaction(self.other)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('companies'), {'sort': '-interactions_phone'})
+        self.assertEqual(response.context['current_order'], '-interactions_phone')
+        self.assertEqual(response.context['company_list'][0], self.other)
+
+
+class RevenueSummaryTest(TestCase):
+    """
+    Проверяет сводку выручки по компаниям, статусам и месяцам.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        cls.other = Company.objects.create(title='Другая', leader_name='Директор', address='Адрес')
+
+    def create_project(self, name, company, start, price=100):
+        return Project.objects.create(company=company, name=name, description='', start_date=start,
+                                      end_date=start + timedelta(days=1), price=price)
+
+    def summary(self):
+        return set(RevenueSummary.objects.values_list('company_id', 'status_pro', 'month', 'projects', 'revenue'))
+
+    def assertSummaryIsLive(self):
+        live = {(row['company_id'], row['status_pro'], row['month'], row['projects'], row['revenue'])
+                for row in live_revenue()}
+        self.assertEqual(self.summary(), live)
+
+    def test_summary_follows_project_changes(self):
+        start = timezone.now() + timedelta(days=40)
+        first = self.create_project('Первый', self.company, start, 100)
+        self.create_project('Второй', self.company, start, 250)
+        self.assertEqual(self.summary(), {(self.company.pk, Project.status_not_started, month_of(start), 2, 350)})
+
+        first = Project.objects.get(pk=first.pk)
+        first.company = self.other
+        first.start_date -= timedelta(days=70)
+        first.end_date = first.start_date + timedelta(days=1)
+        first.save()
+        self.assertSummaryIsLive()
+        self.assertEqual(len(self.summary()), 2)
+
+        first.delete()
+        self.assertEqual(self.summary(), {(self.company.pk, Project.status_not_started, month_of(start), 1, 250)})
+
+    def test_status_update_refreshes_summary(self):
+        self.create_project('Проект', self.company, timezone.now() + timedelta(days=1))
+        update_project_status(timezone.now() + timedelta(days=3))
+        self.assertSummaryIsLive()
+        self.assertEqual(RevenueSummary.objects.get().status_pro, Project.status_completed)
+
+    def test_rebuild_matches_live_group_by(self):
+        create_projects(self.company, 5, Project.status_completed, 'bulk')
+        create_projects(self.other, 3, Project.status_in_process, 'bulk')
+        self.assertEqual(rebuild_revenue(), len(list(live_revenue())))
+        self.assertSummaryIsLive()
+
+    def test_page_filters_by_company(self):
+        create_projects(self.company, 2, Project.status_completed, 'bulk')
+        create_projects(self.other, 2, Project.status_completed, 'bulk')
+        rebuild_revenue()
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('revenue_summary'), {'company': self.other.pk, 'year': 'x'})
+        self.assertEqual(response.context['filters'], {'company': str(self.other.pk)})
+        self.assertEqual({row.company_id for row in response.context['revenuesummary_list']}, {self.other.pk})
+
+
+class SearchTest(TestCase):
+    """
+    Проверяет полнотекстовый поиск по компаниям, проектам и взаимодействиям.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.customer = User.objects.create_user(username='customer', password='password', is_customer=True)
+        cls.company = Company.objects.create(title='Стройка', leader_name='Директор', address='Адрес',
+                                             description='<p>Строим жилые&nbsp;<b>дома</b></p>')
+        now = timezone.now()
+        cls.project = Project.objects.create(company=cls.company, name='Жилой квартал', description='<p>Десять домов</p>',
+                                             start_date=now, end_date=now + timedelta(days=1), price=100)
+        cls.interaction = Interaction.objects.create(company=cls.company, user=cls.manager, rating='☆',
+                                                     reference_obj='с компанией',
+                                                     channel_of_reference=Interaction.channel_phone,
+                                                     description='<p>Обсудили сроки сдачи домов</p>')
+
+    def setUp(self):
+        cache.clear()
+
+    def found(self, query, kinds=None):
+        return {(document.kind, document.object_id) for document in search(query, kinds)}
+
+    def test_stemming(self):
+        self.assertEqual({stem(word) for word in ('проекты', 'проектов', 'проекта')}, {'проект'})
+        self.assertEqual(stem('компаниями'), stem('компании'))
+        self.assertEqual(html_to_text('<p>Строим&nbsp;<b>дома</b></p>'), 'Строим дома')
+        self.assertEqual(html_to_text('<p>Дома</p><!-- x --><p>офисы</p>'), 'Дома офисы')
+
+    def test_word_forms_are_found(self):
+        self.assertEqual(self.found('жилой дом'), {(SearchDocument.kind_company, self.company.pk),
+                                                  (SearchDocument.kind_project, self.project.pk)})
+        self.assertEqual(self.found('домами', [SearchDocument.kind_interaction]),
+                         {(SearchDocument.kind_interaction, self.interaction.pk)})
+        self.assertEqual(self.found('...'), set())
+
+    def test_index_follows_changes(self):
+        self.project.description = '<p>Офисный центр</p>'
+        self.project.save()
+        self.assertEqual(self.found('офисном центре'), {(SearchDocument.kind_project, self.project.pk)})
+        self.assertNotIn((SearchDocument.kind_project, self.project.pk), self.found('домов'))
+
+        self.project.delete()
+        self.assertEqual(self.found('офисном центре'), set())
+        self.assertEqual(SearchDocument.objects.filter(kind=SearchDocument.kind_interaction).count(), 1)
+
+    def test_rebuild_matches_signals(self):
+        before = self.found('дом')
+        self.assertEqual(rebuild_search_index(), 3)
+        self.assertEqual(self.found('дом'), before)
+
+    def test_interactions_are_found_only_for_managers(self):
+        for user, expected in ((self.manager, 3), (self.customer, 1)):
+            self.client.force_login(user)
+            response = self.client.get(reverse('search'), {'q': 'домов'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['document_list']), expected, user.username)
+
+    def test_customers_find_only_own_projects(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('search'), {'q': 'десять'})
+        self.assertNotContains(response, 'Десять домов')
+        self.assertEqual(len(response.context['document_list']), 0)
+        self.project.customer = Customer.objects.create(user=self.customer, name='Заказчик')
+        self.project.save()
+        response = self.client.get(reverse('search'), {'q': 'десять'})
+        self.assertContains(response, 'Десять домов')
+
+
+class TypeaheadTest(TestCase):
+    """
+    Проверяет подсказки по названиям из индекса в памяти процесса.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='ООО Ромашка', leader_name='Директор', address='Адрес')
+        Company.objects.create(title='Рога и копыта', leader_name='Директор', address='Адрес')
+        cls.customer = Customer.objects.create(user=cls.manager, name='Роман Заказчиков')
+
+    def setUp(self):
+        typeahead_index.build()
+
+    def names(self, prefix, kinds=('company', 'customer')):
+        return [result['name'] for result in typeahead_index.search(prefix, kinds)]
+
+    def test_prefix_index(self):
+        index = PrefixIndex()
+        index.build([(1, 'Альфа Строй'), (2, 'Строймонтаж'), (3, 'Бета')])
+        self.assertEqual(index.search('СТРОЙ', 10), [(1, 'Альфа Строй'), (2, 'Строймонтаж')])
+        index.add(2, 'Гамма')
+        index.remove(1)
+        self.assertEqual(index.search('стр', 10), [])
+        self.assertEqual(index.search('г', 10), [(2, 'Гамма')])
+
+    def test_search_does_not_touch_database(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.names('ро'), ['ООО Ромашка', 'Рога и копыта', 'Роман Заказчиков'])
+            self.assertEqual(self.names('ро', ['company']), ['ООО Ромашка', 'Рога и копыта'])
+
+    def test_index_follows_committed_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.title = 'ООО Василек'
+            self.company.save()
+        self.assertEqual(self.names('ром'), ['Роман Заказчиков'])
+        self.assertEqual(self.names('вас'), ['ООО Василек'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.delete()
+        self.assertEqual(self.names('вас'), [])
+
+    def test_index_applies_changes_from_other_processes(self):
+        other = TypeaheadIndex()
+        other.build()
+        typeahead_index.update(Company, self.company.pk, 'ООО Василек')
+        with self.assertNumQueries(0):
+            self.assertEqual([result['name'] for result in other.search('вас', ['company'])], ['ООО Василек'])
+
+    def test_endpoint_respects_user_kinds(self):
+        response = self.client.get(reverse('typeahead'), {'q': 'ро'})
+        self.assertEqual([result['type'] for result in response.json()['results']], ['company', 'company'])
+
+        self.client.force_login(self.manager)
+        response = self.client.get(reverse('typeahead'), {'q': 'рома', 'limit': '1'})
+        self.assertEqual(response.json()['results'], [
+            {'type': 'company', 'id': self.company.pk, 'name': 'ООО Ромашка',
+             'url': reverse('company-detail', args=[self.company.pk])}])
+
+
+class NameMigrationTest(TransactionTestCase):
+    """
+    Проверяет подготовку существующих данных перед уникальными индексами названий и проверкой дат
+    (миграция 0052): базу откатывает до 0051, заполняет и снова мигрирует.
+    """
+    before = [('crm', '0051_search_document')]
+    after = [('crm', '0052_case_insensitive_names')]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.before)
+        self.apps = executor.loader.project_state(self.before).apps
+        self.addCleanup(self.migrate, None)
+
+    def migrate(self, targets):
+        """
+        Мигрирует базу к targets (None - к последним миграциям) заново прочитанным графом миграций.
+        """
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets or executor.loader.graph.leaf_nodes())
+
+    def test_case_variants_are_renamed(self):
+        Company = self.apps.get_model('crm', 'Company')
+        for title in ('Acme', 'ACME', 'acme', 'Other'):
+            Company.objects.create(title=title, leader_name='Директор', address='Адрес')
+        first, second, third = Company.objects.filter(title__iexact='acme').order_by('pk').values_list('pk', flat=True)
+        self.migrate(self.after)
+        titles = dict(Company.objects.values_list('pk', 'title'))
+        self.assertEqual(titles[first], 'Acme')
+        self.assertEqual(titles[second], 'ACME (%d)' % second)
+        self.assertEqual(titles[third], 'acme (%d)' % third)
+
+    def test_bad_dates_stop_migration_with_list(self):
+        company = self.apps.get_model('crm', 'Company').objects.create(title='Acme', leader_name='Директор',
+                                                                        address='Адрес')
+        Project = self.apps.get_model('crm', 'Project')
+        now = timezone.now()
+        for name, end in (('Build', now + timedelta(days=1)), ('Broken', now)):
+            Project.objects.create(company=company, name=name, description='', price=100, start_date=now, end_date=end)
+        broken = Project.objects.get(name='Broken')
+        with self.assertRaisesMessage(RuntimeError, '%d (Broken)' % broken.pk):
+            self.migrate(self.after)
+        Project.objects.filter(pk=broken.pk).update(end_date=now + timedelta(days=1))
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class NameConstraintTest(TestCase):
+    """
+    Проверяет уникальность названий без учета регистра и проверку дат проекта на уровне базы данных.
+    SQLite приводит к нижнему регистру только латиницу, поэтому названия в тесте латинские.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(title='Acme', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 2, Project.status_in_process, 'Build')
+        cls.project, cls.other = Project.objects.order_by('pk')
+        cls.customer = Customer.objects.create(user=cls.manager, name='Заказчик')
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def test_database_rejects_duplicates_and_bad_dates(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Company.objects.create(title='ACME', leader_name='Директор', address='Адрес')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Project.objects.filter(pk=self.project.pk).update(end_date=self.project.start_date)
+
+    def test_company_form_reports_duplicate_without_lookup(self):
+        data = {'title': 'acme', 'leader_name': 'Директор', 'address': 'Адрес', 'description': 'Описание'}
+        for prefix in ('phone_set', 'email_set', 'manager_set'):
+            data.update({'%s-TOTAL_FORMS' % prefix: '0', '%s-INITIAL_FORMS' % prefix: '0'})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('company_create'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors['title'], ['Введите уникальное название'])
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('SELECT') and 'crm_company' in query['sql']])
+
+        data['title'] = 'Acme Two'
+        response = self.client.post(reverse('company_create'), data)
+        self.assertRedirects(response, reverse('company-detail', args=[Company.objects.get(title='Acme Two').pk]),
+                             fetch_redirect_response=False)
+
+    def test_project_form_reports_duplicate_name(self):
+        data = {'company': self.company.pk, 'name': self.other.name.upper(),
+                'customer': self.customer.pk, 'description': 'Описание',
+                'start_date': self.project.start_date.strftime('%Y-%m-%d %H:%M:%S'),
+                'end_date': self.project.end_date.strftime('%Y-%m-%d %H:%M:%S'), 'price': 100}
+        response = self.client.post(reverse('project_update', args=[self.project.pk]), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['form'].errors['name'], ['Введите уникальное название'])
+
+
+IMPORT_CSV = """title,leader_name,address,description,phones,emails,managers
+Acme,Иванов,Киев,<p>Строительство офисов</p>,+380501112233;+380501112244,info@acme.test,Петров
+Beta,Сидоров,Львов,,12,beta@test,
+Gamma,Коваль,Одесса,,,gamma@gamma.test,Шевченко;Франко
+acme,Иванов И.,Киев,,+380509998877,,
+"""
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CompanyImportTest(TestCase):
+    """
+    Проверяет потоковый импорт компаний с контактами из CSV и JSONL.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.user = User.objects.create_user(username='user', password='password')
+        cls.company = Company.objects.create(title='GAMMA', leader_name='Директор', address='Адрес')
+        Phone.objects.create(company=cls.company, phone_number='+380500000000')
+
+    def test_csv_creates_updates_and_rejects_rows(self):
+        result = import_file(io.BytesIO(IMPORT_CSV.encode()), 'csv', batch_size=2)
+        self.assertEqual((result.created, result.updated, result.rejected), (1, 2, 1))
+        self.assertEqual(result.errors[0][0], 3)
+        self.assertIn('phones', result.errors[0][1])
+
+        acme = Company.objects.get(title='acme')
+        self.assertEqual(acme.leader_name, 'Иванов И.')
+        self.assertEqual(list(acme.phone_set.values_list('phone_number', flat=True)), ['+380509998877'])
+        self.assertFalse(acme.email_set.exists())
+
+        gamma = Company.objects.get(pk=self.company.pk)
+        self.assertEqual((gamma.title, gamma.leader_name), ('Gamma', 'Коваль'))
+        self.assertFalse(gamma.phone_set.exists())
+        self.assertEqual(sorted(gamma.manager_set.values_list('manager_name', flat=True)), ['Франко', 'Шевченко'])
+        self.assertEqual(Company.objects.count(), 2)
+        self.assertEqual(SearchDocument.objects.filter(kind=SearchDocument.kind_company).count(), 2)
+
+    def test_cyrillic_case_variant_updates_company(self):
+        company = Company.objects.create(title='ООО Ромашка', leader_name='Директор', address='Адрес')
+        rows = '{"title": "ооо ромашка", "leader_name": "Петренко", "address": "Адрес"}\n'
+        result = import_file(io.BytesIO(rows.encode()), 'jsonl')
+        self.assertEqual((result.created, result.updated), (0, 1))
+        company.refresh_from_db()
+        self.assertEqual((company.title, company.title_key, company.leader_name),
+                         ('ооо ромашка', 'ооо ромашка', 'Петренко'))
+        self.assertEqual(Company.objects.filter(title_key='ооо ромашка').count(), 1)
+
+    def test_jsonl_batches_within_bounded_queries(self):
+        lines = ['{"title": "Company %d", "leader_name": "Директор", "address": "Адрес", '
+                 '"phones": ["+38050000%04d"], "emails": ["c%d@test.ua"], "managers": ["Менеджер"]}' % (i, i, i)
+                 for i in range(50)]
+        lines.insert(10, '{"title": ')
+        with CaptureQueriesContext(connection) as queries:
+            result = import_file(io.BytesIO('\n'.join(lines).encode()), 'jsonl', batch_size=25)
+        self.assertEqual((result.created, result.updated, result.rejected), (50, 0, 1))
+        self.assertEqual(result.errors[0][0], 11)
+        self.assertLess(len(queries), 40)
+        self.assertEqual(Phone.objects.filter(company__title__startswith='Company').count(), 50)
+        self.assertEqual(Email.objects.count(), 50)
+        self.assertEqual(Manager.objects.count(), 50)
+        self.assertEqual(search('Company 7').count(), 1)
+
+    def test_upload_view_requires_manager(self):
+        upload = SimpleUploadedFile('companies.csv', IMPORT_CSV.encode())
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.post(reverse('company_import'), {'file': upload}).status_code, 403)
+
+        self.client.force_login(self.manager)
+        upload.seek(0)
+        response = self.client.post(reverse('company_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['result'].created, response.context['result'].updated), (1, 1))
+
+        response = self.client.post(reverse('company_import'),
+                                    {'file': SimpleUploadedFile('companies.txt', b'title')})
+        self.assertIn('file', response.context['form'].errors)
+
+
+class ExportTest(TestCase):
+    """
+    Проверяет потоковую выгрузку проектов и взаимодействий в CSV и XLSX.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.user = User.objects.create_user(username='user', password='password')
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 3, Project.status_in_process, 'export')
+        Project.objects.filter(name__endswith='-1').update(description='<p>Офис &amp; <b>склад</b></p>', price=500)
+        project = Project.objects.order_by('pk').first()
+        Interaction.objects.bulk_create([
+            Interaction(company=cls.company, project=project, user=cls.manager, rating='☆',
+                        reference_obj='с компанией', channel_of_reference=channel, description='<p>Звонок</p>')
+            for channel, _ in Interaction.channels])
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def read_csv(self, response):
+        return list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode('utf-8-sig'))))
+
+    def test_csv_respects_sort_and_strips_html(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('projects_export'), {'format': 'csv', 'sort': '-price'})
+            rows = self.read_csv(response)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="projects-', response['Content-Disposition'])
+        self.assertEqual(rows[0][0], 'Название проекта')
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], '%s-export-1' % self.company.pk)
+        self.assertEqual(rows[1][1:4], ['Компания', '', Project.status_in_process])
+        self.assertEqual(rows[1][6:], ['500', 'Офис & склад'])
+        self.assertLessEqual(len(queries), 3)
+
+    def test_xlsx_is_valid_workbook(self):
+        response = self.client.get(reverse('interactions_export'), {'format': 'xlsx'})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('[Content_Types].xml', archive.namelist())
+        sheet = archive.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), 4)
+        self.assertIn('>Звонок<', sheet)
+        self.assertIn('>manager<', sheet)
+
+    def test_formulas_are_exported_as_text(self):
+        Project.objects.filter(name__endswith='-1').update(name='=HYPERLINK("http://evil")',
+                                                           description='<p>@SUM(A1)</p>')
+        rows = self.read_csv(self.client.get(reverse('projects_export'), {'format': 'csv', 'sort': '-price'}))
+        self.assertEqual(rows[1][0], '\'=HYPERLINK("http://evil")')
+        self.assertEqual(rows[1][7], "'@SUM(A1)")
+        self.assertEqual(rows[1][6], '500')
+
+    def test_export_requires_manager_and_known_format(self):
+        self.assertEqual(self.client.get(reverse('interactions_export'), {'format': 'pdf'}).status_code, 404)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('interactions_export')).status_code, 403)
+
+
+class ApiTest(TestCase):
+    """
+    Проверяет JSON API: курсорную пагинацию, выбор полей, встроенные связи и условные GET-запросы.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.user = User.objects.create_user(username='user', password='password')
+        cls.customer = Customer.objects.create(user=cls.manager, name='Заказчик')
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 5, Project.status_in_process, 'api')
+        Project.objects.update(customer=cls.customer)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def get_json(self, url, params=None, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params or {}, **headers)
+        return response, queries
+
+    def test_pages_fields_and_relations(self):
+        url = reverse('api_projects')
+        response, queries = self.get_json(url, {'fields': 'name,company,customer', 'limit': 3})
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['results']), 3)
+        self.assertEqual(data['results'][0], {
+            'id': data['results'][0]['id'], 'name': '%s-api-0' % self.company.pk,
+            'company': {'id': self.company.pk, 'title': 'Компания'},
+            'customer': {'id': self.customer.pk, 'name': 'Заказчик'}})
+        project_queries = [query['sql'] for query in queries.captured_queries if 'crm_project' in query['sql']]
+        self.assertEqual(len(project_queries), 1)
+        self.assertNotIn('description', project_queries[0])
+
+        response, _ = self.get_json(data['next'])
+        rest = response.json()
+        self.assertEqual([project['name'][-1] for project in rest['results']], ['3', '4'])
+        self.assertIsNone(rest['next'])
+
+        response, _ = self.get_json(reverse('api_company', args=[self.company.pk]), {'fields': 'projects_in_process'})
+        self.assertEqual(response.json(), {'id': self.company.pk, 'projects_in_process': 0})
+
+    def test_errors_and_access(self):
+        self.assertEqual(self.client.get(reverse('api_companies'), {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_companies'), {'sort': 'address'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('api_company', args=[0])).status_code, 404)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('api_customers')).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_customers')).status_code, 401)
+
+    def test_unchanged_collection_answers_not_modified(self):
+        url = reverse('api_companies')
+        response, _ = self.get_json(url)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        response, queries = self.get_json(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([query for query in queries.captured_queries if 'crm_company' in query['sql']])
+
+        Interaction.objects.create(company=self.company, channel_of_reference=Interaction.channel_phone,
+                                   rating='☆', description='')
+        response, _ = self.get_json(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['interactions_phone'], 1)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        with mock.patch('time.time', return_value=time.time() + 2):
+            response, _ = self.get_json(url)
+            modified = response['Last-Modified']
+            response, _ = self.get_json(url, HTTP_IF_MODIFIED_SINCE=modified)
+        self.assertEqual(response.status_code, 304)
+
+
+class ConditionalDetailTest(TestCase):
+    """
+    Проверяет ответы 304 страниц компании, проекта и взаимодействия.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.admin = User.objects.create_user(username='admin', password='password', is_admin=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 1, Project.status_in_process, 'detail')
+        cls.project = Project.objects.get()
+        cls.interaction = Interaction.objects.create(company=cls.company, project=cls.project, user=cls.manager,
+                                                     channel_of_reference=Interaction.channel_phone, rating='☆',
+                                                     description='')
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def revalidate(self, url, response):
+        """
+        Повторяет запрос url с If-None-Match из ответа response.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            again = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        return again, len(queries)
+
+    def test_company_page_covers_contacts_and_counters(self):
+        url = reverse('company-detail', args=[self.company.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        again, queries = self.revalidate(url, response)
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(queries, 1)
+
+        Phone.objects.create(company=self.company, phone_number='+380501112233')
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+
+        response = self.client.get(url)
+        Interaction.objects.create(company=self.company, project=self.project,
+                                   channel_of_reference=Interaction.channel_email, rating='☆', description='')
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+
+    def modified_since(self, url, response):
+        """
+        Повторяет запрос url только с If-Modified-Since из ответа response.
+        """
+        return self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+
+    def age_pages(self):
+        """
+        Переносит даты изменения всех объектов на минуту назад: Last-Modified отдается
+        только после окончания секунды изменения.
+        """
+        past = timezone.now() - timedelta(minutes=1)
+        for model in (Company, Project, Interaction):
+            model.objects.update(updated_date=past)
+
+    def test_last_modified_covers_counters_and_names(self):
+        self.age_pages()
+        company_url = reverse('company-detail', args=[self.company.pk])
+        response = self.client.get(company_url)
+        self.assertEqual(self.modified_since(company_url, response).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+            Interaction.objects.create(company=self.company, channel_of_reference=Interaction.channel_email,
+                                       rating='☆', description='')
+        self.assertEqual(self.modified_since(company_url, response).status_code, 200)
+
+        self.age_pages()
+        interaction_url = reverse('interaction-detail', args=[self.interaction.pk])
+        response = self.client.get(interaction_url)
+        self.assertEqual(self.modified_since(interaction_url, response).status_code, 304)
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+            self.manager.first_name = 'Иван'
+            self.manager.save()
+        self.assertEqual(self.modified_since(interaction_url, response).status_code, 200)
+
+    def test_no_last_modified_within_second_of_change(self):
+        url = reverse('company-detail', args=[self.company.pk])
+        now = timezone.now()
+        Company.objects.update(updated_date=now)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertNotIn('Last-Modified', self.client.get(url))
+        Company.objects.update(updated_date=timezone.now() - timedelta(seconds=2))
+        self.assertIn('Last-Modified', self.client.get(url))
+
+    def test_project_page_depends_on_company_and_viewer(self):
+        url = reverse('project-detail', args=[self.project.pk])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 304)
+
+        self.client.force_login(self.admin)
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+
+        self.client.force_login(self.manager)
+        response = self.client.get(url)
+        self.company.title = 'Новое название'
+        self.company.save()
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+
+    def test_interaction_page_depends_on_manager_name(self):
+        url = reverse('interaction-detail', args=[self.interaction.pk])
+        response = self.client.get(url)
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 304)
+        User.objects.filter(pk=self.manager.pk).update(first_name='Иван')
+        self.assertEqual(self.revalidate(url, response)[0].status_code, 200)
+        self.assertEqual(self.client.get(reverse('interaction-detail', args=[0])).status_code, 404)
+
+
+class FragmentCacheTest(TestCase):
+    """
+    Проверяет кэширование фрагментов шаблонов по версиям объектов и роли пользователя.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.customer = User.objects.create_user(username='customer', password='password', is_customer=True)
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        Phone.objects.create(company=cls.company, phone_number='+380501112233')
+        create_projects(cls.company, 1, Project.status_in_process, 'fragment')
+        cls.project = Project.objects.get()
+        Interaction.objects.create(company=cls.company, project=cls.project, user=cls.manager,
+                                   channel_of_reference=Interaction.channel_phone, rating='☆', description='')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def render(self, url):
+        """
+        Возвращает (ответ на запрос url, количество запросов к базе данных).
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def test_company_detail_skips_contact_queries(self):
+        url = reverse('company-detail', args=[self.company.pk])
+        self.client.get(reverse('about'))
+        response, cold = self.render(url)
+        self.assertContains(response, '+380501112233')
+        response, warm = self.render(url)
+        self.assertContains(response, '+380501112233')
+        self.assertEqual(cold - warm, 4)
+
+        Phone.objects.create(company=self.company, phone_number='+380504445566')
+        self.assertContains(self.client.get(url), '+380504445566')
+        self.company.leader_name = 'Новый директор'
+        self.company.save()
+        self.assertContains(self.client.get(url), 'Новый директор')
+
+    def test_fragment_depends_on_role(self):
+        url = reverse('company-detail', args=[self.company.pk])
+        self.assertContains(self.client.get(url), 'Редактировать запись о компании')
+        self.client.force_login(self.customer)
+        self.assertNotContains(self.client.get(url), 'Редактировать запись о компании')
+
+    def test_interaction_row_depends_on_related_objects(self):
+        url = reverse('interactions')
+        self.client.get(url)
+        self.manager.first_name = 'Иван'
+        self.manager.save()
+        self.assertContains(self.client.get(url), 'Иван')
+        self.project.name = 'Переименованный проект'
+        self.project.save()
+        self.assertContains(self.client.get(url), 'Переименованный проект')
+
+
+class ObjectCacheTest(TestCase):
+    """
+    Проверяет сквозной кэш объектов и страницы объектов, которые его используют.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True,
+                                               first_name='Петр')
+        cls.customer_user = User.objects.create_user(username='customer', password='password', is_customer=True)
+        cls.customer = Customer.objects.create(user=cls.customer_user, name='Заказчик')
+        cls.company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес')
+        create_projects(cls.company, 1, Project.status_not_started, 'cached')
+        cls.project = Project.objects.get()
+        Project.objects.filter(pk=cls.project.pk).update(customer=cls.customer)
+        cls.interaction = Interaction.objects.create(company=cls.company, project=cls.project, user=cls.manager,
+                                                     channel_of_reference=Interaction.channel_phone, rating='☆',
+                                                     description='')
+
+    def setUp(self):
+        cache.clear()
+        object_cache.clear()
+
+    def test_get_with_relations(self):
+        relations = ('project__company', 'project__customer__user', 'company', 'user')
+        interaction = object_cache.get(Interaction, self.interaction.pk, relations)
+        with self.assertNumQueries(0):
+            interaction = object_cache.get(Interaction, self.interaction.pk, relations)
+            self.assertEqual(interaction.project.customer.user.username, 'customer')
+            self.assertEqual(interaction.user.first_name, 'Петр')
+            self.assertEqual(interaction.company.title, 'Компания')
+        self.assertEqual(object_cache.stats()['miss'], 6)
+        self.assertEqual(object_cache.stats()['local'], 8)
+
+        self.manager.first_name = 'Иван'
+        self.manager.save()
+        with self.assertNumQueries(2):
+            interaction = object_cache.get(Interaction, self.interaction.pk, relations)
+        self.assertEqual(interaction.user.first_name, 'Иван')
+
+    def test_shared_level_and_eviction(self):
+        other = ObjectCache(size=1)
+        object_cache.get(Project, self.project.pk, ('company',))
+        with self.assertNumQueries(0):
+            other.get(Company, self.company.pk)
+            other.get(Project, self.project.pk, ('company',))
+        self.assertEqual(other.stats()['shared'], 3)
+        self.assertEqual(len(other.local), 1)
+        self.assertEqual(other.stats()['hit_ratio'], 1.0)
+
+    def test_stats_are_published_for_all_processes(self):
+        relations = ('project__company', 'project__customer__user', 'company', 'user')
+        with mock.patch('crm.objectcache.OBJECT_CACHE_STATS_INTERVAL', 0), \
+                self.assertLogs('crm.objectcache', 'INFO'):
+            object_cache.get(Interaction, self.interaction.pk, relations)
+            object_cache.get(Interaction, self.interaction.pk, relations)
+        self.assertEqual(shared_stats(), object_cache.stats())
+        out = io.StringIO()
+        call_command('object_cache_stats', '--reset', stdout=out)
+        self.assertIn('промахов: 6', out.getvalue())
+        self.assertEqual(shared_stats()['miss'], 0)
+
+    def test_missing_object(self):
+        with self.assertRaises(Company.DoesNotExist):
+            object_cache.get(Company, 0)
+        company_pk = self.company.pk
+        object_cache.get(Company, company_pk)
+        self.company.delete()
+        with self.assertRaises(Company.DoesNotExist):
+            object_cache.get(Company, company_pk)
+
+    def test_detail_pages(self):
+        self.client.force_login(self.manager)
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(reverse('interaction-detail', args=[self.interaction.pk]))
+        with CaptureQueriesContext(connection) as warm:
+            response = self.client.get(reverse('interaction-detail', args=[self.interaction.pk]))
+        self.assertContains(response, 'Компания')
+        self.assertEqual(len(cold) - len(warm), 6)
+        url = reverse('project-detail', args=[self.project.pk])
+        self.assertContains(self.client.get(url), Project.status_not_started)
+        self.assertContains(self.client.get(reverse('customer_detail', args=[self.customer.pk])), 'Заказчик')
+        self.assertEqual(self.client.get(reverse('project-detail', args=[0])).status_code, 404)
+
+
+class SQLiteCacheTest(TestCase):
+    """
+    Проверяет общий для процессов бэкенд кэша в файле SQLite.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {'OPTIONS': {'MAX_ENTRIES': 10, 'CULL_FREQUENCY': 2}})
+
+    def test_tests_do_not_use_shared_cache_file(self):
+        cache.set('probe', 1)
+        location = settings.CACHES['default']['LOCATION']
+        self.assertNotEqual(os.path.dirname(location), str(settings.BASE_DIR))
+        self.assertTrue(os.path.exists(location))
+
+    def test_operations(self):
+        cache = self.cache
+        cache.set('a', {'value': 1})
+        self.assertEqual(cache.get('a'), {'value': 1})
+        self.assertFalse(cache.add('a', 2))
+        self.assertTrue(cache.add('b', 2))
+        self.assertEqual(cache.incr('b', 5), 7)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+        cache.set_many({'c': 3, 'd': 4})
+        self.assertEqual(cache.get_many(['a', 'c', 'd', 'missing']), {'a': {'value': 1}, 'c': 3, 'd': 4})
+        cache.delete_many(['c', 'd'])
+        self.assertTrue(cache.delete('a'))
+        self.assertFalse(cache.has_key('a'))
+        self.assertEqual(cache.get_or_set('e', 5), 5)
+
+    def test_expiry(self):
+        self.cache.set('a', 1, timeout=0.05)
+        self.assertTrue(self.cache.touch('a', 0.05))
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertTrue(self.cache.add('a', 2))
+        self.assertEqual(self.cache.get('a'), 2)
+
+    def test_instances_share_entries_and_messages(self):
+        other = SQLiteCache(self.path, {})
+        self.cache.set('a', 1)
+        self.assertEqual(other.get('a'), 1)
+        last, _ = other.receive('channel')
+        self.cache.publish('channel', 'first')
+        self.cache.publish('another', 'skipped')
+        self.cache.publish('channel', 'second')
+        last, messages = other.receive('channel', last)
+        self.assertEqual(messages, ['first', 'second'])
+        self.assertEqual(other.receive('channel', last)[1], [])
+
+    def test_cull_evicts_least_recently_read(self):
+        cache = self.cache
+        cache.set_many({'old:%d' % i: i for i in range(5)})
+        cache.set_many({'new:%d' % i: i for i in range(8)})
+        cache.execute("UPDATE cache_entries SET accessed = CASE WHEN key LIKE '%old:%' THEN 0 ELSE 1 END")
+        cache.get('old:0')
+        cache.cull()
+        self.assertEqual(cache.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0], 5)
+        self.assertEqual(sorted(cache.get_many(['old:%d' % i for i in range(5)])), ['old:0'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CachedSessionTest(TestCase):
+    """
+    Проверяет чтение сессии и пользователя сессии из кэша.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='manager', password='password', is_manager=True)
+
+    def setUp(self):
+        cache.clear()
+        object_cache.clear()
+        self.client.login(username='manager', password='password')
+
+    def test_page_view_reads_session_and_user_from_cache(self):
+        url = reverse('about')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'manager')
+        tables = ' '.join(query['sql'] for query in queries)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('crm_user', tables)
+
+    def test_saved_user_is_reloaded(self):
+        self.client.get(reverse('about'))
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertContains(self.client.get(reverse('about')), 'renamed')
+
+    def test_password_change_logs_out_other_sessions(self):
+        other = Client()
+        other.login(username='manager', password='password')
+        self.assertTrue(other.get(reverse('about')).context['user'].is_authenticated)
+        response = self.client.post(reverse('update_password'), {
+            'old_password': 'password', 'new_password1': 'Nov1-parol-x', 'new_password2': 'Nov1-parol-x'})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(self.client.get(reverse('about')).context['user'].is_authenticated)
+        self.assertFalse(other.get(reverse('about')).context['user'].is_authenticated)
+
+    def test_sessions_of_model_backend_stay_logged_in(self):
+        other = Client()
+        other.force_login(self.user, backend='django.contrib.auth.backends.ModelBackend')
+        self.assertTrue(other.get(reverse('about')).context['user'].is_authenticated)
+        self.assertEqual(self.client.session[BACKEND_SESSION_KEY], 'crm.auth.CachedModelBackend')
+
+
+class ThumbnailTest(TestCase):
+    """
+    Проверяет уменьшенные копии фотографий пользователей.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 500), 'green').save(buffer, 'JPEG')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user = User.objects.create_user(username='user', password='password',
+                                                 photo=SimpleUploadedFile('photo.jpg', buffer.getvalue()))
+
+    def test_thumbnails_are_created_on_upload(self):
+        with default_storage.open(thumbnail_name(self.user.photo.name, 100, 'webp')) as file:
+            self.assertEqual(Image.open(file).size, (100, 50))
+        with default_storage.open(thumbnail_name(self.user.photo.name, 400, 'jpg')) as file:
+            self.assertEqual(Image.open(file).size, (400, 200))
+
+    def test_view_serves_and_creates_missing_thumbnails(self):
+        name = thumbnail_name(self.user.photo.name, 200, 'jpg')
+        default_storage.delete(name)
+        response = self.client.get(default_storage.url(name))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.client.get(default_storage.url(name.replace('.200.', '.300.'))).status_code, 404)
+        self.assertEqual(self.client.get(default_storage.url('thumbnails/missing.jpg.50.jpg')).status_code, 404)
+
+    def test_view_rejects_foreign_sources(self):
+        nested = thumbnail_name(thumbnail_name(self.user.photo.name, 50, 'jpg'), 50, 'jpg')
+        self.assertEqual(self.client.get(default_storage.url(nested)).status_code, 404)
+        default_storage.save('notes.txt', ContentFile(b'not an image'))
+        self.assertEqual(self.client.get(default_storage.url(thumbnail_name('notes.txt', 50, 'jpg'))).status_code, 404)
+        User.objects.filter(pk=self.user.pk).update(photo='notes.txt')
+        self.assertEqual(self.client.get(default_storage.url(thumbnail_name('notes.txt', 50, 'jpg'))).status_code, 404)
+        self.assertFalse(default_storage.exists(thumbnail_name('notes.txt', 50, 'webp')))
+
+    def test_avatar_tag(self):
+        html = Template("{% load crm_media %}{% avatar photo 100 'd-flex' %}").render(Context({'photo': self.user.photo}))
+        self.assertIn('%s 2x' % default_storage.url(thumbnail_name(self.user.photo.name, 200, 'webp')), html)
+        self.assertIn('src="%s"' % default_storage.url(thumbnail_name(self.user.photo.name, 100, 'jpg')), html)
+
+
+class MediaStorageTest(TestCase):
+    """
+    Проверяет хранилище по содержимому, счетчики ссылок и удаление файлов без ссылок.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = self.settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.photos = []
+        for color in ('red', 'blue'):
+            buffer = io.BytesIO()
+            Image.new('RGB', (60, 30), color).save(buffer, 'JPEG')
+            self.photos.append(buffer.getvalue())
+
+    def create_user(self, username, photo):
+        return User.objects.create_user(username=username, password='password',
+                                        photo=SimpleUploadedFile('photo.jpg', photo))
+
+    def test_identical_uploads_are_stored_once(self):
+        first = self.create_user('first', self.photos[0])
+        second = self.create_user('second', self.photos[0])
+        self.assertEqual(first.photo.name, second.photo.name)
+        self.assertTrue(first.photo.name.startswith('cas/'))
+        self.assertEqual(len(os.listdir(os.path.dirname(content_storage.path(first.photo.name)))), 1)
+        self.assertEqual(MediaBlob.objects.get(name=first.photo.name).references, 2)
+
+    def test_references_follow_photo_changes(self):
+        user = self.create_user('user', self.photos[0])
+        old = user.photo.name
+        user.photo = SimpleUploadedFile('new.jpg', self.photos[1])
+        user.save()
+        self.assertEqual(MediaBlob.objects.get(name=old).references, 0)
+        self.assertEqual(MediaBlob.objects.get(name=user.photo.name).references, 1)
+        User.objects.get(pk=user.pk).save(update_fields=['first_name'])
+        self.assertEqual(MediaBlob.objects.get(name=user.photo.name).references, 1)
+        user.delete()
+        self.assertEqual(MediaBlob.objects.get(name=user.photo.name).references, 0)
+
+    def test_garbage_collection_keeps_referenced_files(self):
+        user = self.create_user('user', self.photos[0])
+        unused = content_storage.save('unused.jpg', SimpleUploadedFile('unused.jpg', self.photos[1]))
+        Company.objects.create(title='Компания', leader_name='Директор', address='Адрес',
+                               description='<img src="%s">' % content_storage.url(unused))
+        self.assertEqual(collect_garbage(), (0, 0))
+        Company.objects.update(description='')
+        MediaBlob.objects.update(created_date=timezone.now() - timedelta(days=2))
+        self.assertEqual(collect_garbage(), (1, len(self.photos[1])))
+        self.assertFalse(content_storage.exists(unused))
+        self.assertFalse(MediaBlob.objects.filter(name=unused).exists())
+        self.assertTrue(content_storage.exists(user.photo.name))
+
+    def test_editor_uploads_are_stored_by_content(self):
+        user = self.create_user('user', self.photos[0])
+        client = Client()
+        client.force_login(user)
+        upload = SimpleUploadedFile('image.jpg', self.photos[1])
+        self.assertEqual(client.post(reverse('ckeditor_upload'), {'upload': upload}).status_code, 302)
+        user.is_staff = True
+        user.save()
+        for name in ('image.jpg', 'copy.jpg'):
+            response = client.post(reverse('ckeditor_upload'),
+                                   {'upload': SimpleUploadedFile(name, self.photos[1])})
+            self.assertTrue(response.json()['url'].startswith(settings.MEDIA_URL + 'cas/'))
+        name = response.json()['url'][len(settings.MEDIA_URL):]
+        self.assertEqual(MediaBlob.objects.filter(name=name).count(), 1)
+        self.assertTrue(content_storage.exists(name))
+
+    def test_garbage_collection_keeps_reuploaded_file(self):
+        name = content_storage.save('unused.jpg', SimpleUploadedFile('unused.jpg', self.photos[1]))
+        MediaBlob.objects.update(created_date=timezone.now() - timedelta(days=2))
+        now, uploaded = timezone.now, []
+
+        def upload_during_collection():
+            if not uploaded:
+                uploaded.append(None)
+                uploaded[0] = content_storage.save('again.jpg', SimpleUploadedFile('again.jpg', self.photos[1]))
+            return now()
+
+        with mock.patch('django.utils.timezone.now', upload_during_collection):
+            self.assertEqual(collect_garbage(), (0, 0))
+        self.assertEqual(uploaded, [name])
+        self.assertTrue(content_storage.exists(name))
+        self.assertTrue(MediaBlob.objects.filter(name=name).exists())
+
+    def test_fold_duplicates(self):
+        for name, photo in (('photo.jpg', self.photos[0]), ('photo_a1b2c3d.jpg', self.photos[0]),
+                            ('default1.jpg', self.photos[1]), ('default1_x.jpg', self.photos[1])):
+            with open(content_storage.path(name), 'wb') as file:
+                file.write(photo)
+        user = User.objects.create_user(username='user', password='password')
+        User.objects.filter(pk=user.pk).update(photo='photo_a1b2c3d.jpg')
+        company = Company.objects.create(title='Компания', leader_name='Директор', address='Адрес',
+                                         description='<img src="/media/photo.jpg"><img src="/media/default1_x.jpg">')
+        expected = (2, 3, len(self.photos[0]) + len(self.photos[1]))
+        self.assertEqual(fold_duplicates(dry_run=True), expected)
+        self.assertTrue(content_storage.exists('photo.jpg'))
+        self.assertEqual(fold_duplicates(), expected)
+        name = User.objects.get(pk=user.pk).photo.name
+        self.assertTrue(name.startswith('cas/'))
+        company = Company.objects.get(pk=company.pk)
+        self.assertEqual(company.description, '<img src="/media/%s"><img src="/media/default1.jpg">' % name)
+        self.assertEqual(company.description_html, company.description)
+        self.assertEqual(sorted(os.listdir(content_storage.location)), ['cas', 'default1.jpg'])
+        self.assertEqual(MediaBlob.objects.get(name=name).references, 2)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RichTextTest(TestCase):
+    """
+    Проверяет очищенный HTML и выдержки описаний, заполняемые при сохранении.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+        cls.company = Company.objects.create(
+            title='Компания', leader_name='Директор', address='Адрес',
+            description='<p style="text-align:center; color:red" onclick="x()">Строим <b>офисы</b>'
+                        '<script>alert(1)</script> <a href="javascript:alert(1)">и</a> '
+                        '<a href="https://example.com">склады</a></p>' + '<p>текст</p>' * 50)
+
+    def test_sanitize_html(self):
+        self.assertEqual(sanitize_html('<ul><li>один<li>два</ul><img src="x.jpg" onerror="x()"><i>'),
+                         '<ul><li>один</li><li>два</li></ul><img src="x.jpg"><i></i>')
+        self.assertEqual(sanitize_html('<p>a &lt;b&gt; &amp;</p></div><style>p {}</style>'),
+                         '<p>a &lt;b&gt; &amp;</p>')
+        self.assertEqual(excerpt('слово ' * 10, 20), 'слово слово слово…')
+        self.assertEqual(excerpt('коротко'), 'коротко')
+
+    def test_fields_are_filled_on_save(self):
+        html = self.company.description_html
+        self.assertTrue(html.startswith('<p style="text-align:center">Строим <b>офисы</b> <a>и</a> '
+                                        '<a href="https://example.com" rel="nofollow noopener">склады</a></p>'))
+        self.assertNotIn('script', html)
+        self.assertTrue(self.company.description_excerpt.startswith('Строим офисы и склады текст'))
+        self.assertTrue(self.company.description_excerpt.endswith('…'))
+        company = Company.objects.get(pk=self.company.pk)
+        company.description = '<p>Новое</p>'
+        company.save(update_fields=['description'])
+        company.refresh_from_db()
+        self.assertEqual((company.description_html, company.description_excerpt), ('<p>Новое</p>', 'Новое'))
+        company = Company.objects.defer('description').get(pk=self.company.pk)
+        company.title = 'Другая'
+        company.save()
+        self.assertEqual(Company.objects.get(pk=self.company.pk).description_excerpt, 'Новое')
+
+    def test_pages_use_rendered_fields(self):
+        self.client.force_login(self.manager)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('companies'))
+        self.assertContains(response, self.company.description_excerpt)
+        self.assertNotContains(response, 'example.com')
+        company_sql = [query['sql'] for query in queries if 'FROM "crm_company"' in query['sql']]
+        self.assertTrue(company_sql and not any('"description_html"' in sql for sql in company_sql))
+        response = self.client.get(self.company.get_absolute_url())
+        self.assertContains(response, self.company.description_html, html=False)
+        self.assertNotContains(response, 'alert(1)')
+
+    def test_backfill_command(self):
+        Company.objects.update(description='<p>Обновлено <u>в обход</u> модели</p>')
+        call_command('render_descriptions', stdout=io.StringIO())
+        company = Company.objects.get(pk=self.company.pk)
+        self.assertEqual(company.description_html, '<p>Обновлено <u>в обход</u> модели</p>')
+        self.assertEqual(company.description_excerpt, 'Обновлено в обход модели')
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CompanyWriteTest(TestCase):
+    """
+    Проверяет сохранение компании с контактами одной транзакцией с постоянным количеством запросов.
+    """
+    formsets = (('phone_set', Phone, 'phone_number', '+38050%07d'), ('email_set', Email, 'email_address', 'c%d@test.ua'),
+                ('manager_set', Manager, 'manager_name', 'Менеджер %d'))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user(username='manager', password='password', is_manager=True)
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+        self.client.get(reverse('about'))
+
+    def post_data(self, title, count, company=None):
+        """
+        Возвращает данные формы компании title с count контактами каждого вида (у company - существующими).
+        """
+        data = {'title': title, 'leader_name': 'Директор', 'address': 'Адрес', 'description': '<p>Описание</p>'}
+        for prefix, model, field, template in self.formsets:
+            existing = list(model.objects.filter(company=company).order_by('pk')) if company else []
+            data.update({'%s-TOTAL_FORMS' % prefix: str(count), '%s-INITIAL_FORMS' % prefix: str(len(existing))})
+            for i in range(count):
+                data['%s-%d-%s' % (prefix, i, field)] = template % i
+                if i < len(existing):
+                    data['%s-%d-id' % (prefix, i)] = str(existing[i].pk)
+        return data
+
+    def post(self, url, data):
+        """
+        Возвращает (ответ, количество запросов к базе данных).
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        return response, len(queries)
+
+    def test_create_and_update_with_constant_queries(self):
+        counts = []
+        for title, count in (('Small', 2), ('Large', 20)):
+            _, created_queries = self.post(reverse('company_create'), self.post_data(title, count))
+            company = Company.objects.get(title=title)
+            self.assertEqual(company.phone_set.count(), count)
+            self.assertEqual(sorted(company.email_set.values_list('email_address', flat=True))[:2],
+                             ['c0@test.ua', 'c10@test.ua'] if count > 2 else ['c0@test.ua', 'c1@test.ua'])
+            data = self.post_data(title, count + 1, company)
+            data['phone_set-0-phone_number'] = '+380991234567'
+            _, updated_queries = self.post(reverse('company_update', args=[company.pk]), data)
+            self.assertEqual(company.phone_set.filter(phone_number='+380991234567').count(), 1)
+            self.assertEqual(company.manager_set.count(), count + 1)
+            counts.append((created_queries, updated_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_unchanged_rows_are_not_written(self):
+        self.post(reverse('company_create'), self.post_data('Company', 3))
+        company = Company.objects.get(title='Company')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(reverse('company_update', args=[company.pk]), self.post_data('Company', 3, company))
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith(('UPDATE "crm_phone"', 'INSERT INTO "crm_phone"'))])
+
+    def test_invalid_contact_saves_nothing(self):
+        data = self.post_data('Company', 2)
+        data['email_set-1-email_address'] = 'not an email'
+        response = self.client.post(reverse('company_create'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['email_formset'].errors[1])
+        self.assertFalse(Company.objects.filter(title='Company').exists())
@@ -0,0 +1,272 @@
+import re
+from functools import lru_cache
+from html import escape, unescape
+from html.parser import HTMLParser
+
+
+VOWELS = 'аеиоуыэюя'
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'[а-я]')
+COMMENT_RE = re.compile(r'<!--.*?-->', re.S)
+BLOCK_TAG_RE = re.compile(r'</?(?:p|div|br|li|ul|ol|h[1-6]|tr|td|th|table|blockquote|pre|hr)\b[^>]*>', re.I)
+TAG_RE = re.compile(r'<[^>]*>')
+
+EXCERPT_LENGTH = 200
+ALLOWED_TAGS = {
+    'p': (), 'div': (), 'span': (), 'br': (), 'hr': (), 'strong': (), 'b': (), 'em': (), 'i': (), 'u': (),
+    's': (), 'sub': (), 'sup': (), 'ol': (), 'ul': (), 'li': (), 'blockquote': (), 'pre': (), 'code': (),
+    'h1': (), 'h2': (), 'h3': (), 'h4': (), 'h5': (), 'h6': (),
+    'table': (), 'thead': (), 'tbody': (), 'tr': (), 'th': ('colspan', 'rowspan'), 'td': ('colspan', 'rowspan'),
+    'a': ('href', 'title'), 'img': ('src', 'alt', 'width', 'height'),
+}
+VOID_TAGS = {'br', 'hr', 'img'}
+DROPPED_CONTENT_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'template', 'noscript'}
+URL_ATTRIBUTES = {'href', 'src'}
+SAFE_URL_RE = re.compile(r'^(?:https?:|mailto:|tel:|/|#|\.|[^:/?#]*(?:[/?#]|$))', re.I)
+STYLE_RE = re.compile(r'^(?:text-align:\s*(?:left|right|center|justify)|(?:margin|padding)-left:\s*\d{1,4}px)$')
+
+
+def endings_table(endings, after_a=()):
+    """
+    Возвращает пары (окончание, нужна ли перед ним "а" или "я") от длинных к коротким:
+    выбирается самое длинное подходящее окончание.
+    """
+    table = [(ending, False) for ending in endings] + [(ending, True) for ending in after_a]
+    return tuple(sorted(table, key=lambda item: len(item[0]), reverse=True))
+
+
+PERFECTIVE_GERUND = endings_table(('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'), after_a=('в', 'вши', 'вшись'))
+ADJECTIVE = endings_table(('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+                           'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'))
+PARTICIPLE = endings_table(('ивш', 'ывш', 'ующ'), after_a=('ем', 'нн', 'вш', 'ющ', 'щ'))
+REFLEXIVE = endings_table(('ся', 'сь'))
+VERB = endings_table(('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им',
+                      'ым', 'ен', 'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь',
+                      'ую', 'ю'),
+                     after_a=('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны',
+                              'ть', 'ешь', 'нно'))
+NOUN = endings_table(('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой',
+                      'ий', 'й', 'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию',
+                      'ью', 'ю', 'ия', 'ья', 'я'))
+SUPERLATIVE = endings_table(('ейш', 'ейше'))
+DERIVATIONAL = endings_table(('ост', 'ость'))
+
+
+def regions(word):
+    """
+    Возвращает начала областей RV и R2 слова по алгоритму Snowball.
+    """
+    rv = r1 = r2 = len(word)
+    for i, char in enumerate(word):
+        if char in VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def remove_ending(word, start, table):
+    """
+    Удаляет из word первое подходящее окончание из table (см. endings_table), целиком лежащее
+    после позиции start.
+    :return: слово без окончания или None, если окончание не найдено
+    """
+    for ending, needs_a in table:
+        position = len(word) - len(ending)
+        if position < start or not word.endswith(ending):
+            continue
+        if needs_a and (position - 1 < start or word[position - 1] not in 'ая'):
+            continue
+        return word[:position]
+    return None
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """
+    Возвращает основу русского слова (стеммер Snowball для русского языка).
+    Слова без кириллицы возвращаются в нижнем регистре без изменений.
+    Результаты кэшируются: в текстах CRM повторяется небольшой словарь.
+    """
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.search(word):
+        return word
+    rv, r2 = regions(word)
+    if rv >= len(word):
+        return word
+
+    result = remove_ending(word, rv, PERFECTIVE_GERUND)
+    if result is None:
+        word = remove_ending(word, rv, REFLEXIVE) or word
+        result = remove_ending(word, rv, ADJECTIVE)
+        if result is not None:
+            result = remove_ending(result, rv, PARTICIPLE) or result
+        else:
+            result = remove_ending(word, rv, VERB)
+            if result is None:
+                result = remove_ending(word, rv, NOUN)
+    word = result if result is not None else word
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = remove_ending(word, r2, DERIVATIONAL) or word
+
+    superlative = remove_ending(word, rv, SUPERLATIVE)
+    if superlative is not None:
+        word = superlative
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif superlative is None and word.endswith('ь') and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def html_to_text(html):
+    """
+    Возвращает текст HTML-поля RichTextField без тегов, HTML-сущностей и лишних пробелов.
+    Блочные теги заменяются пробелом, чтобы не склеивать слова соседних абзацев. Регулярные выражения
+    вместо strip_tags (HTMLParser) в несколько раз быстрее на потоковой выгрузке и индексации.
+    """
+    if not html:
+        return ''
+    if '<' in html:
+        html = TAG_RE.sub('', BLOCK_TAG_RE.sub(' ', COMMENT_RE.sub('', html)))
+    return ' '.join(unescape(html).split())
+
+
+class SanitizingParser(HTMLParser):
+    """
+    Класс SanitizingParser собирает HTML, оставляя только теги и атрибуты ALLOWED_TAGS, ссылки
+    с безопасными схемами и выравнивание и отступы из стилей (то, что дает панель CKEditor).
+    Содержимое DROPPED_CONTENT_TAGS удаляется целиком, текст экранируется заново,
+    незакрытые теги закрываются (li - перед следующим li), лишние закрывающие теги отбрасываются.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def attributes(self, tag, attrs):
+        """
+        Возвращает разрешенные атрибуты тега tag строкой для вставки в HTML.
+        """
+        result = []
+        for name, value in attrs:
+            value = (value or '').strip()
+            if name == 'style':
+                styles = [style.strip() for style in value.lower().split(';') if STYLE_RE.match(style.strip())]
+                if styles:
+                    result.append(' style="%s"' % escape('; '.join(styles)))
+            elif name in ALLOWED_TAGS[tag] and not (name in URL_ATTRIBUTES and not SAFE_URL_RE.match(value)):
+                result.append(' %s="%s"' % (name, escape(value)))
+        if tag == 'a' and any(part.startswith(' href=') for part in result):
+            result.append(' rel="nofollow noopener"')
+        return ''.join(result)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping += 1
+        elif not self.dropping and tag in ALLOWED_TAGS:
+            if tag == 'li' and self.open_tags and self.open_tags[-1] == 'li':
+                self.handle_endtag('li')
+            self.parts.append('<%s%s>' % (tag, self.attributes(tag, attrs)))
+            if tag not in VOID_TAGS:
+                self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in DROPPED_CONTENT_TAGS:
+            self.handle_starttag(tag, attrs)
+            if tag not in VOID_TAGS:
+                self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_CONTENT_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+        elif not self.dropping and tag in self.open_tags:
+            while True:
+                closed = self.open_tags.pop()
+                self.parts.append('</%s>' % closed)
+                if closed == tag:
+                    break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.parts.append(escape(data, quote=False))
+
+    def result(self):
+        """
+        Возвращает собранный HTML, закрыв оставшиеся открытыми теги.
+        """
+        self.close()
+        return ''.join(self.parts + ['</%s>' % tag for tag in reversed(self.open_tags)])
+
+
+def sanitize_html(html):
+    """
+    Возвращает HTML поля RichTextField, безопасный для вывода без экранирования (см. SanitizingParser).
+    Очистка выполняется при сохранении модели (crm.models.RichTextMixin), а не при каждом выводе.
+    """
+    if not html:
+        return ''
+    parser = SanitizingParser()
+    parser.feed(html)
+    return parser.result()
+
+
+def excerpt(text, length=EXCERPT_LENGTH):
+    """
+    Возвращает начало текста text не длиннее length символов, обрезанное по границе слова, с многоточием.
+    """
+    if len(text) <= length:
+        return text
+    cut = text[:length - 1]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' ,.;:-') + '…'
+
+
+def render_descriptions(model, batch_size=1000):
+    """
+    Заполняет description_html и description_excerpt всех объектов модели model пачками по pk
+    (bulk_update, без сохранения моделей и сигналов). Подходит и для моделей миграций.
+    :return: pk объектов, у которых поля изменились
+    """
+    changed, last_pk = [], 0
+    while True:
+        batch = list(model.objects.filter(pk__gt=last_pk).order_by('pk')
+                     .only('pk', 'description', 'description_html', 'description_excerpt')[:batch_size])
+        if not batch:
+            return changed
+        updated = []
+        for obj in batch:
+            html = sanitize_html(obj.description)
+            text = excerpt(html_to_text(html))
+            if (html, text) != (obj.description_html, obj.description_excerpt):
+                obj.description_html, obj.description_excerpt = html, text
+                updated.append(obj)
+        model.objects.bulk_update(updated, ['description_html', 'description_excerpt'])
+        changed.extend(obj.pk for obj in updated)
+        last_pk = batch[-1].pk
+
+
+def words(text):
+    """
+    Возвращает слова текста text в нижнем регистре.
+    """
+    return WORD_RE.findall((text or '').lower())
+
+
+def stem_text(text):
+    """
+    Возвращает основы всех слов текста text через пробел.
+    """
+    return ' '.join(stem(word) for word in words(text))
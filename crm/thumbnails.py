@@ -0,0 +1,76 @@
+import io
+import re
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+
+THUMBNAIL_WIDTHS = (50, 100, 200, 400)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+THUMBNAIL_DIRECTORY = 'thumbnails'
+THUMBNAIL_RE = re.compile(r'^(?P<source>.+)\.(?P<width>\d+)\.(?P<extension>webp|jpg)$')
+
+
+def thumbnail_name(source, width, extension):
+    """
+    Возвращает имя файла уменьшенной копии изображения source шириной width в формате extension.
+    Имя исходного файла входит в имя копии целиком, поэтому по копии всегда можно найти оригинал,
+    а новая загрузка (Django дает ей новое имя) получает новые адреса копий.
+    """
+    return '%s/%s.%d.%s' % (THUMBNAIL_DIRECTORY, source, width, extension)
+
+
+def parse_thumbnail_name(name):
+    """
+    Возвращает (имя оригинала, ширина, формат) по имени копии без каталога или None для чужого имени.
+    Копии копий (оригинал в каталоге THUMBNAIL_DIRECTORY) не допускаются.
+    """
+    match = THUMBNAIL_RE.match(name)
+    if match is None or int(match['width']) not in THUMBNAIL_WIDTHS \
+            or match['source'].startswith(THUMBNAIL_DIRECTORY + '/'):
+        return None
+    return match['source'], int(match['width']), match['extension']
+
+
+def render_thumbnails(source, widths=THUMBNAIL_WIDTHS):
+    """
+    Возвращает {(ширина, формат): байты} уменьшенных копий изображения source из хранилища.
+    JPEG декодируется сразу в уменьшенном масштабе (draft), что в несколько раз быстрее полного
+    декодирования большой фотографии; копии не шире оригинала.
+    """
+    with default_storage.open(source) as file:
+        image = Image.open(file)
+        image.draft('RGB', (max(widths), max(widths) * image.height // image.width))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+    rendered = {}
+    for width in widths:
+        size = min(width, image.width)
+        resized = image.resize((size, max(1, image.height * size // image.width)), Image.LANCZOS)
+        for extension, (image_format, _, options) in THUMBNAIL_FORMATS.items():
+            buffer = io.BytesIO()
+            resized.save(buffer, image_format, **options)
+            rendered[width, extension] = buffer.getvalue()
+    return rendered
+
+
+def make_thumbnails(source, force=False):
+    """
+    Создает в хранилище недостающие уменьшенные копии изображения source всех ширин THUMBNAIL_WIDTHS
+    (force - пересоздает все). Возвращает количество созданных файлов.
+    """
+    widths = [width for width in THUMBNAIL_WIDTHS
+              if force or not all(default_storage.exists(thumbnail_name(source, width, extension))
+                                  for extension in THUMBNAIL_FORMATS)]
+    if not widths:
+        return 0
+    rendered = render_thumbnails(source, widths)
+    for (width, extension), data in rendered.items():
+        name = thumbnail_name(source, width, extension)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        default_storage.save(name, ContentFile(data))
+    return len(widths) * len(THUMBNAIL_FORMATS)
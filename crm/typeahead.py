@@ -0,0 +1,245 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError
+
+from crm.cache import publish, receive
+from crm.models import Company, Project, Customer, ManagerCRM
+
+
+logger = logging.getLogger(__name__)
+
+TYPEAHEAD_REFRESH = getattr(settings, 'CRM_TYPEAHEAD_REFRESH', 600)
+TYPEAHEAD_CHANNEL = 'typeahead'
+
+TYPEAHEAD_SOURCES = {
+    Company: ('company', 'title'),
+    Project: ('project', 'name'),
+    Customer: ('customer', 'name'),
+    ManagerCRM: ('manager_crm', 'name'),
+}
+
+
+def fold(name):
+    """
+    Возвращает имя, приведенное к виду для сравнения без учета регистра.
+    """
+    return ' '.join((name or '').casefold().replace('ё', 'е').split())
+
+
+def name_keys(name):
+    """
+    Возвращает ключи индекса для имени: все имя и его окончания с начала каждого слова,
+    чтобы "ромашка" находила "ООО Ромашка".
+    """
+    folded = fold(name)
+    keys = [folded]
+    for i, char in enumerate(folded):
+        if char == ' ':
+            keys.append(folded[i + 1:])
+    return keys
+
+
+class PrefixIndex:
+    """
+    Класс PrefixIndex - отсортированный массив ключей (casefold имен) с pk и исходными именами.
+    Поиск по префиксу - bisect и последовательное чтение, изменения - вставка и удаление по позиции bisect.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.values = []
+        self.names = {}
+
+    def build(self, items):
+        """
+        Строит индекс заново по парам (pk, имя).
+        """
+        rows = sorted((key, pk) for pk, name in items for key in name_keys(name))
+        self.keys = [key for key, _ in rows]
+        self.values = [pk for _, pk in rows]
+        self.names = {}
+        for pk, name in items:
+            self.names[pk] = name
+
+    def add(self, pk, name):
+        """
+        Добавляет (или заменяет) имя объекта pk.
+        """
+        self.remove(pk)
+        for key in name_keys(name):
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key and self.values[position] < pk:
+                position += 1
+            self.keys.insert(position, key)
+            self.values.insert(position, pk)
+        self.names[pk] = name
+
+    def remove(self, pk):
+        """
+        Удаляет имя объекта pk, если оно есть в индексе.
+        """
+        name = self.names.pop(pk, None)
+        if name is None:
+            return
+        for key in name_keys(name):
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                if self.values[position] == pk:
+                    del self.keys[position]
+                    del self.values[position]
+                    break
+                position += 1
+
+    def search(self, prefix, limit):
+        """
+        Возвращает до limit пар (pk, имя), у которых имя или одно из его слов начинается с prefix,
+        по алфавиту ключей.
+        """
+        prefix, found = fold(prefix), {}
+        position = bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(found) < limit and self.keys[position].startswith(prefix):
+            pk = self.values[position]
+            found.setdefault(pk, self.names[pk])
+            position += 1
+        return list(found.items())
+
+
+class TypeaheadIndex:
+    """
+    Класс TypeaheadIndex хранит в памяти процесса по PrefixIndex на каждый тип объектов TYPEAHEAD_SOURCES.
+    Индекс строится при первом обращении (или при старте worker, см. crm_belousov/wsgi.py)
+    и обновляется сигналами моделей. Изменения публикуются в канале TYPEAHEAD_CHANNEL общего кэша
+    (crm.cache.publish), и индексы других процессов применяют их перед поиском. Раз в TYPEAHEAD_REFRESH
+    секунд индекс перестраивается в фоновом потоке: так подхватываются изменения, которые не прошли
+    через канал (запись в обход моделей, отставание дольше хранения сообщений).
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.indexes = None
+        self.built_at = None
+        self.refreshing = False
+        self.last_message = None
+
+    def load(self):
+        """
+        Читает имена из базы данных и возвращает новый словарь {тип: PrefixIndex}.
+        """
+        indexes = {}
+        for model, (kind, field) in TYPEAHEAD_SOURCES.items():
+            indexes[kind] = PrefixIndex()
+            indexes[kind].build(list(model.objects.exclude(**{field: None}).values_list('pk', field).iterator()))
+        return indexes
+
+    def build(self):
+        """
+        Строит индекс заново. Номер последнего сообщения канала читается до загрузки имен,
+        поэтому изменения, опубликованные во время загрузки, будут применены.
+        """
+        last_message, _ = receive(TYPEAHEAD_CHANNEL)
+        indexes = self.load()
+        with self.lock:
+            self.indexes, self.built_at, self.last_message = indexes, time.monotonic(), last_message
+
+    def refresh(self):
+        """
+        Перестраивает индекс в фоновом потоке, продолжая отвечать по старому.
+        """
+        try:
+            self.build()
+        except DatabaseError:
+            logger.exception('Не удалось перестроить индекс подсказок')
+        finally:
+            self.refreshing = False
+
+    def ensure_built(self):
+        """
+        Строит индекс, если он еще не построен, иначе применяет изменения из канала и запускает
+        фоновое обновление устаревшего индекса.
+        """
+        if self.indexes is None:
+            with self.lock:
+                if self.indexes is None:
+                    self.build()
+            return
+        self.sync()
+        if TYPEAHEAD_REFRESH and time.monotonic() - self.built_at > TYPEAHEAD_REFRESH and not self.refreshing:
+            self.refreshing = True
+            threading.Thread(target=self.refresh, daemon=True).start()
+
+    def search(self, prefix, kinds, limit=10):
+        """
+        Возвращает до limit словарей {'type', 'id', 'name'} объектов типов kinds, имя которых
+        (или слово в имени) начинается с prefix, без обращения к базе данных.
+        """
+        if not fold(prefix):
+            return []
+        self.ensure_built()
+        with self.lock:
+            results = [(fold(name), kind, pk, name) for kind in kinds
+                       for pk, name in self.indexes[kind].search(prefix, limit)]
+        return [{'type': kind, 'id': pk, 'name': name} for _, kind, pk, name in sorted(results)[:limit]]
+
+    def apply(self, model, names):
+        """
+        Применяет к уже построенному индексу имена объектов модели model из пар (pk, имя);
+        имя None удаляет объект.
+        """
+        kind, _ = TYPEAHEAD_SOURCES[model]
+        with self.lock:
+            if self.indexes is not None:
+                for pk, name in names:
+                    if name is None:
+                        self.indexes[kind].remove(pk)
+                    else:
+                        self.indexes[kind].add(pk, name)
+
+    def sync(self):
+        """
+        Применяет изменения, опубликованные в канале TYPEAHEAD_CHANNEL после последнего прочитанного
+        сообщения (в том числе свои: повторное применение ничего не меняет).
+        """
+        last_message, messages = receive(TYPEAHEAD_CHANNEL, self.last_message)
+        for label, names in messages:
+            self.apply(apps.get_model(label), names)
+        self.last_message = last_message
+
+    def update_many(self, model, names):
+        """
+        Обновляет имена объектов модели model из пар (pk, имя) в уже построенном индексе
+        и публикует изменение для индексов других процессов.
+        """
+        names = list(names)
+        self.apply(model, names)
+        publish(TYPEAHEAD_CHANNEL, (model._meta.label, names))
+
+    def update(self, model, pk, name):
+        """
+        Обновляет имя объекта pk модели model.
+        """
+        self.update_many(model, [(pk, name)])
+
+    def remove(self, model, pk):
+        """
+        Удаляет объект pk модели model.
+        """
+        self.update_many(model, [(pk, None)])
+
+
+typeahead_index = TypeaheadIndex()
+
+
+def warm_up():
+    """
+    Строит индекс подсказок при старте процесса. Ошибка базы данных не мешает старту:
+    индекс будет построен при первом запросе.
+    """
+    try:
+        typeahead_index.build()
+    except DatabaseError:
+        logger.exception('Не удалось построить индекс подсказок')
@@ -1,53 +1,70 @@
 from django.urls import path
+from .models import Company, Project, Interaction
 from .views import \
     CompanyDetailView, \
     CompanyCreateView, \
+    CompanyImportView, \
     CompanyDeleteView, \
     CompanyUpdateView, \
     CompanyProjectsDetailView, \
     ProjectDetailView, \
     ProjectDeleteView, \
     ProjectUpdateView, \
-    CompanyProjectsNotStartedDetailView, \
-    CompanyProjectsInProcessDetailView, \
-    CompanyProjectsCompletedDetailView, \
+    CompanyProjectsStatusDetailView, \
     ProjectInteractionsDetailView, \
     CompanyProjectInteractionsDetailView, \
-    CompanyInteractionsPhonesDetailView, \
-    CompanyInteractionsEmailDetailView, \
-    CompanyInteractionsMessengerDetailView, \
-    ProjectInteractionsPhonesDetailView, \
-    ProjectInteractionsEmailDetailView, \
-    ProjectInteractionsMessengerDetailView
+    InteractionsChannelDetailView
 
 
 urlpatterns = [
     path('create/', CompanyCreateView.as_view(), name='company_create'),
+    path('import/', CompanyImportView.as_view(), name='company_import'),
     path('<int:pk>/', CompanyDetailView.as_view(), name='company-detail'),
 
     path('<int:pk>/projects/', CompanyProjectsDetailView.as_view(), name='projects'),
     path('<int:pk>/interactions/', CompanyProjectInteractionsDetailView.as_view(), name='company_interactions'),
 
-    path('<int:pk>/interactions_phones', CompanyInteractionsPhonesDetailView.as_view(),
+    path('<int:pk>/interactions_phones',
+         InteractionsChannelDetailView.as_view(model=Company, channel_of_reference=Interaction.channel_phone,
+                                               template_name='crm/companyinteractions_detail_phones.html'),
          name='company_interactions_phones'),
-    path('<int:pk>/interactions_email', CompanyInteractionsEmailDetailView.as_view(),
+    path('<int:pk>/interactions_email',
+         InteractionsChannelDetailView.as_view(model=Company, channel_of_reference=Interaction.channel_email,
+                                               template_name='crm/companyinteractions_detail_email.html'),
          name='company_interactions_email'),
-    path('<int:pk>/interactions_messenger', CompanyInteractionsMessengerDetailView.as_view(),
+    path('<int:pk>/interactions_messenger',
+         InteractionsChannelDetailView.as_view(model=Company, channel_of_reference=Interaction.channel_messenger,
+                                               template_name='crm/companyinteractions_detail_messenger.html'),
          name='company_interactions_messenger'),
 
-    path('<int:pk>/projects_not_started/', CompanyProjectsNotStartedDetailView.as_view(), name='projects_not_started'),
-    path('<int:pk>/projects_in_process/', CompanyProjectsInProcessDetailView.as_view(), name='projects_in_process'),
-    path('<int:pk>/completed/', CompanyProjectsCompletedDetailView.as_view(), name='projects_completed'),
+    path('<int:pk>/projects_not_started/',
+         CompanyProjectsStatusDetailView.as_view(status_pro=Project.status_not_started,
+                                                 template_name='crm/companyproject_detail_not_started.html'),
+         name='projects_not_started'),
+    path('<int:pk>/projects_in_process/',
+         CompanyProjectsStatusDetailView.as_view(status_pro=Project.status_in_process,
+                                                 template_name='crm/companyproject_detail_in_process.html'),
+         name='projects_in_process'),
+    path('<int:pk>/completed/',
+         CompanyProjectsStatusDetailView.as_view(status_pro=Project.status_completed,
+                                                 template_name='crm/companyproject_detail_completed.html'),
+         name='projects_completed'),
     path('<int:pk>/delete/', CompanyDeleteView.as_view(), name='company_delete'),
     path('<int:pk>/update/', CompanyUpdateView.as_view(), name='company_update'),
     path('project/<int:pk>/', ProjectDetailView.as_view(), name='project-detail'),
     path('project/<int:pk>/interactions/', ProjectInteractionsDetailView.as_view(), name='project_interactions'),
-    path('project/<int:pk>/interactions_phones/', ProjectInteractionsPhonesDetailView.as_view(),
-         name='project_interactions_phones'),
-    path('project/<int:pk>/interactions_email/', ProjectInteractionsEmailDetailView.as_view(),
-         name='project_interactions_phones'),
-    path('project/<int:pk>/interactions_messenger/', ProjectInteractionsMessengerDetailView.as_view(),
+    path('project/<int:pk>/interactions_phones/',
+         InteractionsChannelDetailView.as_view(model=Project, channel_of_reference=Interaction.channel_phone,
+                                               template_name='crm/projectinteractions_detail_phones.html'),
          name='project_interactions_phones'),
+    path('project/<int:pk>/interactions_email/',
+         InteractionsChannelDetailView.as_view(model=Project, channel_of_reference=Interaction.channel_email,
+                                               template_name='crm/projectinteractions_detail_email.html'),
+         name='project_interactions_email'),
+    path('project/<int:pk>/interactions_messenger/',
+         InteractionsChannelDetailView.as_view(model=Project, channel_of_reference=Interaction.channel_messenger,
+                                               template_name='crm/projectinteractions_detail_messenger.html'),
+         name='project_interactions_messenger'),
     path('project/<int:pk>/delete/', ProjectDeleteView.as_view(), name='project_delete'),
     path('project/<int:pk>/update/', ProjectUpdateView.as_view(), name='project_update'),
 
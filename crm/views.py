@@ -1,20 +1,303 @@
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.core.files.storage import default_storage
 from django.shortcuts import reverse
 from django.urls import reverse_lazy
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.views import View
 from django.views.generic import ListView, DetailView, CreateView, DeleteView, UpdateView, FormView
 from django.views.generic.list import MultipleObjectMixin
 from django.contrib.auth.views import PasswordChangeView
 from django.contrib.auth.forms import PasswordChangeForm
 from crm.forms import PhoneFormSet, EmailFormSet, ManagerFormSet, CompanyModelForm, InteractionModelForm, \
-    ManagerCRMFormSet, CustomerFormSet
-from crm.models import Company, User, Project, Interaction, ManagerCRM, Customer
+    ManagerCRMFormSet, CustomerFormSet, ProjectModelForm, CompanyImportForm
+from crm.models import Company, User, Project, Interaction, ManagerCRM, Customer, RevenueSummary, \
+    SearchDocument
+from crm.cache import customer_projects_key, customer_projects_timeout, invalidate_object, \
+    invalidate_table, status_count_timeout
+from crm.counters import COUNTER_FIELDS
+from crm.pagination import CursorPaginationMixin, CachedCountPaginator
+from crm.export import EXPORT_CONTENT_TYPES, EXPORT_WRITERS, export_rows
+from crm.importer import import_file
+from crm.objectcache import object_cache
+from crm.search import search
+from crm.thumbnails import THUMBNAIL_FORMATS, make_thumbnails, parse_thumbnail_name, thumbnail_name
+from crm.typeahead import typeahead_index
+from PIL import Image
+
+
+def rich_text_fields(*prefixes):
+    """
+    Возвращает для list_defer поля исходного и очищенного HTML описаний модели списка ('')
+    и связанных моделей (префиксы путей, например 'company__'): списки выводят только выдержку.
+    """
+    return tuple(prefix + field for prefix in prefixes for field in ('description', 'description_html'))
+
+
+class ListQueryMixin:
+    """
+    Класс-примесь для списков: объявляет загрузку связанных объектов (list_select_related,
+    list_prefetch_related), отложенные поля (list_defer), которые список не отображает,
+    и бюджет SQL-запросов на одну страницу (query_budget), проверяемый в тестах.
+    Бюджет учитывает и запросы сессии и пользователя и не зависит от размера страницы.
+    Количество строк для пагинации берется из кэша (CachedCountPaginator); списки, запрос которых
+    зависит от текущего времени, задают ключ кэша без него (get_count_signature, count_objects).
+    """
+    paginator_class = CachedCountPaginator
+    list_select_related = ()
+    list_prefetch_related = ()
+    list_defer = ()
+    query_budget = None
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        """
+        Возвращает paginator с ключом и временем жизни кэша количества строк списка.
+        """
+        return super().get_paginator(queryset, per_page, orphans, allow_empty_first_page,
+                                     count_signature=self.get_count_signature(),
+                                     count_function=self.count_objects, **kwargs)
+
+    def get_count_signature(self):
+        """
+        Возвращает ключ кэша количества строк вместо текста запроса (None - ключ по тексту запроса).
+        """
+        return None
+
+    def count_objects(self):
+        """
+        Возвращает (количество строк списка, время жизни в кэше) при промахе кэша или None -
+        тогда считаются строки запроса списка.
+        """
+        return None
+
+    def optimize_queryset(self, qs):
+        """
+        Применяет к qs объявленные select_related, prefetch_related и defer.
+        """
+        if self.list_select_related:
+            qs = qs.select_related(*self.list_select_related)
+        if self.list_prefetch_related:
+            qs = qs.prefetch_related(*self.list_prefetch_related)
+        if self.list_defer:
+            qs = qs.defer(*self.list_defer)
+        return qs
+
+
+class ExportMixin:
+    """
+    Класс-примесь для списка: вместо страницы отдает весь список с той же сортировкой и фильтрами
+    (get_queryset списка) файлом CSV или XLSX (?format=). Строки читаются пачками и отправляются
+    через StreamingHttpResponse по мере чтения (crm.export). Выгрузка доступна только менеджерам
+    и администраторам.
+    """
+    export_columns = ()
+    export_html_fields = ()
+    export_name = 'export'
+
+    def get(self, request, *args, **kwargs):
+        """
+        Возвращает файл выгрузки.
+        """
+        if not (request.user.is_authenticated and (request.user.is_manager or request.user.is_admin)):
+            raise PermissionDenied
+        file_format = request.GET.get('format', 'csv')
+        if file_format not in EXPORT_WRITERS:
+            raise Http404
+        headers = [header for header, _ in self.export_columns]
+        rows = export_rows(self.get_queryset(), [field for _, field in self.export_columns], self.export_html_fields)
+        response = StreamingHttpResponse(EXPORT_WRITERS[file_format](headers, rows),
+                                         content_type=EXPORT_CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = 'attachment; filename="%s-%s.%s"' % (
+            self.export_name, timezone.localdate().isoformat(), file_format)
+        return response
+
+
+class ConditionalDetailMixin:
+    """
+    Класс-примесь для DetailView: отвечает 304 на If-None-Match и If-Modified-Since, не строя страницу.
+    Состояние страницы читается одним запросом по pk (с JOIN по внешним ключам): даты изменения
+    объекта и связанных объектов (modified_fields) дают Last-Modified, вместе с остальными
+    отображаемыми значениями (etag_fields) и ролью пользователя - ETag. Счетчики компании и имена
+    пользователей обновляют даты изменения страниц, на которых отображаются (crm.counters, crm.signals).
+    Last-Modified отдается с точностью до секунды, поэтому только после окончания секунды изменения:
+    запись позже в ту же секунду иначе получила бы ту же дату, и клиент - 304 с устаревшей страницей.
+    """
+    modified_fields = ('updated_date',)
+    etag_fields = ()
+
+    def get_condition_dates(self, row):
+        """
+        Возвращает даты изменения страницы по строке состояния row.
+        """
+        return [row[field] for field in self.modified_fields if row[field] is not None]
+
+    def get_condition(self):
+        """
+        Возвращает (ETag, Last-Modified в секундах или None) страницы или (None, None), если объекта нет.
+        """
+        row = self.model.objects.filter(pk=self.kwargs[self.pk_url_kwarg])\
+            .values(*self.modified_fields + self.etag_fields).first()
+        if row is None:
+            return None, None
+        dates = self.get_condition_dates(row)
+        user = self.request.user
+        viewer = (user.pk, user.get_username(), user.is_manager, user.is_admin, user.is_customer) \
+            if user.is_authenticated else None
+        signature = repr((self.request.get_full_path(), sorted(row.items()), dates, viewer))
+        last_modified = int(max(dates).timestamp()) if dates else None
+        if last_modified is not None and last_modified >= int(timezone.now().timestamp()):
+            last_modified = None
+        return quote_etag(hashlib.md5(signature.encode()).hexdigest()), last_modified
+
+    def get(self, request, *args, **kwargs):
+        """
+        Возвращает 304, если страница не изменилась, иначе строит ее.
+        """
+        etag, last_modified = self.get_condition()
+        response = None
+        if etag is not None:
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if etag is not None:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class CachedObjectMixin:
+    """
+    Класс-примесь для DetailView: читает объект по pk со связанными объектами object_relations
+    (пути select_related) из кэша объектов (crm.objectcache), а не из базы данных.
+    """
+    object_relations = ()
+
+    def get_object(self, queryset=None):
+        """
+        Возвращает объект страницы из кэша объектов.
+        """
+        try:
+            return object_cache.get(self.model, self.kwargs[self.pk_url_kwarg], self.object_relations)
+        except self.model.DoesNotExist:
+            raise Http404('%s не найден' % self.model._meta.verbose_name)
+
+
+class ConstraintErrorMixin:
+    """
+    Класс-примесь для CreateView и UpdateView с формой ConstraintErrorsMixin: сохраняет объект
+    в транзакции и показывает нарушение ограничения базы данных как ошибку поля формы,
+    поэтому проверка уникальности не требует отдельного запроса.
+    """
+
+    def form_valid(self, form):
+        """
+        Сохраняет форму и перенаправляет на success_url или возвращает форму с ошибкой ограничения.
+        """
+        try:
+            with transaction.atomic():
+                self.save_form(form)
+        except IntegrityError as error:
+            if not form.add_constraint_error(error):
+                raise
+            return self.form_invalid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
+    def save_form(self, form):
+        """
+        Сохраняет объект формы; выполняется в транзакции form_valid.
+        """
+        self.object = form.save()
+
+
+class CompanyContactsMixin(ConstraintErrorMixin):
+    """
+    Класс-примесь для создания и редактирования компании вместе с телефонами, e-mail и менеджерами
+    (формсеты contact_formsets). Компания и контакты сохраняются в одной транзакции: компания - один раз,
+    новые контакты - bulk_create, измененные - bulk_update только измененных полей, неизмененные строки
+    формсетов не сохраняются. Количество запросов не зависит от количества контактов. bulk_create
+    и bulk_update не отправляют сигналы, поэтому кэши таблиц контактов сбрасываются явно, а дату
+    изменения компании обновляет ее сохранение.
+    """
+    contact_formsets = (('phone_formset', PhoneFormSet), ('email_formset', EmailFormSet),
+                        ('manager_formset', ManagerFormSet))
+
+    def get_formsets(self):
+        """
+        Возвращает {имя в контексте: формсет} для компании self.object (None - новая компания).
+        """
+        data = (self.request.POST,) if self.request.method == 'POST' else ()
+        return {name: formset_class(*data, instance=self.object) for name, formset_class in self.contact_formsets}
+
+    def get_context_data(self, **kwargs):
+        """
+        Возвращает словарь, представляющий контекст шаблона, с формсетами контактов
+        (уже проверенными в form_valid, если они есть).
+        """
+        context = super().get_context_data(**kwargs)
+        context.update(getattr(self, 'formsets', None) or self.get_formsets())
+        return context
+
+    def form_valid(self, form):
+        """
+        Проверяет формсеты контактов и сохраняет компанию с контактами или возвращает форму с ошибками.
+        """
+        self.formsets = self.get_formsets()
+        if not all([formset.is_valid() for formset in self.formsets.values()]):
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+    def save_form(self, form):
+        """
+        Сохраняет компанию и контакты из формсетов.
+        """
+        self.object = form.save()
+        for formset in self.formsets.values():
+            formset.instance = self.object
+            contacts = formset.save(commit=False)
+            model = formset.model
+            created = [contact for contact in contacts if contact._state.adding]
+            updated = [contact for contact in contacts if not contact._state.adding]
+            model.objects.bulk_create(created)
+            if updated:
+                fields = {name for _, changed in formset.changed_objects for name in changed}
+                model.objects.bulk_update(updated, fields)
+                for contact in updated:
+                    invalidate_object(model, contact.pk)
+            if contacts:
+                invalidate_table(model._meta.db_table)
+
+
+def project_ordering(ordering):
+    """
+    Заменяет сортировку по сохраненному полю status_pro на сортировку по статусу,
+    вычисленному в момент запроса (ProjectQuerySet.with_status).
+    """
+    if ordering.lstrip('-') == 'status_pro':
+        return ordering.replace('status_pro', 'current_status')
+    return ordering
 
 
-class CompanyListView(ListView):
+class CompanyListView(ListQueryMixin, ListView):
     """
     Класс отображения списка компаний на сайте.
     """
     model = Company
     paginate_by = 3
+    list_defer = rich_text_fields('')
+    query_budget = 4
+    ordering_fields = ('title', 'created_date', 'projects_not_started', 'projects_in_process',
+                       'projects_completed', 'interactions_phone', 'interactions_email',
+                       'interactions_messenger', 'last_interaction_date')
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -30,122 +313,68 @@ class CompanyListView(ListView):
         Определяет по каким полям можно делать сортировку на странице.
         """
         ordering = self.request.GET.get('sort', 'title')
-        return ordering if ordering in ('-title', 'created_date', '-created_date', 'title') else 'title'
+        return ordering if ordering.lstrip('-') in self.ordering_fields else 'title'
 
     def get_queryset(self):
         """
         Определяет список объектов модели Company, которые мы хотим отобразить.
         """
         qs = Company.objects.order_by(self.get_ordering())
-        return qs
+        return self.optimize_queryset(qs)
+
+
+class CompanyImportView(FormView):
+    """
+    Класс загрузки файла CSV или JSONL для импорта компаний с телефонами, e-mail и контактными лицами.
+    Файл читается потоком и сохраняется пачками (crm.importer), итоги показываются на той же странице.
+    Импорт доступен только менеджерам и администраторам.
+    """
+    form_class = CompanyImportForm
+    template_name = 'crm/company_import.html'
+
+    def post(self, request, *args, **kwargs):
+        """
+        Проверяет права пользователя перед импортом.
+        """
+        if not (request.user.is_authenticated and (request.user.is_manager or request.user.is_admin)):
+            raise PermissionDenied
+        return super().post(request, *args, **kwargs)
 
+    def form_valid(self, form):
+        """
+        Импортирует загруженный файл и показывает итоги импорта.
+        """
+        file = form.cleaned_data['file']
+        result = import_file(file, form.get_format(file))
+        return self.render_to_response(self.get_context_data(form=form, result=result))
 
-class CompanyDetailView(DetailView):
+
+class CompanyDetailView(ConditionalDetailMixin, CachedObjectMixin, DetailView):
     """
     Класс отображения информации о конкретной компании по pk.
+    Изменение телефонов, e-mail и контактных лиц обновляет дату изменения компании (crm.signals).
     """
     model = Company
     query_pk_and_slug = True
+    etag_fields = tuple(COUNTER_FIELDS)
 
 
-class CompanyCreateView(CreateView):
+class CompanyCreateView(CompanyContactsMixin, CreateView):
     """
     Класс создания записи о новой компании.
     """
     model = Company
-    fields = ['title', 'leader_name', 'description', 'address']
+    form_class = CompanyModelForm
 
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        context = super(CompanyCreateView, self).get_context_data(**kwargs)
-        if self.request.POST:
-            context['phone_formset'] = PhoneFormSet(self.request.POST)
-            context['email_formset'] = EmailFormSet(self.request.POST)
-            context['manager_formset'] = ManagerFormSet(self.request.POST)
-        else:
-            context['phone_formset'] = PhoneFormSet()
-            context['email_formset'] = EmailFormSet()
-            context['manager_formset'] = ManagerFormSet()
-        return context
 
-    def form_valid(self, form):
-        """
-        Проверяет валидность заполненной информации в форме.
-        """
-        context = self.get_context_data(form=form)
-        self.author = self.request.user
-        formsets = [context['phone_formset'], context['email_formset'], context['manager_formset']]
-        count = 0
-        for formset in formsets:
-            if formset.is_valid():
-                response = super().form_valid(form)
-                # formset.instance = self.object
-                # formset.save()
-                contacts = formset.save(commit=False)
-                for contact in contacts:
-                    contact.user = self.request.user
-                    contact.company = self.object
-                    contact.save()
-                count += 1
-                if count == len(formsets):
-                    return response
-            else:
-                return super().form_invalid(form)
-
-
-class CompanyUpdateView(UpdateView):
+class CompanyUpdateView(CompanyContactsMixin, UpdateView):
     """
     Класс редаактированния записи о компании на странице.
     """
     model = Company
     query_pk_and_slug = True
     template_name_suffix = '_update'
-    fields = ['title', 'leader_name', 'description', 'address']
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        context = super(CompanyUpdateView, self).get_context_data(**kwargs)
-        if self.request.POST:
-            context['phone_formset'] = PhoneFormSet(self.request.POST, instance=self.object)
-            context['phone_formset'].full_clean()
-            context['email_formset'] = EmailFormSet(self.request.POST, instance=self.object)
-            context['email_formset'].full_clean()
-            context['manager_formset'] = ManagerFormSet(self.request.POST, instance=self.object)
-            context['manager_formset'].full_clean()
-        else:
-            context['phone_formset'] = PhoneFormSet(instance=self.object)
-            context['email_formset'] = EmailFormSet(instance=self.object)
-            context['manager_formset'] = ManagerFormSet(instance=self.object)
-        return context
-
-    def form_valid(self, form):
-        """
-        Проверяет валидность заполненной информации в форме.
-        """
-        context = self.get_context_data(form=form)
-        formsets = [context['phone_formset'], context['email_formset'], context['manager_formset']]
-        count = 0
-        for formset in formsets:
-            if formset.is_valid():
-                response = super().form_valid(form)
-                # formset.instance = self.object
-                # formset.save()
-                contacts = formset.save(commit=False)
-                for contact in contacts:
-                    contact.user = self.request.user
-                    contact.company = self.object
-                    contact.save()
-                count += 1
-                if count == len(formsets):
-                    return response
-            else:
-                return super().form_invalid(form)
+    form_class = CompanyModelForm
 
 
 class CompanyDeleteView(DeleteView):
@@ -283,13 +512,15 @@ class UserCustomerUpdateView(UpdateView):
                 return super().form_invalid(form)
 
 
-class ManagerCRMListView(ListView):
+class ManagerCRMListView(ListQueryMixin, ListView):
     """
     Класс по отображению списка пользователей со статусом - менеджер-CRM.
     """
     model = ManagerCRM
     paginate_by = 3
     template_name = 'crm/manager_crm_list.html'
+    list_select_related = ('user',)
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -312,25 +543,28 @@ class ManagerCRMListView(ListView):
         Определяет список объектов модели ManagerCRM, которые мы хотим отобразить.
         """
         qs = ManagerCRM.objects.order_by(self.get_ordering())
-        return qs
+        return self.optimize_queryset(qs)
 
 
-class ManagerCRMDetailView(DetailView):
+class ManagerCRMDetailView(CachedObjectMixin, DetailView):
     """
     Класс отображает информацию о конкретном пользователе со статусом - менеджер-CRM по pk.
     """
     model = ManagerCRM
     query_pk_and_slug = True
+    object_relations = ('user',)
     template_name = 'crm/manager_crm_detail.html'
 
 
-class CustomerListView(ListView):
+class CustomerListView(ListQueryMixin, ListView):
     """
     Класс по отображению списка пользователей со статусом - заказчик.
     """
     model = Customer
     paginate_by = 3
     template_name = 'crm/customer_list.html'
+    list_select_related = ('user',)
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -353,19 +587,20 @@ class CustomerListView(ListView):
         Определяет список объектов модели Customer, которые мы хотим отобразить.
         """
         qs = Customer.objects.order_by(self.get_ordering())
-        return qs
+        return self.optimize_queryset(qs)
 
 
-class CustomerDetailView(DetailView):
+class CustomerDetailView(CachedObjectMixin, DetailView):
     """
     Класс отображает информацию о конкретном пользователе со статусом - заказчик по pk.
     """
     model = Customer
     query_pk_and_slug = True
+    object_relations = ('user',)
     template_name = 'crm/customer_detail.html'
 
 
-class CompanyProjectsDetailView(DetailView, MultipleObjectMixin):
+class CompanyProjectsDetailView(ListQueryMixin, DetailView, MultipleObjectMixin):
     """
     Класс отображает список всех проектов конкретной компании по ее pk.
     """
@@ -373,88 +608,74 @@ class CompanyProjectsDetailView(DetailView, MultipleObjectMixin):
     paginate_by = 3
     query_pk_and_slug = True
     template_name = 'crm/companyproject_detail.html'
+    list_select_related = ('customer__user',)
+    list_defer = rich_text_fields('')
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         """
         Возвращает словарь, представляющий контекст шаблона.
         Приведенные аргументы ключевого слова составят возвращаемый контекст.
         """
-        object_list = Project.objects.filter(company=self.object)
+        object_list = self.optimize_queryset(Project.objects.filter(company=self.object).with_status())
         context = super(CompanyProjectsDetailView, self).get_context_data(object_list=object_list, **kwargs)
         context['current_order'] = self.get_ordering()
         context['form'] = CompanyModelForm()
         return context
 
 
-class CompanyProjectsNotStartedDetailView(DetailView, MultipleObjectMixin):
+class CompanyProjectsStatusDetailView(ListQueryMixin, DetailView, MultipleObjectMixin):
     """
-    Класс отображает список проектов со статусом - Еще не начат, конкретной компании по ее pk.
+    Класс отображает список проектов конкретной компании по ее pk с заданным статусом проекта.
+    Статус (status_pro) и шаблон передаются через as_view() в urls.py,
+    фильтрация по статусу, вычисленному по датам проекта, выполняется в базе данных.
     """
     model = Company
     paginate_by = 3
     query_pk_and_slug = True
-    template_name = 'crm/companyproject_detail_not_started.html'
+    status_pro = None
+    list_select_related = ('customer__user',)
+    list_defer = rich_text_fields('')
+    query_budget = 5
 
-    def get_context_data(self, **kwargs):
+    def get_count_signature(self):
         """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
+        Количество проектов кэшируется по компании и статусу, а не по запросу с текущим временем.
         """
-        object_list = Project.objects.filter(company=self.object)
-        context = super(CompanyProjectsNotStartedDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
+        return 'projects_status', self.object.pk, self.status_pro
 
-class CompanyProjectsInProcessDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список проектов со статусом - В процессе разработки, конкретной компании по ее pk.
-    """
-    model = Company
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/companyproject_detail_in_process.html'
-
-    def get_context_data(self, **kwargs):
+    def count_objects(self):
         """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
+        Количество проектов и ближайшая смена статуса проекта компании читаются одним запросом:
+        количество живет в кэше не дольше этой смены.
         """
-        object_list = Project.objects.filter(company=self.object)
-        context = super(CompanyProjectsInProcessDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class CompanyProjectsCompletedDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список проектов со статусом - Выполнен, конкретной компании по ее pk.
-    """
-    model = Company
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/companyproject_detail_completed.html'
+        count, change = Project.objects.filter(company=self.object).count_status(self.status_pro, self.now)
+        return count, status_count_timeout(change, self.now)
 
     def get_context_data(self, **kwargs):
         """
         Возвращает словарь, представляющий контекст шаблона.
         Приведенные аргументы ключевого слова составят возвращаемый контекст.
         """
-        object_list = Project.objects.filter(company=self.object)
-        context = super(CompanyProjectsCompletedDetailView, self).get_context_data(object_list=object_list, **kwargs)
+        self.now = timezone.now()
+        object_list = self.optimize_queryset(
+            Project.objects.filter(company=self.object).filter_status(self.status_pro, self.now).with_status()
+            .order_by('start_date', 'pk'))
+        context = super(CompanyProjectsStatusDetailView, self).get_context_data(object_list=object_list, **kwargs)
         context['current_order'] = self.get_ordering()
         context['form'] = CompanyModelForm()
         return context
 
 
-class ProjectListView(ListView):
+class ProjectListView(ListQueryMixin, CursorPaginationMixin, ListView):
     """
-    Класс отображает список всех проектов на сайте.
+    Класс отображает список всех проектов на сайте (по номерам страниц, с ?after= - курсорная пагинация).
     """
     model = Project
     paginate_by = 5
+    list_select_related = ('company',)
+    list_defer = rich_text_fields('', 'company__')
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -478,19 +699,49 @@ class ProjectListView(ListView):
         """
         Определяет список объектов модели Project, которые мы хотим отобразить.
         """
-        qs = Project.objects.order_by(self.get_ordering())
-        return qs
+        qs = Project.objects.with_status().order_by(project_ordering(self.get_ordering()))
+        return self.optimize_queryset(qs)
+
+
+class ProjectExportView(ExportMixin, ProjectListView):
+    """
+    Класс выгрузки списка проектов в CSV или XLSX с сортировкой списка (?sort=).
+    """
+    export_name = 'projects'
+    export_columns = (('Название проекта', 'name'), ('Компания', 'company__title'), ('Заказчик', 'customer__name'),
+                      ('Статус проекта', 'current_status'), ('Дата начала', 'start_date'),
+                      ('Дата окончания', 'end_date'), ('Стоимость', 'price'), ('Описание', 'description'))
+    export_html_fields = ('description',)
 
 
-class ProjectDetailView(DetailView):
+class ProjectDetailView(ConditionalDetailMixin, CachedObjectMixin, DetailView):
     """
     Класс отображает информацию по конкретному проекту по pk.
     """
     model = Project
     query_pk_and_slug = True
+    object_relations = ('company', 'customer__user')
+    modified_fields = ('updated_date', 'company__updated_date', 'start_date', 'end_date')
+    etag_fields = ('customer_id', 'customer__user_id', 'customer__user__first_name', 'customer__user__last_name')
+
+    def get_condition_dates(self, row):
+        """
+        Статус проекта вычисляется в момент запроса, поэтому наступившие даты начала и окончания
+        тоже считаются изменением страницы, а будущие - нет.
+        """
+        now = timezone.now()
+        return [date for date in super().get_condition_dates(row) if date <= now]
 
+    def get_object(self, queryset=None):
+        """
+        Добавляет к проекту статус, вычисленный в момент запроса.
+        """
+        project = super().get_object(queryset)
+        project.current_status = project.status_at(timezone.now())
+        return project
 
-class ProjectCustomerListView(ListView):
+
+class ProjectCustomerListView(ListQueryMixin, ListView):
     """
     Класс отображает список всех проектов,
     заказчиком которых является текущий пользователь со статусом - заказчик.
@@ -498,6 +749,9 @@ class ProjectCustomerListView(ListView):
     model = Project
     paginate_by = 5
     template_name = 'crm/customer_project_list.html'
+    list_select_related = ('company',)
+    list_defer = rich_text_fields('', 'company__')
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -521,13 +775,21 @@ class ProjectCustomerListView(ListView):
     def get_queryset(self):
         """
         Определяет список объектов модели Project, которые мы хотим отобразить.
+        Список ограничен проектами текущего пользователя и кэшируется для каждого заказчика и сортировки.
         """
         if self.request.user.is_authenticated:
-            qs = Project.objects.order_by(self.get_ordering())
-            return qs
+            ordering = self.get_ordering()
+            key = customer_projects_key(self.request.user.pk, ordering)
+            projects = cache.get(key)
+            if projects is None:
+                qs = Project.objects.filter(customer__user=self.request.user).with_status()\
+                    .order_by(project_ordering(ordering), 'pk')
+                projects = list(self.optimize_queryset(qs))
+                cache.set(key, projects, customer_projects_timeout(projects))
+            return projects
 
 
-class ProjectInteractionsDetailView(DetailView, MultipleObjectMixin):
+class ProjectInteractionsDetailView(ListQueryMixin, DetailView, MultipleObjectMixin):
     """
     Класс отображает список всех взаимодействий по конкретному проекту по pk.
     """
@@ -535,19 +797,22 @@ class ProjectInteractionsDetailView(DetailView, MultipleObjectMixin):
     paginate_by = 3
     query_pk_and_slug = True
     template_name = 'crm/project_interactions.html'
+    list_select_related = ('project__company', 'company', 'user')
+    list_defer = rich_text_fields('', 'project__', 'project__company__', 'company__')
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         """
         Возвращает словарь, представляющий контекст шаблона.
         Приведенные аргументы ключевого слова составят возвращаемый контекст.
         """
-        object_list = Interaction.objects.filter(project=self.object)
+        object_list = self.optimize_queryset(Interaction.objects.filter(project=self.object))
         context = super(ProjectInteractionsDetailView, self).get_context_data(object_list=object_list, **kwargs)
         context['current_order'] = self.get_ordering()
         return context
 
 
-class CompanyProjectInteractionsDetailView(DetailView, MultipleObjectMixin):
+class CompanyProjectInteractionsDetailView(ListQueryMixin, DetailView, MultipleObjectMixin):
     """
     Класс отображает список всех взаимодействий c конкретномой компанией по pk.
     """
@@ -555,24 +820,27 @@ class CompanyProjectInteractionsDetailView(DetailView, MultipleObjectMixin):
     paginate_by = 3
     query_pk_and_slug = True
     template_name = 'crm/company_interactions.html'
+    list_select_related = ('project__company', 'company', 'user')
+    list_defer = rich_text_fields('', 'project__', 'project__company__', 'company__')
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         """
         Возвращает словарь, представляющий контекст шаблона.
         Приведенные аргументы ключевого слова составят возвращаемый контекст.
         """
-        object_list = Interaction.objects.filter(company=self.object)
+        object_list = self.optimize_queryset(Interaction.objects.filter(company=self.object))
         context = super(CompanyProjectInteractionsDetailView, self).get_context_data(object_list=object_list, **kwargs)
         context['current_order'] = self.get_ordering()
         return context
 
 
-class ProjectCreateView(CreateView):
+class ProjectCreateView(ConstraintErrorMixin, CreateView):
     """
     Класс создания записи о новом проекте.
     """
     model = Project
-    fields = ['company', 'name', 'customer', 'description', 'start_date', 'end_date', 'price']
+    form_class = ProjectModelForm
 
     def get_context_data(self, **kwargs):
         """
@@ -583,12 +851,12 @@ class ProjectCreateView(CreateView):
         return context
 
 
-class ProjectUpdateView(UpdateView):
+class ProjectUpdateView(ConstraintErrorMixin, UpdateView):
     """
     Класс редаактированния записи о проекте на сайте.
     """
     model = Project
-    fields = ['company', 'name', 'customer', 'description', 'start_date', 'end_date', 'price']
+    form_class = ProjectModelForm
     template_name_suffix = '_update'
 
 
@@ -601,75 +869,15 @@ class ProjectDeleteView(DeleteView):
     success_url = reverse_lazy('companies')
 
 
-class ProjectInteractionsPhonesDetailView(DetailView, MultipleObjectMixin):
+class InteractionListView(ListQueryMixin, CursorPaginationMixin, ListView):
     """
-    Класс отображает список взаимодействий по проекту с каналом связи - Телефонный звонок.
-    """
-    model = Project
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/projectinteractions_detail_phones.html'
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        object_list = Interaction.objects.filter(project=self.object)
-        context = super(ProjectInteractionsPhonesDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class ProjectInteractionsEmailDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список взаимодействий по проекту с каналом связи - Переписка по E-mail.
-    """
-    model = Project
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/projectinteractions_detail_email.html'
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        object_list = Interaction.objects.filter(project=self.object)
-        context = super(ProjectInteractionsEmailDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class ProjectInteractionsMessengerDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список взаимодействий по проекту с каналом связи - Переписка в мессенджере.
-    """
-    model = Project
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/projectinteractions_detail_messenger.html'
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        object_list = Interaction.objects.filter(project=self.object)
-        context = super(ProjectInteractionsMessengerDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class InteractionListView(ListView):
-    """
-    Класс отображает список всех взаимодействий на сайте.
+    Класс отображает список всех взаимодействий на сайте (по номерам страниц, с ?after= - курсорная пагинация).
     """
     model = Interaction
     paginate_by = 5
+    list_select_related = ('project__company', 'company', 'user')
+    list_defer = rich_text_fields('', 'project__', 'project__company__', 'company__')
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -693,10 +901,22 @@ class InteractionListView(ListView):
         Определяет список объектов модели Interaction, которые мы хотим отобразить.
         """
         qs = Interaction.objects.order_by(self.get_ordering())
-        return qs
+        return self.optimize_queryset(qs)
 
 
-class InteractionManagerCRMListView(ListView):
+class InteractionExportView(ExportMixin, InteractionListView):
+    """
+    Класс выгрузки списка взаимодействий в CSV или XLSX с сортировкой списка (?sort=).
+    """
+    export_name = 'interactions'
+    export_columns = (('Дата создания', 'created_date'), ('Канал связи', 'channel_of_reference'),
+                      ('Вид связи', 'reference_obj'), ('Проект', 'project__name'), ('Компания', 'company__title'),
+                      ('Заказчик', 'customer__name'), ('Менеджер', 'user__username'), ('Оценка', 'rating'),
+                      ('Описание', 'description'))
+    export_html_fields = ('description',)
+
+
+class InteractionManagerCRMListView(ListQueryMixin, ListView):
     """
     Класс отображает список всех взаимодействий,
     автором которой является текущий пользователь со статусом - менеджер-CRM.
@@ -704,6 +924,9 @@ class InteractionManagerCRMListView(ListView):
     model = Interaction
     paginate_by = 5
     template_name = 'crm/manager_crm_interactions_list.html'
+    list_select_related = ('project__company', 'company', 'user')
+    list_defer = rich_text_fields('', 'project__', 'project__company__', 'company__')
+    query_budget = 4
 
     def get_context_data(self, *, object_list=None, **kwargs):
         """
@@ -729,75 +952,44 @@ class InteractionManagerCRMListView(ListView):
         """
         if self.request.user.is_authenticated:
             qs = Interaction.objects.order_by(self.get_ordering()).filter(user=self.request.user)
-            return qs
+            return self.optimize_queryset(qs)
 
 
-class InteractionDetailView(DetailView):
+class InteractionDetailView(ConditionalDetailMixin, CachedObjectMixin, DetailView):
     """
     Класс отображает информацию по конкретному взаимодействию по pk.
     """
     model = Interaction
     query_pk_and_slug = True
+    object_relations = ('project__company', 'project__customer__user', 'company', 'user')
+    modified_fields = ('updated_date', 'project__updated_date', 'project__company__updated_date',
+                       'company__updated_date')
+    etag_fields = ('project__customer_id', 'project__customer__user__first_name',
+                   'project__customer__user__last_name', 'user_id', 'user__first_name', 'user__last_name')
 
 
-class CompanyInteractionsPhonesDetailView(DetailView, MultipleObjectMixin):
+class InteractionsChannelDetailView(ListQueryMixin, DetailView, MultipleObjectMixin):
     """
-    Класс отображает список взаимодействий с компанией имеющих канал связи - Телефонный звонок.
+    Класс отображает список взаимодействий с компанией или по проекту (model) с заданным каналом связи.
+    Модель, канал связи (channel_of_reference) и шаблон передаются через as_view() в urls.py,
+    фильтрация по каналу связи выполняется в базе данных.
     """
-    model = Company
     paginate_by = 3
     query_pk_and_slug = True
-    template_name = 'crm/companyinteractions_detail_phones.html'
+    channel_of_reference = None
+    list_select_related = ('project__company', 'company', 'user')
+    list_defer = rich_text_fields('', 'project__', 'project__company__', 'company__')
+    query_budget = 5
 
     def get_context_data(self, **kwargs):
         """
         Возвращает словарь, представляющий контекст шаблона.
         Приведенные аргументы ключевого слова составят возвращаемый контекст.
         """
-        object_list = Interaction.objects.filter(company=self.object)
-        context = super(CompanyInteractionsPhonesDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class CompanyInteractionsEmailDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список взаимодействий с компанией имеющих канал связи - Переписка по E-mail.
-    """
-    model = Company
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/companyinteractions_detail_email.html'
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        object_list = Interaction.objects.filter(company=self.object)
-        context = super(CompanyInteractionsEmailDetailView, self).get_context_data(object_list=object_list, **kwargs)
-        context['current_order'] = self.get_ordering()
-        context['form'] = CompanyModelForm()
-        return context
-
-
-class CompanyInteractionsMessengerDetailView(DetailView, MultipleObjectMixin):
-    """
-    Класс отображает список взаимодействий с компанией имеющих канал связи - Переписка в мессенджере.
-    """
-    model = Company
-    paginate_by = 3
-    query_pk_and_slug = True
-    template_name = 'crm/companyinteractions_detail_messenger.html'
-
-    def get_context_data(self, **kwargs):
-        """
-        Возвращает словарь, представляющий контекст шаблона.
-        Приведенные аргументы ключевого слова составят возвращаемый контекст.
-        """
-        object_list = Interaction.objects.filter(company=self.object)
-        context = super(CompanyInteractionsMessengerDetailView, self).get_context_data(object_list=object_list, **kwargs)
+        object_list = self.optimize_queryset(
+            Interaction.objects.filter(**{self.model._meta.model_name: self.object},
+                                       channel_of_reference=self.channel_of_reference).order_by('-created_date', '-pk'))
+        context = super(InteractionsChannelDetailView, self).get_context_data(object_list=object_list, **kwargs)
         context['current_order'] = self.get_ordering()
         context['form'] = CompanyModelForm()
         return context
@@ -845,9 +1037,166 @@ class InteractionDeleteView(DeleteView):
     success_url = reverse_lazy('interactions')
 
 
+class RevenueSummaryListView(ListQueryMixin, ListView):
+    """
+    Класс отображает сводку выручки по компаниям, статусам проектов и месяцам (RevenueSummary).
+    Фильтры: ?company=<pk>, ?status=<статус>, ?year=<год>.
+    """
+    model = RevenueSummary
+    paginate_by = 20
+    template_name = 'crm/revenue_summary_list.html'
+    list_select_related = ('company',)
+    list_defer = rich_text_fields('company__')
+    query_budget = 4
+    filter_params = ('company', 'status', 'year')
+
+    def get_filters(self):
+        """
+        Возвращает словарь фильтров из параметров запроса, отбрасывая пустые и неверные значения.
+        """
+        filters = {name: self.request.GET.get(name, '').strip() for name in self.filter_params}
+        for name in ('company', 'year'):
+            if not filters[name].isdigit():
+                filters[name] = ''
+        return {name: value for name, value in filters.items() if value}
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """
+        Возвращает словарь, представляющий контекст шаблона.
+        Приведенные аргументы ключевого слова составят возвращаемый контекст.
+        """
+        context = super(RevenueSummaryListView, self).get_context_data(**kwargs)
+        context['filters'] = self.get_filters()
+        context['filter_query'] = urlencode(context['filters'])
+        context['statuses'] = (Project.status_not_started, Project.status_in_process, Project.status_completed)
+        return context
+
+    def get_queryset(self):
+        """
+        Определяет список строк сводки выручки, которые мы хотим отобразить.
+        """
+        filters = self.get_filters()
+        qs = RevenueSummary.objects.all()
+        if 'company' in filters:
+            qs = qs.filter(company_id=filters['company'])
+        if 'status' in filters:
+            qs = qs.filter(status_pro=filters['status'])
+        if 'year' in filters:
+            qs = qs.filter(month__year=filters['year'])
+        return self.optimize_queryset(qs)
+
+
+class SearchView(ListQueryMixin, ListView):
+    """
+    Класс отображает результаты полнотекстового поиска (?q=) по компаниям, проектам и взаимодействиям,
+    от более к менее релевантным. Взаимодействия ищутся только для менеджеров и администраторов,
+    проекты для остальных пользователей - только собственные проекты заказчика: описание проекта
+    (и выдержка из него в результатах) видно только им (project_detail.html).
+    """
+    paginate_by = 10
+    template_name = 'crm/search.html'
+    context_object_name = 'document_list'
+    query_budget = 4
+
+    def get_query(self):
+        """
+        Возвращает текст поискового запроса.
+        """
+        return self.request.GET.get('q', '').strip()
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+        """
+        Возвращает словарь, представляющий контекст шаблона.
+        Приведенные аргументы ключевого слова составят возвращаемый контекст.
+        """
+        context = super(SearchView, self).get_context_data(**kwargs)
+        context['query'] = self.get_query()
+        context['filter_query'] = urlencode({'q': context['query']})
+        return context
+
+    def get_queryset(self):
+        """
+        Определяет список найденных поисковых документов.
+        """
+        user = self.request.user
+        kinds = [SearchDocument.kind_company, SearchDocument.kind_project]
+        if user.is_authenticated and (user.is_manager or user.is_admin):
+            return search(self.get_query(), kinds + [SearchDocument.kind_interaction])
+        own_projects = Project.objects.filter(customer__user=user).values('pk') if user.is_authenticated \
+            else Project.objects.none().values('pk')
+        return search(self.get_query(), kinds).filter(
+            ~Q(kind=SearchDocument.kind_project) | Q(object_id__in=own_projects))
+
+
+class TypeaheadView(View):
+    """
+    Класс отвечает JSON-подсказками (?q=, ?limit=) по названиям компаний и проектов и именам заказчиков
+    и CRM-менеджеров из индекса в памяти процесса (crm.typeahead), не обращаясь к базе данных за данными.
+    Заказчики видны только менеджерам и администраторам, анонимному пользователю - только компании.
+    """
+    max_limit = 20
+    detail_urls = {'company': 'company-detail', 'project': 'project-detail',
+                   'customer': 'customer_detail', 'manager_crm': 'manager_crm_detail'}
+
+    def get_kinds(self):
+        """
+        Возвращает типы объектов, которые видит текущий пользователь.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return ['company']
+        if user.is_manager or user.is_admin:
+            return ['company', 'project', 'customer', 'manager_crm']
+        return ['company', 'project', 'manager_crm']
+
+    def get(self, request, *args, **kwargs):
+        """
+        Возвращает {'results': [{'type', 'id', 'name', 'url'}, ...]}.
+        """
+        limit = request.GET.get('limit', '')
+        limit = min(int(limit), self.max_limit) if limit.isdigit() and int(limit) > 0 else 10
+        results = typeahead_index.search(request.GET.get('q', ''), self.get_kinds(), limit)
+        for result in results:
+            result['url'] = reverse(self.detail_urls[result['type']], args=[result['id']])
+        return JsonResponse({'results': results})
+
+
 class AboutPageDetailView(ListView):
     """
     Класс для отображения страницы о сайте - О нас.
     """
     model = Company
     template_name = 'crm/about_page.html'
+
+
+class ThumbnailView(View):
+    """
+    Класс отдает уменьшенную копию фотографии (crm.thumbnails) с кэшированием в браузере на год:
+    адрес копии меняется вместе с именем фотографии, поэтому содержимое по адресу не меняется.
+    Недостающая копия (фотография загружена в обход модели или до появления копий) создается
+    при первом запросе, но только для текущих фотографий пользователей и фотографии по умолчанию:
+    иначе любой запрос мог бы заставить сервер обрабатывать произвольные файлы хранилища.
+    """
+    max_age = 60 * 60 * 24 * 365
+
+    def get(self, request, name):
+        """
+        Возвращает файл копии name.
+        """
+        parsed = parse_thumbnail_name(name)
+        if parsed is None:
+            raise Http404('Неизвестная уменьшенная копия')
+        source, width, extension = parsed
+        path = thumbnail_name(source, width, extension)
+        try:
+            if not default_storage.exists(path):
+                is_photo = source == User._meta.get_field('photo').default or \
+                    User.objects.filter(photo=source).exists()
+                if not is_photo or not default_storage.exists(source):
+                    raise Http404('Фотография не найдена')
+                make_thumbnails(source)
+        except (SuspiciousFileOperation, OSError, ValueError, Image.DecompressionBombError):
+            raise Http404('Фотография не найдена')
+        response = FileResponse(default_storage.open(path), content_type=THUMBNAIL_FORMATS[extension][1])
+        patch_cache_control(response, public=True, max_age=self.max_age, immutable=True)
+        return response
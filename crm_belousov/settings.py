@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'crm.apps.CrmConfig',
     'ckeditor',
+    'ckeditor_uploader',
     'django_filters'
 ]
 
@@ -65,6 +66,14 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'crm_belousov.urls'
 
+# Sessions are written to the database and read from the shared cache; the session user
+# is loaded from the object cache (crm/auth.py), so a page view needs no session or user queries.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# ModelBackend stays listed after the cached backend: sessions created before it name ModelBackend
+# in BACKEND_SESSION_KEY and would otherwise be logged out. New logins use the cached backend.
+AUTHENTICATION_BACKENDS = ['crm.auth.CachedModelBackend', 'django.contrib.auth.backends.ModelBackend']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -94,6 +103,18 @@ DATABASES = {
     }
 }
 
+# Cache shared by all gunicorn workers on the box: an SQLite file in WAL mode (crm/sqlite_cache.py).
+CACHES = {
+    'default': {
+        'BACKEND': 'crm.sqlite_cache.SQLiteCache',
+        'LOCATION': os.environ.get('CRM_CACHE_PATH', str(BASE_DIR / 'cache.sqlite3')),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+# Tests run with the cache in a temporary file so that cache.clear() leaves the shared cache alone.
+TEST_RUNNER = 'crm.test_runner.TemporaryCacheRunner'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -146,7 +167,7 @@ CKEDITOR_CONFIGS = {
         'toolbar_Custom': [
             ['Bold', 'Italic', 'Underline'],
             ['NumberedList', 'BulletedList', '-', 'Outdent', 'Indent', '-', 'JustifyLeft', 'JustifyCenter', 'JustifyRight', 'JustifyBlock'],
-            ['Link', 'Unlink'],
+            ['Link', 'Unlink', 'Image'],
             ['RemoveFormat', 'Source']
         ]
     }
@@ -154,6 +175,9 @@ CKEDITOR_CONFIGS = {
 
 CKEDITOR_UPLOAD_PATH = "uploads/"
 
+# Images uploaded from CKEditor (staff only) are stored once per content (see crm.storage).
+CKEDITOR_STORAGE_BACKEND = 'crm.storage.ContentAddressedStorage'
+
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
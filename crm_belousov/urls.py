@@ -41,7 +41,13 @@ from crm.views import ProjectCreateView, \
     UserCustomerUpdateView, \
     InteractionManagerCRMListView, \
     AboutPageDetailView, \
-    ProjectCustomerListView
+    ProjectCustomerListView, \
+    RevenueSummaryListView, \
+    SearchView, \
+    TypeaheadView, \
+    ProjectExportView, \
+    InteractionExportView, \
+    ThumbnailView
 
 
 urlpatterns = [
@@ -52,8 +58,11 @@ urlpatterns += [
     path('companies/', CompanyListView.as_view(), name='companies'),
     path('about/', AboutPageDetailView.as_view(), name='about'),
     path('company/', include('crm.urls')),
+    path('api/v1/', include('crm.api_urls')),
+    path('ckeditor/', include('ckeditor_uploader.urls')),
 
     path('projects/', ProjectListView.as_view(), name='projects'),
+    path('projects/export/', ProjectExportView.as_view(), name='projects_export'),
     path('project/create/', ProjectCreateView.as_view(), name='project_create'),
 
 
@@ -72,12 +81,18 @@ urlpatterns += [
     path('customer/project_list/', ProjectCustomerListView.as_view(), name='customer_project_list'),
 
     path('interactions/', InteractionListView.as_view(), name='interactions'),
+    path('interactions/export/', InteractionExportView.as_view(), name='interactions_export'),
     path('interaction/<int:pk>/', InteractionDetailView.as_view(), name='interaction-detail'),
     path('interaction/create/', InteractionCreateView.as_view(), name='interaction_create'),
     path('interaction/<int:pk>/update/', InteractionUpdateView.as_view(), name='interaction_update'),
     path('interaction/<int:pk>/delete/', InteractionDeleteView.as_view(), name='interaction_delete'),
     path('user/interactions/', InteractionManagerCRMListView.as_view(), name='interaction_manager_crm'),
 
+    path('revenue/', RevenueSummaryListView.as_view(), name='revenue_summary'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('typeahead/', TypeaheadView.as_view(), name='typeahead'),
+    path(settings.MEDIA_URL.lstrip('/') + 'thumbnails/<path:name>', ThumbnailView.as_view(), name='thumbnail'),
+
 ]
 
 urlpatterns += [
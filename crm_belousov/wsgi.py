@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'crm_belousov.settings')
 
 application = get_wsgi_application()
+
+# Индекс подсказок строится при старте worker, а не на первом запросе пользователя.
+from crm.typeahead import warm_up  # noqa: E402
+
+warm_up()